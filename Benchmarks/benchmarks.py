@@ -0,0 +1,478 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##########
+## benchmarks.py Version 0.1
+##
+## License: MIT ( http://opensource.org/licenses/MIT )
+##
+##########
+
+"""
+Time the Uyghur tools on a reproducible synthetic corpus.
+
+Each benchmark generates its input from a seed (Uyghur text in every
+orthography of the transliterator's table, Latin word lists for the IPA
+transcriber, Wiktionary pages and lexicon rows for the scraper), then
+times one of the tools on it in a fresh process, recording throughput,
+peak memory and a checksum of the output. The results can be saved as a
+baseline, and later runs are compared with it: a benchmark that got
+slower, used more memory or produced different output is flagged.
+"""
+
+from __future__ import print_function
+
+import argparse
+import codecs
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+## the tools live in sibling directories of this one
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for tool in ("UyghurTransliterator", "IPATranscriber", "WiktionaryScraper"):
+    sys.path.insert(0, os.path.join(repository, tool))
+
+import uyghurtransliterator
+import ipatranscriber
+
+## the scraper needs BeautifulSoup
+try:
+    import wiktionaryscraper
+except ImportError:
+    wiktionaryscraper = None
+
+baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "baseline.json")
+
+## a benchmark is flagged if it got this much slower (or used this much
+## more memory) than its baseline
+DEFAULT_TOLERANCE = 0.2
+
+## phonemes (in the IPA column of uyghur_orthographies) that are vowels
+ipa_vowels = frozenset([u'a', u'ɑ', u'aː', u'ɛ', u'æ', u'e', u'i', u'ɨ',
+                        u'o', u'ø', u'u', u'ɯ', u'ʏ', u'y', u'yː', u'ŭ'])
+
+## words the generated definitions are made of
+english_words = (u"to", u"the", u"a", u"collect", u"gather", u"careful",
+                 u"respond", u"answer", u"remind", u"warn", u"angry",
+                 u"gently", u"water", u"house", u"road", u"of", u"person",
+                 u"quickly", u"bright", u"old", u"new", u"speak", u"write")
+
+
+class CorpusGenerator(object):
+    """Seeded generator of Uyghur-like text, word lists and pages.
+
+    Words are strings of phonemes (rows of uyghur_orthographies) made of
+    (C)V(C) syllables. The phonemes are chosen before they are written
+    out, so a seed gives the same words in every orthography (as far as
+    each orthography can write them).
+    """
+
+    def __init__(self, seed=0):
+        """Initialize a generator with a seed."""
+        self.seed = seed
+        rows = [row for row in uyghurtransliterator.uyghur_orthographies
+                if not isinstance(row[0], int)]
+        self.vowels = [row for row in rows if row[0] in ipa_vowels]
+        self.consonants = [row for row in rows if row[0] not in ipa_vowels]
+
+    def phoneme_words(self, count, salt=0):
+        """Return count words, each a list of rows of the table."""
+        rng = random.Random((self.seed, salt))
+        words = []
+        for _ in range(count):
+            word = []
+            for _ in range(rng.choice((1, 2, 2, 2, 3, 3, 4))):
+                if rng.random() < 0.7:
+                    word.append(rng.choice(self.consonants))
+                word.append(rng.choice(self.vowels))
+                if rng.random() < 0.4:
+                    word.append(rng.choice(self.consonants))
+            words.append(word)
+        return words
+
+    def words(self, count, orth):
+        """Return count words written in orth."""
+        column = uyghurtransliterator.orth_index(orth)
+        return [u"".join(row[column] for row in word
+                         if not isinstance(row[column], int))
+                for word in self.phoneme_words(count)]
+
+    def text(self, length, orth):
+        """Return about length characters of text written in orth.
+
+        Words are grouped into sentences and paragraphs; in orthographies
+        with case, sentences start with a capital.
+        """
+        rng = random.Random((self.seed, "text"))
+        cased = orth not in uyghurtransliterator.caseless_orths
+        words = self.words(max(1, length // 5), orth)
+        parts = []
+        total = 0
+        position = 0
+        while total < length:
+            sentence = []
+            for _ in range(rng.randint(4, 16)):
+                sentence.append(words[position % len(words)])
+                position += 1
+            if cased:
+                sentence[0] = sentence[0][:1].upper() + sentence[0][1:]
+            sentence = u" ".join(sentence) + rng.choice(u"..?!,")
+            sentence += u"\n" if rng.random() < 0.2 else u" "
+            parts.append(sentence)
+            total += len(sentence)
+        return u"".join(parts)[:length]
+
+    def mandarin_terms(self, count):
+        """Return count distinct made-up Mandarin terms."""
+        rng = random.Random((self.seed, "mandarin"))
+        terms = set()
+        while len(terms) < count:
+            terms.add(u"".join(unichr(rng.randint(0x4E00, 0x9FA5))
+                               for _ in range(rng.choice((1, 2, 2, 3)))))
+        return sorted(terms)
+
+    def definitions(self, rng):
+        """Return a few made-up English definitions."""
+        return [u" ".join(rng.choice(english_words)
+                          for _ in range(rng.randint(1, 5)))
+                for _ in range(rng.randint(1, 4))]
+
+    def pages(self, count):
+        """Return count Wiktionary-like pages (UTF-8 HTML).
+
+        Each page has several language sections with tables and lists, one
+        of them Chinese, as on en.wiktionary.org.
+        """
+        rng = random.Random((self.seed, "pages"))
+        pages = []
+        for term in self.mandarin_terms(count):
+            languages = [u"Language%d" % number
+                         for number in range(rng.randint(2, 12))]
+            languages.insert(rng.randint(0, len(languages)), u"Chinese")
+            sections = []
+            for language in languages:
+                definitions = self.definitions(rng)
+                if language != u"Chinese":
+                    definitions = definitions * rng.randint(1, 6)
+                sections.append(
+                    u'<h2><span class="mw-headline" id="%s">%s</span></h2>'
+                    u'<table class="wikitable">%s</table>'
+                    u'<h3><span class="mw-headline" id="Noun">Noun</span>'
+                    u'</h3><p><strong>%s</strong></p>\n<ol>\n%s</ol>\n' % (
+                        language, language,
+                        u"".join(u'<tr><td><a href="/wiki/%s">%s</a></td>'
+                                 u'</tr>' % (word, word)
+                                 for word in definitions[0].split()) * 5,
+                        term,
+                        u"".join(u"<li>%s\n<dl><dd>example</dd></dl></li>\n"
+                                 % definition
+                                 for definition in definitions)))
+            pages.append((u"<html><head><title>%s</title></head><body>%s"
+                          u"</body></html>" % (term, u"".join(sections))
+                          ).encode("utf-8"))
+        return pages
+
+    def lexicon(self, count):
+        """Return count lexicon rows and the definitions of their terms.
+
+        Rows are in the scraper's input format; terms recur across rows,
+        and about two thirds of them have definitions.
+        """
+        rng = random.Random((self.seed, "lexicon"))
+        terms = self.mandarin_terms(max(1, count // 3))
+        definitions = dict((term, self.definitions(rng)) for term in terms
+                           if rng.random() < 0.67)
+        rows = [u"Index,Chinese\n"]
+        for index in range(count):
+            cell = u"；".join(rng.choice(terms)
+                              for _ in range(rng.choice((0, 1, 1, 1, 2))))
+            rows.append(u"%d,%s\n" % (index, cell))
+        return rows, definitions
+
+
+def bench_transliterate(generator, size, input_orth, output_orth):
+    """Transliterate a text; counts characters."""
+    text = generator.text(int(1000000 * size), input_orth)
+    uyghurtransliterator.get_transducer(input_orth, output_orth)
+    started = time.time()
+    output = uyghurtransliterator.transliterate(text, input_orth,
+                                                output_orth)
+    return len(text), time.time() - started, [output]
+
+def bench_transliterate_many(generator, size, input_orth, output_orth):
+    """Transliterate a list of words; counts words."""
+    words = generator.words(int(200000 * size), input_orth)
+    uyghurtransliterator.get_transducer(input_orth, output_orth)
+    started = time.time()
+    output = uyghurtransliterator.transliterate_many(words, input_orth,
+                                                     output_orth)
+    return len(words), time.time() - started, output
+
+def bench_ipa(generator, size):
+    """Transcribe Latin words one at a time; counts words."""
+    words = generator.words(int(200000 * size), "UyLatin")
+    started = time.time()
+    output = [ipatranscriber.uyghur_latin_to_ipa(word) for word in words]
+    return len(words), time.time() - started, output
+
+def bench_ipa_many(generator, size):
+    """Transcribe a list of Latin words together; counts words."""
+    words = generator.words(int(200000 * size), "UyLatin")
+    started = time.time()
+    output = ipatranscriber.uyghur_latin_to_ipa_many(words)
+    return len(words), time.time() - started, output
+
+def bench_scraper_parse(generator, size, pages_dir=None):
+    """Extract definitions from Wiktionary pages; counts pages."""
+    if pages_dir is not None:
+        pages = []
+        for name in sorted(os.listdir(pages_dir)):
+            with open(os.path.join(pages_dir, name), "rb") as page:
+                pages.append(page.read())
+    else:
+        pages = generator.pages(int(200 * size))
+    started = time.time()
+    output = [u"\n".join(wiktionaryscraper.html_definitions(
+                  wiktionaryscraper.chinese_html(page)))
+              for page in pages]
+    return len(pages), time.time() - started, output
+
+def bench_scraper_rows(generator, size):
+    """Gloss lexicon rows from a dump index; counts rows."""
+    rows, definitions = generator.lexicon(int(20000 * size))
+    directory = tempfile.mkdtemp()
+    try:
+        index = wiktionaryscraper.DumpIndex(
+            os.path.join(directory, "index.sqlite"))
+        index._insert([(term, u"\n".join(term_definitions), None)
+                       for term, term_definitions in definitions.items()])
+        resolver = wiktionaryscraper.TermResolver(
+            wiktionaryscraper.IndexBackend(index))
+        output_path = os.path.join(directory, "output.txt")
+        ## the scraper prints a line per term looked up
+        wiktionaryscraper.show_progress = False
+        try:
+            started = time.time()
+            with codecs.open(output_path, "w", encoding="utf-8") as stream:
+                count = wiktionaryscraper.crawl(
+                    wiktionaryscraper.read_rows(rows), stream, resolver)
+            elapsed = time.time() - started
+        finally:
+            wiktionaryscraper.show_progress = True
+        index.close()
+        with codecs.open(output_path, encoding="utf-8") as output:
+            return count, elapsed, [output.read()]
+    finally:
+        shutil.rmtree(directory)
+
+def list_benchmarks(pages_dir=None):
+    """Return (name, unit, function, arguments) for every benchmark."""
+    benchmarks = []
+    for orth in sorted(uyghurtransliterator.orth_key,
+                       key=uyghurtransliterator.orth_index):
+        output_orth = "IPA" if orth == "UyLatin" else "UyLatin"
+        benchmarks.append(("transliterate %s>%s" % (orth, output_orth),
+                           "chars", bench_transliterate,
+                           (orth, output_orth)))
+    benchmarks.append(("transliterate_many UyLatin>UyCyrillic", "words",
+                       bench_transliterate_many, ("UyLatin", "UyCyrillic")))
+    benchmarks.append(("uyghur_latin_to_ipa", "words", bench_ipa, ()))
+    benchmarks.append(("uyghur_latin_to_ipa_many", "words", bench_ipa_many,
+                       ()))
+    if wiktionaryscraper is not None:
+        benchmarks.append(("scraper parse", "pages", bench_scraper_parse,
+                           (pages_dir,)))
+        benchmarks.append(("scraper rows", "rows", bench_scraper_rows, ()))
+    return benchmarks
+
+def checksum(output):
+    """Return an MD5 checksum of a list of output strings."""
+    digest = hashlib.md5()
+    for text in output:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+def _run_child(connection, function, arguments, seed, size, repeat):
+    """Run a benchmark repeat times and send back its result."""
+    try:
+        generator = CorpusGenerator(seed)
+        best = None
+        for _ in range(repeat):
+            count, seconds, output = function(generator, size, *arguments)
+            best = seconds if best is None else min(best, seconds)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        connection.send({"count": count, "seconds": best,
+                         "rate": count / best if best else None,
+                         "peak_kb": peak, "checksum": checksum(output)})
+    except Exception as e:
+        connection.send({"error": "%s: %s" % (type(e).__name__, e)})
+    connection.close()
+
+def run_benchmark(name, unit, function, arguments, seed=0, size=1.0,
+                  repeat=3):
+    """Run a benchmark in a new process and return its result (a dict).
+
+    The best time of repeat runs is kept; peak memory is the most the
+    process running the benchmark ever used, which includes generating
+    the corpus, not only the timed call. A process that dies without a
+    result (e.g. killed for running out of memory) gives an error.
+    """
+    receiver, sender = multiprocessing.Pipe(False)
+    child = multiprocessing.Process(
+        target=_run_child,
+        args=(sender, function, arguments, seed, size, repeat))
+    child.start()
+    ## only the child holds the sending end now, so recv() raises EOFError
+    ## rather than waiting forever if the child dies
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    receiver.close()
+    child.join()
+    if result is None:
+        result = {"error": "benchmark process died (exit code %s)" % (
+            child.exitcode)}
+    result.update({"name": name, "unit": unit})
+    return result
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return a list of (name, problem) for results worse than baseline."""
+    baseline = dict((result["name"], result) for result in baseline)
+    problems = []
+    for result in results:
+        if "error" in result:
+            problems.append((result["name"], result["error"]))
+            continue
+        before = baseline.get(result["name"])
+        if before is None or "error" in before:
+            continue
+        if result["checksum"] != before["checksum"]:
+            problems.append((result["name"], "output changed"))
+        ## (a run too quick to time has no rate)
+        if result["rate"] is not None and before["rate"] is not None and \
+                result["rate"] < before["rate"] * (1 - tolerance):
+            problems.append((result["name"], "%.0f%% slower" % (
+                100 * (1 - result["rate"] / before["rate"]))))
+        if result["peak_kb"] > before["peak_kb"] * (1 + tolerance):
+            problems.append((result["name"], "%.0f%% more memory" % (
+                100 * (result["peak_kb"] / float(before["peak_kb"]) - 1))))
+    return problems
+
+def format_result(result, before=None):
+    """Return a line of the results table."""
+    if "error" in result:
+        return "%-40s %s" % (result["name"], result["error"])
+    if result["rate"] is None:
+        rate = "%12s" % "-"
+    else:
+        rate = "%12.0f" % result["rate"]
+    line = "%-40s %s %-7s %8.1f MB" % (
+        result["name"], rate, result["unit"] + "/s",
+        result["peak_kb"] / 1024.0)
+    if before is not None and "error" not in before and \
+            result["rate"] is not None and before["rate"] is not None:
+        line += "  %+6.1f%%" % (100 * (result["rate"] / before["rate"] - 1))
+    return line
+
+def main(only=None, seed=0, size=1.0, repeat=3, baseline_path=baseline_file,
+         save_baseline=False, tolerance=DEFAULT_TOLERANCE, json_path=None,
+         pages_dir=None):
+    """Run the benchmarks (those whose name contains only, if given).
+
+    The results are compared with the baseline in baseline_path, if there
+    is one, or saved there with save_baseline. Returns the number of
+    problems found.
+    """
+    baseline = []
+    if os.path.exists(baseline_path) and not save_baseline:
+        with open(baseline_path) as stream:
+            baseline = json.load(stream)["results"]
+    previous = dict((result["name"], result) for result in baseline)
+
+    results = []
+    for name, unit, function, arguments in list_benchmarks(pages_dir):
+        if only is not None and only not in name:
+            continue
+        result = run_benchmark(name, unit, function, arguments, seed, size,
+                               repeat)
+        print(format_result(result, previous.get(name)))
+        results.append(result)
+
+    report = {"seed": seed, "size": size, "repeat": repeat,
+              "python": sys.version.split()[0], "time": time.time(),
+              "results": results}
+    if json_path is not None:
+        with open(json_path, "w") as stream:
+            json.dump(report, stream, indent=2, sort_keys=True)
+    if save_baseline:
+        with open(baseline_path, "w") as stream:
+            json.dump(report, stream, indent=2, sort_keys=True)
+        print("Baseline saved to %s" % baseline_path)
+        return 0
+
+    problems = compare(results, baseline, tolerance)
+    for name, problem in problems:
+        print("REGRESSION %s: %s" % (name, problem))
+    return len(problems)
+
+def save_pages(directory, seed=0, size=1.0):
+    """Write the generated Wiktionary pages to directory."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    pages = CorpusGenerator(seed).pages(int(200 * size))
+    for number, page in enumerate(pages):
+        with open(os.path.join(directory, "page%04d.html" % number),
+                  "wb") as stream:
+            stream.write(page)
+    return len(pages)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=("Time the Uyghur tools on a synthetic corpus and "
+                     "compare the results with a saved baseline."))
+    parser.add_argument('--only', metavar='TEXT',
+                        help="only run benchmarks whose name contains TEXT")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of the corpus (default: %(default)s)")
+    parser.add_argument('--size', type=float, default=1.0,
+                        help=("scale of the corpus, 1 being e.g. a million "
+                              "characters of text (default: %(default)s)"))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help=("runs of each benchmark, the best of which "
+                              "counts (default: %(default)s)"))
+    parser.add_argument('--baseline', default=baseline_file,
+                        help="baseline file (default: %(default)s)")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="save the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=("slowdown (or extra memory) allowed before a "
+                              "benchmark is flagged, as a fraction "
+                              "(default: %(default)s)"))
+    parser.add_argument('--json', metavar='FILE',
+                        help="also write the results to FILE")
+    parser.add_argument('--pages', metavar='DIR',
+                        help=("time the scraper on the pages saved in DIR "
+                              "instead of generated ones"))
+    parser.add_argument('--save-pages', metavar='DIR',
+                        help="write the generated pages to DIR and exit")
+    args = parser.parse_args()
+    if args.save_pages:
+        print("%d pages written to %s" % (
+            save_pages(args.save_pages, args.seed, args.size),
+            args.save_pages))
+        sys.exit(0)
+    sys.exit(1 if main(args.only, args.seed, args.size, args.repeat,
+                       args.baseline, args.save_baseline, args.tolerance,
+                       args.json, args.pages) else 0)
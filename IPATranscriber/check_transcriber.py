@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Check the single-scan transcriber against the replace loop it replaced.
+
+legacy_latin_to_ipa() is uyghur_latin_to_ipa() as it was before the
+pairs were compiled into one scan: one replace pass per pair, then one
+per consonant to strip the aspiration before it. Random words, made of
+the orthography's graphemes, punctuation and IPA characters, must be
+transcribed the same by both, and lists of them the same by
+uyghur_latin_to_ipa_many() (with NumPy and the transliterator's
+helpers, if NumPy is installed) as one by one. Run with
+`python check_transcriber.py`.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import random
+import sys
+import unittest
+
+## the NumPy transcription is built from the transliterator's, which
+## lives in a sibling directory of this one
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repository, "UyghurTransliterator"))
+
+import ipatranscriber as it
+
+## random words to transcribe
+WORDS = 200000
+
+
+def legacy_latin_to_ipa(word):
+    """Return broad IPA transcription of a Uyghur word in Latin orthography."""
+
+    ## new_word will be the output. start by setting it equal to the input
+    new_word = word
+
+    ## first replace the diagraphs
+    for char in it.uyghur_multiples.keys():
+        new_word = new_word.replace(char, it.uyghur_multiples[char])
+
+    ## then the single characters
+    for char in it.uyghur_singles.keys():
+        new_word = new_word.replace(char, it.uyghur_singles[char])
+
+    ## then y
+    for char in it.uyghur_y.keys():
+        new_word = new_word.replace(char, it.uyghur_y[char])
+
+    ## then j
+    for char in it.uyghur_u.keys():
+        new_word = new_word.replace(char, it.uyghur_u[char])
+
+    ## create a list of aspiration ("ʰ") + consonant sequences
+    sequences = ["ʰ" + consonant for consonant in it.consonants]
+
+    ## replace sequences of ʰ + consonant with the plain consonant
+    for sequence in sequences:
+        new_word = new_word.replace(sequence, sequence[1:])
+
+    ## output the word in IPA transcription
+    return new_word
+
+
+def random_words(rng, count, length=12):
+    """Return count random words of up to length graphemes."""
+    pieces = (list(it.uyghur_multiples) + list(it.uyghur_singles) +
+              list(it.uyghur_y) + list(it.uyghur_u) + it.consonants +
+              list("aiouhlmnrsw-ʰ ") + ["A", "Ch", "ŋ"])
+    return ["".join(rng.choice(pieces) for _ in range(rng.randint(0, length)))
+            for _ in range(count)]
+
+
+class TranscriberTest(unittest.TestCase):
+
+    def test_docstring_examples(self):
+        for word, ipa in [("yéziliq", "jeziliqʰ"), ("zeple-", "zɛplɛ-"),
+                          ("yashliq", "jaʃliqʰ"), ("a'ile", "aˀilɛ")]:
+            self.assertEqual(it.uyghur_latin_to_ipa(word), ipa)
+            self.assertEqual(legacy_latin_to_ipa(word), ipa)
+
+    def test_random_words(self):
+        for word in random_words(random.Random(7), WORDS):
+            self.assertEqual(it.uyghur_latin_to_ipa(word),
+                             legacy_latin_to_ipa(word), repr(word))
+
+    def test_many_words(self):
+        if it.numpy is not None:
+            self.assertIsNotNone(it._compile_vector_tables())
+        rng = random.Random(10)
+        for _ in range(100):
+            ## with a character past the tables, and a word holding the
+            ## separator now and then
+            words = random_words(rng, 500)
+            words += ["中", "x\x00y"][:rng.randint(0, 2)]
+            self.assertEqual(it.uyghur_latin_to_ipa_many(words),
+                             [it.uyghur_latin_to_ipa(word) for word in words])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -54,12 +54,36 @@ The IPA output is largely a one-to-one substitution of graphs or digraphs for
 their phonemic values, with the exception that aspiration is blocked consonants.
 """
 
-from __future__ import unicode_literals
+from __future__ import print_function, unicode_literals
+import argparse
 import codecs
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 ## our Uyghur word list
 input_file = "uyghuritems.txt"
 
+## number of distinct words whose transcriptions are remembered when
+## transcribing a stream of words
+DEFAULT_MEMO_SIZE = 100000
+
+## size of the output buffer, and number of lines joined into each write
+BUFFER_SIZE = 1 << 20
+LINES_PER_WRITE = 4096
+
 ## orthography/IPA pairs in which one or both members are digraphs
 uyghur_multiples = {
     "ch": "ʧʰ",
@@ -91,8 +115,9 @@ uyghur_singles = {
     "'": "ˀ"
     }
 
-## y and j get treated separately, since both symbols are input of one process
-## and output of another (i.e., otherwise, we'd get ʤ as output when we want j)
+## y and ü are listed separately, since both symbols are the input of one pair
+## and the output of another (the single-scan transcriber below never rewrites
+## its own output, so y becomes j, not ʤ)
 uyghur_y = {
     "y": "j"
     }
@@ -101,61 +126,484 @@ uyghur_u = {
     "ü": "y"
     }
 
+## list of Uyghur consonants (from "uigCLpixzd2ipa.xsl")
+consonants = [
+    "b", "d", "g", "ɣ", "h", "χ", "ʤ", "k", "q", "l", "ɫ", "m", "n",
+    "ŋ", "p", "r", "s", "ʃ", "t", "ʧ", "w", "j", "z", "ʒ"
+    ]
+
+## aspiration is blocked before consonants
+aspiration = "ʰ"
+
+def _compile_transcriber():
+    """Compile the orthography/IPA pairs into a single-scan transcriber.
+
+    Returns a regular expression and three tables. The expression splits a
+    word at its multi-character graphemes and at the graphemes whose IPA
+    ends in aspiration; for the latter, a second group captures the
+    following grapheme if its IPA begins with a consonant, i.e. if the
+    aspiration is blocked. The text between matches is transcribed with
+    unicode.translate().
+    """
+    pairs = {}
+    for table in (uyghur_multiples, uyghur_singles, uyghur_y, uyghur_u):
+        pairs.update(table)
+    ## an aspiration mark in the input is blocked like any other
+    pairs[aspiration] = aspiration
+
+    def longest_first(graphemes):
+        return sorted(graphemes, key=lambda grapheme: (-len(grapheme),
+                                                       grapheme))
+
+    def alternation(graphemes):
+        return "|".join(re.escape(grapheme)
+                        for grapheme in longest_first(graphemes))
+
+    aspirated = [grapheme for grapheme, ipa in pairs.items()
+                 if ipa.endswith(aspiration)]
+    multiples = [grapheme for grapheme in pairs
+                 if len(grapheme) > 1 and grapheme not in aspirated]
+    ## the aspirated graphemes are tried first, which is only a longest
+    ## match as long as no other grapheme begins with one of them
+    for grapheme in pairs:
+        for prefix in aspirated:
+            if grapheme != prefix and grapheme.startswith(prefix):
+                raise ValueError("%s extends aspirated %s" % (grapheme,
+                                                              prefix))
+
+    ## graphemes whose IPA begins with a consonant, and consonants that
+    ## are their own IPA
+    blocking = ([grapheme for grapheme, ipa in pairs.items()
+                 if ipa[:1] in consonants] +
+                [consonant for consonant in consonants
+                 if consonant not in pairs])
+
+    pattern = "((?:%s)(?=(%s))|%s)" % (alternation(aspirated),
+                                       alternation(blocking),
+                                       alternation(aspirated + multiples))
+    singles = dict((ord(grapheme), ipa) for grapheme, ipa in pairs.items()
+                   if len(grapheme) == 1 and grapheme not in aspirated)
+    blocked = dict((grapheme, pairs[grapheme][:-len(aspiration)])
+                   for grapheme in aspirated)
+    return re.compile(pattern), singles, pairs, blocked
+
+_transcriber, _ipa_singles, _ipa_pairs, _ipa_blocked = _compile_transcriber()
+
+## rule-level profile of every transcription (a TranscriptionProfile), or
+## None when transcriptions aren't profiled
+profile = None
+
+def rules_version():
+    """Return a hash of the orthography/IPA pairs and the consonants.
+
+    It changes whenever one of the tables above does, so transcriptions made
+    with other tables can be told apart.
+    """
+    rules = [sorted(table.items()) for table in (uyghur_multiples,
+                                                 uyghur_singles,
+                                                 uyghur_y, uyghur_u)]
+    rules.append(consonants)
+    rules.append(aspiration)
+    return hashlib.sha1(json.dumps(rules)).hexdigest()
+
 def uyghur_latin_to_ipa(word):
     """Return broad IPA transcription of a Uyghur word in Latin orthography."""
+    if profile is not None:
+        return profile.transcribe(word)
 
-    ## new_word will be the output. start by setting it equal to the input
-    new_word = word
+    ## split the word at its multi-character and aspirated graphemes:
+    ## parts[0::3] is the text between them, parts[1::3] the graphemes, and
+    ## parts[2::3] the following grapheme if it blocks aspiration (or None)
+    parts = _transcriber.split(word)
 
-    ## first replace the diagraphs
-    for char in uyghur_multiples.keys():
-        new_word = new_word.replace(char, uyghur_multiples[char])
+    new_word = parts[:]
+    new_word[0::3] = [part.translate(_ipa_singles) for part in parts[0::3]]
+    new_word[1::3] = [
+        _ipa_pairs[grapheme] if blocker is None else _ipa_blocked[grapheme]
+        for grapheme, blocker in zip(parts[1::3], parts[2::3])]
+    new_word[2::3] = [""] * (len(parts) // 3)
 
-    ## then the single characters
-    for char in uyghur_singles.keys():
-        new_word = new_word.replace(char, uyghur_singles[char])
+    ## output the word in IPA transcription
+    return "".join(new_word)
 
-    ## then y
-    for char in uyghur_y.keys():
-        new_word = new_word.replace(char, uyghur_y[char])
+## the transliterator module and the lookup arrays used by
+## uyghur_latin_to_ipa_many(), built the first time they are needed
+## (False until then, None if they can't be built)
+_vector_tables = False
 
-    ## then j
-    for char in uyghur_u.keys():
-        new_word = new_word.replace(char, uyghur_u[char])
+def _compile_vector_tables():
+    """Return the transliterator module and the arrays it transcribes with.
 
-    ## list of Uyghur consonants (from "uigCLpixzd2ipa.xsl")
-    consonants = [
-        "b", "d", "g", "ɣ", "h", "χ", "ʤ", "k", "q", "l", "ɫ", "m", "n",
-        "ŋ", "p", "r", "s", "ʃ", "t", "ʧ", "w", "j", "z", "ʒ"
-        ]
+    The words are transcribed with the transliterator's NumPy helpers (see
+    vector_tables() there), given this module's pairs and the code points
+    of the consonants. Returns None if NumPy isn't installed, if the
+    transliterator can't be imported (the module leaves the path to its
+    callers, e.g. the pipeline, or the script below), or if a grapheme is
+    longer than two characters.
+    """
+    global _vector_tables
+    if _vector_tables is False:
+        _vector_tables = None
+        if numpy is None or any(len(grapheme) > 2 for grapheme in _ipa_pairs):
+            return None
+        try:
+            import uyghurtransliterator
+        except ImportError:
+            return None
+        consonant_codes = numpy.array(
+            [ord(consonant) for consonant in consonants], dtype=numpy.uint32)
+        _vector_tables = ((uyghurtransliterator,) +
+                          uyghurtransliterator.vector_tables(_ipa_pairs) +
+                          (consonant_codes,))
+    return _vector_tables
 
-    ## create a list of aspiration ("ʰ") + consonant sequences
-    sequences = ["ʰ" + consonant for consonant in consonants]
+def uyghur_latin_to_ipa_many(words):
+    """Return broad IPA transcriptions of a list of Uyghur words.
 
-    ## replace sequences of ʰ + consonant with the plain consonant
-    for sequence in sequences:
-        new_word = new_word.replace(sequence, sequence[1:])
+    Gives the same result as calling uyghur_latin_to_ipa() on each word,
+    but the words are transcribed together with NumPy, as the
+    transliterator's Transducer.convert_many() converts texts; only the
+    blocking of aspiration is done here, with a vectorized mask.
+    Words are transcribed one at a time instead if NumPy or the
+    transliterator isn't available (see _compile_vector_tables), or if a
+    word contains the separator character.
+    """
+    if profile is not None or len(words) < 2:
+        return [uyghur_latin_to_ipa(word) for word in words]
+    tables = _compile_vector_tables()
+    if tables is None:
+        return [uyghur_latin_to_ipa(word) for word in words]
+    (uyghurtransliterator, size, width, single_len, single_out, pair_keys,
+     pair_len, pair_out, consonant_codes) = tables
+    codes = uyghurtransliterator.pack_texts(words)
+    if codes is None:
+        return [uyghur_latin_to_ipa(word) for word in words]
 
-    ## output the word in IPA transcription
-    return new_word
-
-def main():
-    ## open input file in read-only mode with utf-8 encoding
-    with codecs.open(input_file, mode='r', encoding='utf-8') as words:
-        for line in words:
-            ## replace spaces with an underscore---we'll undo this later
-            ## (lines get split on whitespace, so this keeps entries together)
-            line = line.replace(" ", "_")
-            for word in line.split():
-                myipa = uyghur_latin_to_ipa(word)
-                ## output with a semicolon between for straightforward
-                ## pasting into a spreadsheet
-                print "{};{}".format(
-                    word.replace("_"," "), myipa.replace("_", " "))
+    _, _, lengths, out = uyghurtransliterator.map_singles(
+        codes, size, single_len, single_out)
+    ## steps[i] is the number of characters in the grapheme starting at i
+    steps = numpy.ones(len(codes), dtype=numpy.intp)
+    steps[uyghurtransliterator.map_pairs(codes, lengths, out, pair_keys,
+                                         pair_len, pair_out)] = 2
+
+    ## block aspiration where the next grapheme's IPA begins with a
+    ## consonant (every grapheme's IPA is at least one character long)
+    rows = numpy.arange(len(codes))
+    graphemes = lengths > 0
+    aspirated = graphemes & (
+        out[rows, numpy.maximum(lengths - 1, 0)] == ord(aspiration))
+    begins_consonant = graphemes & numpy.in1d(out[:, 0], consonant_codes)
+    following = rows + steps
+    has_following = following < len(codes)
+    blocked = numpy.zeros(len(codes), dtype=bool)
+    blocked[has_following] = aspirated[has_following] & \
+        begins_consonant[following[has_following]]
+    lengths[blocked] -= 1
+    return uyghurtransliterator.unpack_texts(out, lengths)
+
+class TranscriptionProfile(object):
+    """Records what the transcriber does, pair by pair.
+
+    While the module's profile is set to one of these, every word is
+    transcribed through it (one at a time, without NumPy), recording how
+    often each orthography/IPA pair was used, how often each aspirated
+    grapheme kept its aspiration or had it blocked (and by which
+    grapheme), the characters with no pair, which pass through unchanged,
+    and the time spent in each pass of the transcription:
+
+      split: finding the digraphs and aspirated graphemes, and what
+        follows the latter
+      translate: transcribing the single characters between them
+      graphemes: transcribing the digraphs and aspirated graphemes
+      join: joining the output
+
+    How long a single pair takes isn't known: the word is transcribed in
+    four passes, each using every pair. Characters whose IPA is the same
+    character (e.g. a, b, d) have no pair and so are among the unmapped.
+    """
+
+    passes = ("split", "translate", "graphemes", "join")
+
+    def __init__(self):
+        """Initialize an empty profile."""
+        self.lock = threading.Lock()
+        self.words = 0
+        self.characters = 0
+        self.seconds = dict.fromkeys(self.passes, 0.0)
+        self.hits = Counter()
+        self.blocked = Counter()
+        self.unmapped = Counter()
+
+    def transcribe(self, word):
+        """Transcribe word as uyghur_latin_to_ipa() does, recording it."""
+        started = time.time()
+        parts = _transcriber.split(word)
+        split = time.time()
+        new_word = parts[:]
+        new_word[0::3] = [part.translate(_ipa_singles)
+                          for part in parts[0::3]]
+        translated = time.time()
+        new_word[1::3] = [
+            _ipa_pairs[grapheme] if blocker is None
+            else _ipa_blocked[grapheme]
+            for grapheme, blocker in zip(parts[1::3], parts[2::3])]
+        new_word[2::3] = [""] * (len(parts) // 3)
+        looked_up = time.time()
+        ipa = "".join(new_word)
+        joined = time.time()
+
+        hits = Counter(parts[1::3])
+        blocked = Counter((grapheme, blocker) for grapheme, blocker
+                          in zip(parts[1::3], parts[2::3])
+                          if blocker is not None)
+        unmapped = Counter()
+        for char, count in Counter("".join(parts[0::3])).items():
+            if ord(char) in _ipa_singles:
+                hits[char] += count
+            else:
+                unmapped[char] = count
+        with self.lock:
+            self.words += 1
+            self.characters += len(word)
+            for name, start, end in zip(
+                    self.passes, (started, split, translated, looked_up),
+                    (split, translated, looked_up, joined)):
+                self.seconds[name] += end - start
+            self.hits.update(hits)
+            self.blocked.update(blocked)
+            self.unmapped.update(unmapped)
+        return ipa
+
+    def report(self):
+        """Return the profile as a dict (e.g. for JSON).
+
+        The pairs are listed table by table (with the pair that keeps an
+        aspiration mark in the input as it is under "aspiration"); each
+        aspirated grapheme also has the number of times its aspiration was
+        blocked, in all and by each following grapheme.
+        """
+        tables = (("uyghur_multiples", uyghur_multiples),
+                  ("uyghur_singles", uyghur_singles),
+                  ("uyghur_y", uyghur_y), ("uyghur_u", uyghur_u),
+                  ("aspiration", {aspiration: aspiration}))
+        with self.lock:
+            rules = []
+            for table, pairs in tables:
+                for grapheme in sorted(pairs):
+                    rule = OrderedDict([("table", table),
+                                        ("input", grapheme),
+                                        ("output", _ipa_pairs[grapheme]),
+                                        ("hits", self.hits[grapheme])])
+                    if grapheme in _ipa_blocked:
+                        blockers = OrderedDict(
+                            (blocker, count) for (aspirated, blocker), count
+                            in sorted(self.blocked.items())
+                            if aspirated == grapheme)
+                        rule["blocked"] = sum(blockers.values())
+                        rule["blocked_by"] = blockers
+                    rules.append(rule)
+            return OrderedDict([
+                ("words", self.words),
+                ("characters", self.characters),
+                ("seconds", OrderedDict((name, self.seconds[name])
+                                        for name in self.passes)),
+                ("rules", rules),
+                ("unmapped", [OrderedDict([
+                    ("character", char),
+                    ("name", unicodedata.name(char, "U+%04X" % ord(char))),
+                    ("count", count)])
+                    for char, count in self.unmapped.most_common()]),
+            ])
+
+    def collapsed(self):
+        """Return the microseconds of each pass, for a flame graph.
+
+        There is a line for each of the four passes, under a single
+        uyghur_latin_to_ipa frame, e.g. 'uyghur_latin_to_ipa;split 1520'.
+        """
+        with self.lock:
+            return "".join("uyghur_latin_to_ipa;%s %d\n" % (
+                name, round(self.seconds[name] * 1e6))
+                for name in self.passes)
+
+    def save(self, path, format="json"):
+        """Save report() as JSON, or collapsed() if format is "collapsed"."""
+        with codecs.open(path, "w", encoding="utf-8") as f:
+            if format == "collapsed":
+                f.write(self.collapsed())
+            else:
+                f.write(json.dumps(self.report(), ensure_ascii=False,
+                                   indent=2))
+                f.write("\n")
+
+class TranscriptionMemo(object):
+    """Bounded memo of transcriptions, evicting the least recently used.
+
+    Running text repeats the same few thousand words over and over, so
+    each of them only needs to be transcribed once.
+    """
+
+    def __init__(self, max_size=DEFAULT_MEMO_SIZE):
+        """Initialize an empty memo holding up to max_size words."""
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._memo = OrderedDict()
+
+    def transcribe(self, word):
+        """Return the IPA transcription of a word."""
+        memo = self._memo
+        try:
+            ipa = memo.pop(word)
+            self.hits += 1
+        except KeyError:
+            ipa = uyghur_latin_to_ipa(word)
+            self.misses += 1
+            if len(memo) >= self.max_size:
+                ## a memo of size 0 remembers nothing
+                if not memo:
+                    return ipa
+                memo.popitem(last=False)
+        memo[word] = ipa
+        return ipa
+
+def read_entries(lines, delimiter=None):
+    """Yield the entries (words, or phrases with spaces) in lines of input.
+
+    By default a line is split on whitespace other than spaces; otherwise
+    it is split on delimiter. Empty entries are skipped.
+    """
+    for line in lines:
+        if delimiter != None:
+            for word in line.rstrip("\r\n").split(delimiter):
+                if word:
+                    yield word
+            continue
+        ## replace spaces with an underscore---we'll undo this later
+        ## (lines get split on whitespace, so this keeps entries together)
+        line = line.replace(" ", "_")
+        for word in line.split():
+            yield word.replace("_", " ")
+
+def write_pairs(pairs, stream, delimiter=";"):
+    """Write (word, IPA) pairs to stream, one pair per line.
+
+    Lines are joined into blocks of LINES_PER_WRITE before being written.
+    Returns the number of pairs written.
+    """
+    template = "{}" + delimiter + "{}\n"
+    count = 0
+    block = []
+    for word, ipa in pairs:
+        block.append(template.format(word, ipa))
+        if len(block) >= LINES_PER_WRITE:
+            stream.write("".join(block))
+            count += len(block)
+            block = []
+    stream.write("".join(block))
+    return count + len(block)
+
+def open_text(path, mode):
+    """Open a path (or '-' for stdin/stdout) as buffered utf-8 text."""
+    if path == "-":
+        std = sys.stdin if mode == "r" else sys.stdout
+        return io.open(std.fileno(), mode, encoding="utf-8",
+                       buffering=BUFFER_SIZE, closefd=False)
+    return io.open(path, mode, encoding="utf-8", buffering=BUFFER_SIZE)
+
+def transcribe_batch(words):
+    """Transcribe a list of words, each distinct word (type) only once.
+
+    Returns a list of (word, IPA) pairs in input order and the number of
+    types.
+    """
+    types = list(set(words))
+    types = dict(zip(types, uyghur_latin_to_ipa_many(types)))
+    return [(word, types[word]) for word in words], len(types)
+
+def iter_transcribe(words, memo=None):
+    """Yield (word, IPA) pairs for a stream of words.
+
+    Transcriptions are looked up in memo (a TranscriptionMemo, by default
+    a new one) first, so memory stays bounded however long the stream is.
+    """
+    if memo == None:
+        memo = TranscriptionMemo()
+    for word in words:
+        yield word, memo.transcribe(word)
+
+def main(input_path=input_file, output_path="-", batch=False,
+         memo_size=DEFAULT_MEMO_SIZE, input_delimiter=None,
+         output_delimiter=";"):
+    """Write each word in the input with its transcription.
+
+    input_path and output_path may be '-' for stdin and stdout. With batch,
+    the whole input is read first and each distinct word is transcribed
+    once; otherwise words are transcribed as they're read, through a memo
+    of memo_size words. Token and type counts go to stderr.
+    """
+    with open_text(input_path, "r") as lines:
+        with open_text(output_path, "w") as stream:
+            words = read_entries(lines, input_delimiter)
+            if batch:
+                pairs, types = transcribe_batch(list(words))
+            else:
+                memo = TranscriptionMemo(memo_size)
+                pairs = iter_transcribe(words, memo)
+            ## output with a semicolon (by default) between for
+            ## straightforward pasting into a spreadsheet
+            tokens = write_pairs(pairs, stream, output_delimiter)
+
+    if batch:
+        print("{} tokens, {} types".format(tokens, types), file=sys.stderr)
+    else:
+        print("{} tokens, {} transcribed, {} from memo".format(
+            tokens, memo.misses, memo.hits), file=sys.stderr)
 
 ## run the main() function if this script is called as a standalone script
 ## (but if imported, e.g., using the call
 ## from adduyghuripa import uyughur_latin_to_ipa
 ## the main() function won't run)
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Add broad IPA transcriptions to a list of Uyghur words.")
+    parser.add_argument('input', nargs='?', default=input_file,
+                        help=("input file, or - for stdin "
+                              "(default: %(default)s)"))
+    parser.add_argument('-o', '--output', default="-",
+                        help="output file (default: stdout)")
+    parser.add_argument('--input-delimiter', default=None,
+                        type=lambda arg: arg.decode('utf-8'),
+                        help=("split input lines on this string instead of "
+                              "on whitespace other than spaces"))
+    parser.add_argument('--output-delimiter', default=";",
+                        type=lambda arg: arg.decode('utf-8'),
+                        help=("string between a word and its transcription "
+                              "(default: %(default)s)"))
+    parser.add_argument('--batch', action='store_true',
+                        help=("read the whole input first and transcribe "
+                              "each distinct word once"))
+    parser.add_argument('--memo-size', type=int, default=DEFAULT_MEMO_SIZE,
+                        help=("distinct words remembered when not in batch "
+                              "mode (default: %(default)s)"))
+    parser.add_argument('--profile', metavar='FILE',
+                        help=("record pair hits, blocked aspiration, "
+                              "unmapped characters and the time spent in "
+                              "each pass, and write them to FILE"))
+    parser.add_argument('--profile-format', choices=["json", "collapsed"],
+                        default="json",
+                        help=("JSON report, or collapsed stacks for flame "
+                              "graphs (default: %(default)s)"))
+    args = parser.parse_args()
+    ## run as a script, the transliterator (whose array code --batch
+    ## uses) can be found next to this directory, as in this repository
+    sys.path.append(os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "UyghurTransliterator"))
+    if args.profile:
+        profile = TranscriptionProfile()
+    main(args.input, args.output, batch=args.batch, memo_size=args.memo_size,
+         input_delimiter=args.input_delimiter,
+         output_delimiter=args.output_delimiter)
+    if profile is not None:
+        profile.save(args.profile, args.profile_format)
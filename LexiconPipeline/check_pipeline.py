@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Check which rows an incremental run of the pipeline computes again.
+
+A small lexicon is run through the pipeline twice with --incremental: the
+second run must only hand the stages the line that changed, all the rows
+of a stage whose rules changed, and the rows whose glosses failed on a
+network error the first time, and give the same output as a full run.
+Glosses are looked up on the scraper's stand-in server (see
+../WiktionaryScraper/standinserver.py). Run with `python check_pipeline.py`.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+## (lexiconpipeline puts the other tools on the path)
+import lexiconpipeline
+import ipatranscriber
+import standinserver
+import wiktionaryscraper as scraper
+
+LEXICON = """Uyghur\tChinese
+yaxshi\t小心
+kitab\t响应
+bala\t收集
+qelem\t提醒
+sheher\t警告
+"""
+
+
+class IncrementalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input = os.path.join(self.directory, "lexicon.tsv")
+        self.output = os.path.join(self.directory, "enriched.tsv")
+        self.write_input(LEXICON)
+        ## the rows handed to each stage
+        self.submitted = {}
+        self.submit = {}
+        for stage in (lexiconpipeline.TransliterationStage,
+                      lexiconpipeline.IpaStage,
+                      lexiconpipeline.GlossStage):
+            self.record(stage)
+        self.rules_version = ipatranscriber.rules_version
+        self.stdout = sys.stdout
+        ## the scraper prints the terms it looks up
+        sys.stdout = StringIO.StringIO()
+        self.server = standinserver.start_server()
+        scraper.response_cache = None
+        scraper.metrics = None
+        scraper.http_client = scraper.HttpClient(retries=0)
+
+    def tearDown(self):
+        for stage, submit in self.submit.items():
+            stage.submit = submit
+        ipatranscriber.rules_version = self.rules_version
+        sys.stdout = self.stdout
+        scraper.http_client.close()
+        scraper.http_client = None
+        scraper.rate_limiter = None
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def record(self, stage):
+        """Record the first column of the rows handed to stage."""
+        submit = self.submit[stage] = stage.submit
+        submitted = self.submitted[stage.__name__] = []
+
+        def recording(self, rows):
+            submitted.extend(row[0] for row in rows)
+            return submit(self, rows)
+        stage.submit = recording
+
+    def write_input(self, text):
+        with io.open(self.input, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def run_pipeline(self, output=None, gloss=True):
+        for submitted in self.submitted.values():
+            del submitted[:]
+        lexiconpipeline.main(self.input, output or self.output,
+                             output_orths=["UyCyrillic"], ipa=True,
+                             gloss=gloss, base_url=self.server.base_url,
+                             rate=1000, incremental=output is None)
+        with io.open(output or self.output, encoding="utf-8") as f:
+            return f.read()
+
+    def full_run(self):
+        """Return the output of a run that keeps nothing."""
+        return self.run_pipeline(os.path.join(self.directory, "full.tsv"))
+
+    def test_changed_line(self):
+        self.run_pipeline()
+        self.assertEqual(len(self.submitted["IpaStage"]), 5)
+        self.write_input(LEXICON.replace("bala\t", "balilar\t"))
+        output = self.run_pipeline()
+        for stage in ("TransliterationStage", "IpaStage", "GlossStage"):
+            self.assertEqual(self.submitted[stage], ["balilar"], stage)
+        self.assertEqual(output, self.full_run())
+
+    def test_changed_stage(self):
+        self.run_pipeline()
+        ipatranscriber.rules_version = lambda: "edited"
+        output = self.run_pipeline()
+        self.assertEqual(self.submitted["IpaStage"],
+                         ["yaxshi", "kitab", "bala", "qelem", "sheher"])
+        self.assertEqual(self.submitted["TransliterationStage"], [])
+        self.assertEqual(self.submitted["GlossStage"], [])
+        self.assertEqual(output, self.full_run())
+
+    def test_failed_glosses(self):
+        ## every request fails, so no gloss is found
+        self.server.fail_every = 1
+        output = self.run_pipeline()
+        self.assertNotIn("(", output)
+        manifest = lexiconpipeline.Manifest(self.output + ".manifest")
+        self.assertEqual(manifest.load()["failed"],
+                         [[row, 2] for row in range(5)])
+
+        ## only the glosses are looked up again, and are found this time
+        self.server.fail_every = 0
+        output = self.run_pipeline()
+        self.assertEqual(len(self.submitted["GlossStage"]), 5)
+        self.assertEqual(self.submitted["IpaStage"], [])
+        self.assertEqual(manifest.load()["failed"], [])
+        self.assertIn("careful", output)
+        self.assertEqual(output, self.full_run())
+
+        ## and then kept
+        self.run_pipeline()
+        self.assertEqual(self.submitted["GlossStage"], [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,552 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##########
+## lexiconpipeline.py Version 0.1
+##
+## License: MIT ( http://opensource.org/licenses/MIT )
+##
+##########
+
+"""
+Add transliterations, IPA and English glosses to a lexicon in one pass.
+
+Take as input a tab-separated lexicon with a header row, e.g.
+
+    Uyghur	Chinese
+    yaxshi	好
+    kitab	书
+
+and write it out again with a column for each orthography asked for, a
+column of broad IPA transcriptions and a column of English glosses of
+the Mandarin column, e.g.
+
+    Uyghur	Chinese	UyArabic	BroadIPA	English
+    yaxshi	好	ياخشى	jaχʃi	good (好),
+    kitab	书	كىتاب	kʰitʰab	book (书),
+
+The lexicon is read once, a batch of rows at a time, and every stage is
+run on each batch. Glosses are looked up on worker threads (see
+wiktionaryscraper.py) while the other stages run, and a few batches are
+kept in flight so that slow lookups overlap.
+
+With --incremental, a manifest is kept next to the output, holding a hash
+of every input line and a version of each stage (a hash of the rule
+tables it uses). A later run only computes the stages of lines that are
+new or changed, or whose stage has changed, and copies the rest from the
+output it is replacing.
+"""
+
+from __future__ import print_function
+
+import argparse
+import codecs
+import collections
+import hashlib
+import io
+import json
+import os
+import sys
+from multiprocessing.pool import ThreadPool
+
+## the tools live in sibling directories of this one
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for tool in ("UyghurTransliterator", "IPATranscriber", "WiktionaryScraper"):
+    sys.path.insert(0, os.path.join(repository, tool))
+
+import uyghurtransliterator
+import ipatranscriber
+
+## glosses need BeautifulSoup (through the scraper)
+try:
+    import wiktionaryscraper
+except ImportError:
+    wiktionaryscraper = None
+
+## rows read and processed together, and batches in flight at once
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_DEPTH = 4
+
+
+class _Done(object):
+    """Result that is already there (cf. multiprocessing's AsyncResult)."""
+
+    def __init__(self, value):
+        """Initialize a result holding value."""
+        self.value = value
+
+    def get(self):
+        """Return the value."""
+        return self.value
+
+class Failed(list):
+    """Cells of a row that a stage couldn't fully compute.
+
+    They are written like any others, but an incremental run doesn't keep
+    them: the stage is run on the row again the next time.
+    """
+
+def _version(*parts):
+    """Return a hash of a stage's settings and rule versions."""
+    return hashlib.sha1(json.dumps(parts)).hexdigest()
+
+def line_hash(line):
+    """Return the hash of a lexicon line."""
+    return hashlib.sha1(line.encode("utf-8")).hexdigest()
+
+class TransliterationStage(object):
+    """Adds a column per output orthography, converted from one column."""
+
+    def __init__(self, column, input_orth, output_orths):
+        """Initialize a stage converting column from input_orth.
+
+        Parameters
+        ---------
+          column (int): index of the column to convert
+          input_orth (str): orthography of that column (a key of orth_key)
+          output_orths (list): output orthographies (keys of orth_key)
+        """
+        self.column = column
+        self.columns = list(output_orths)
+        self.fan = uyghurtransliterator.FanOut(input_orth, output_orths)
+        self.version = _version(
+            "transliteration", column,
+            [uyghurtransliterator.rules_version(input_orth, orth)
+             for orth in [input_orth] + self.columns])
+
+    def submit(self, rows):
+        """Convert a batch of rows; returns a result holding their cells."""
+        return _Done([self.fan.convert(row[self.column]) for row in rows])
+
+class IpaStage(object):
+    """Adds a column of broad IPA transcriptions of one column."""
+
+    columns = ["BroadIPA"]
+
+    def __init__(self, column, input_orth="UyLatin"):
+        """Initialize a stage transcribing column (written in input_orth).
+
+        Words not in Latin orthography are transliterated into it first,
+        and all words are lower-cased (the transcriber expects them so).
+        """
+        self.column = column
+        self.input_orth = input_orth
+        rules = [ipatranscriber.rules_version()]
+        if input_orth != "UyLatin":
+            rules.append(uyghurtransliterator.rules_version(input_orth,
+                                                            "UyLatin"))
+        self.version = _version("ipa", column, rules)
+
+    def submit(self, rows):
+        """Transcribe a batch of rows; returns a result holding their cells."""
+        words = [row[self.column] for row in rows]
+        if self.input_orth != "UyLatin":
+            words = uyghurtransliterator.transliterate_many(
+                words, self.input_orth, "UyLatin")
+        words = [word.lower() for word in words]
+        return _Done([[ipa] for ipa in
+                      ipatranscriber.uyghur_latin_to_ipa_many(words)])
+
+class GlossStage(object):
+    """Adds a column of English glosses of the Mandarin column.
+
+    Glosses are looked up on a pool of threads, through a TermResolver, so
+    each distinct term is only looked up once.
+    """
+
+    columns = ["English"]
+
+    def __init__(self, column, resolver, workers):
+        """Initialize a stage glossing column with resolver.
+
+        Terms are looked up on workers threads.
+        """
+        self.column = column
+        self.resolver = resolver
+        self.pool = ThreadPool(workers)
+        ## glosses depend on where they are looked up, not on any table
+        backend = resolver.backend
+        self.version = _version("gloss", column, type(backend).__name__,
+                                backend.base_url)
+
+    def gloss(self, cell):
+        """Return the English glosses of a Mandarin cell.
+
+        They are Failed if a term couldn't be looked up (e.g. on a network
+        error).
+        """
+        myrow = wiktionaryscraper.RowInTheLexicon(cell)
+        myrow.get_lexicon_info(u"0," + cell)
+        failed = []
+        glosses = wiktionaryscraper.gloss_row(myrow, self.resolver, failed)
+        cells = [u"".join(glosses).strip()]
+        return Failed(cells) if failed else cells
+
+    def submit(self, rows):
+        """Start glossing a batch of rows; returns an AsyncResult."""
+        return self.pool.map_async(
+            self.gloss, [row[self.column] for row in rows])
+
+    def close(self):
+        """Stop the threads."""
+        self.pool.close()
+        self.pool.join()
+
+class _Spliced(object):
+    """Result of a stage for a batch, some of whose rows were kept."""
+
+    def __init__(self, cells, todo, result):
+        """Initialize a result from the cells kept (None where a row
+        wasn't), the positions of the rows that weren't, and the result
+        of the stage for those rows."""
+        self.cells = cells
+        self.todo = todo
+        self.result = result
+
+    def get(self):
+        """Return the cells of every row."""
+        cells = list(self.cells)
+        for position, computed in zip(self.todo, self.result.get()):
+            cells[position] = computed
+        return cells
+
+def _submit(stage, rows, kept):
+    """Hand a stage the rows of a batch whose cells weren't kept."""
+    todo = [position for position, cells in enumerate(kept) if cells is None]
+    if not todo:
+        return _Done(kept)
+    if len(todo) == len(rows):
+        return stage.submit(rows)
+    return _Spliced(kept, todo, stage.submit([rows[position]
+                                              for position in todo]))
+
+class Manifest(object):
+    """What an incremental run wrote, kept in a small JSON file.
+
+    Records the header of the input, the columns and version of each
+    stage, the hash of each input line (in the order of the output rows)
+    and the rows whose cells a stage couldn't fully compute. The file is
+    replaced atomically, after the output.
+    """
+
+    def __init__(self, path):
+        """Initialize a manifest at path."""
+        self.path = path
+
+    def load(self):
+        """Return the state recorded, or None if there is none."""
+        try:
+            with open(self.path, "rb") as manifest:
+                return json.load(manifest)
+        except (IOError, ValueError):
+            return None
+
+    def save(self, header, stages, hashes, failed=()):
+        """Record the header, the stages, the line hashes of a run and
+        the (row, stage) positions of its Failed cells."""
+        state = {"header": header,
+                 "stages": [{"columns": stage.columns,
+                             "version": stage.version} for stage in stages],
+                 "hashes": hashes,
+                 "failed": [list(position) for position in failed]}
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as manifest:
+            json.dump(state, manifest)
+            manifest.flush()
+            os.fsync(manifest.fileno())
+        os.rename(temporary, self.path)
+
+def reusable_rows(state, output_path, header, stages):
+    """Return the cells of an earlier output that can be kept.
+
+    state is what the manifest recorded when output_path was written.
+    Returns a dict mapping the hash of each line then to a list holding,
+    for each of stages, its cells in the output, or None if the stage has
+    changed since (or wasn't run, or failed on that line). The dict is
+    empty if nothing can be kept, e.g. if the header has changed or the
+    output was edited.
+    """
+    if state is None or state.get("header") != header:
+        return {}
+    spans = {}
+    old_header = list(header)
+    for number, stage in enumerate(state["stages"]):
+        key = (tuple(stage["columns"]), stage["version"])
+        spans[key] = (len(old_header), len(old_header) + len(key[0]),
+                      number)
+        old_header.extend(stage["columns"])
+    spans = [spans.get((tuple(stage.columns), stage.version))
+             for stage in stages]
+    if spans.count(None) == len(spans):
+        return {}
+    failed = set((row, stage) for row, stage in state.get("failed", []))
+
+    hashes = state["hashes"]
+    previous = {}
+    try:
+        with io.open(output_path, encoding="utf-8") as output:
+            if output.readline().rstrip(u"\n").split(u"\t") != old_header:
+                return {}
+            rows = 0
+            for line in output:
+                cells = line.rstrip(u"\n").split(u"\t")
+                if rows >= len(hashes) or len(cells) != len(old_header):
+                    return {}
+                previous[hashes[rows]] = [
+                    None if span is None or (rows, span[2]) in failed
+                    else cells[span[0]:span[1]] for span in spans]
+                rows += 1
+    except IOError:
+        return {}
+    if rows != len(hashes):
+        return {}
+    return previous
+
+def read_batches(lines, width, delimiter=u"\t",
+                 batch_size=DEFAULT_BATCH_SIZE):
+    """Yield the rows of a lexicon (lists of cells) in batches.
+
+    Short rows are padded with empty cells to width.
+    """
+    batch = []
+    for line in lines:
+        cells = line.rstrip(u"\r\n").split(delimiter)
+        batch.append(cells + [u""] * (width - len(cells)))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _clean(cell):
+    """Keep tabs and line breaks out of an output cell."""
+    return u" ".join(cell.split(u"\t")).replace(u"\n", u" ")
+
+def run(lines, stream, stages, delimiter=u"\t",
+        batch_size=DEFAULT_BATCH_SIZE, depth=DEFAULT_DEPTH, previous=None,
+        hashes=None, failed=None):
+    """Run stages on every row of a lexicon, writing the combined TSV.
+
+    lines are the lines of the lexicon (header first); every stage is
+    handed each batch of rows in turn, and up to depth batches are in
+    flight before the oldest is waited for and written. Returns the number
+    of rows written.
+
+    With hashes (a list), the hash of each line is appended to it, and
+    the cells of lines found in previous (see reusable_rows) are kept
+    rather than computed again. With failed (a list), the (row, stage)
+    position of every Failed cell is appended to it.
+    """
+    lines = iter(lines)
+    header = next(lines).rstrip(u"\r\n").split(delimiter)
+    width = len(header)
+    for stage in stages:
+        header.extend(stage.columns)
+    stream.write(u"\t".join(header) + u"\n")
+
+    def write(rows, results):
+        cells = [result.get() for result in results]
+        for number, row in enumerate(rows):
+            for stage, stage_cells in enumerate(cells):
+                if failed is not None and isinstance(stage_cells[number],
+                                                     Failed):
+                    failed.append((written + number, stage))
+                row.extend(stage_cells[number])
+            stream.write(u"\t".join(_clean(cell) for cell in row) + u"\n")
+        return len(rows)
+
+    written = 0
+    pending = collections.deque()
+    no_cells = [None] * len(stages)
+    for rows in read_batches(lines, width, delimiter, batch_size):
+        if hashes is None:
+            results = [stage.submit(rows) for stage in stages]
+        else:
+            keys = [line_hash(delimiter.join(row)) for row in rows]
+            hashes.extend(keys)
+            kept = [(previous or {}).get(key, no_cells) for key in keys]
+            results = [_submit(stage, rows, [cells[number] for cells in kept])
+                       for number, stage in enumerate(stages)]
+        pending.append((rows, results))
+        if len(pending) >= depth:
+            written += write(*pending.popleft())
+    while pending:
+        written += write(*pending.popleft())
+    return written
+
+def find_column(header, name):
+    """Return the index of a column by name, or None if there's none."""
+    try:
+        return header.index(name)
+    except ValueError:
+        return None
+
+def main(input_path, output_path=None, input_orth="UyLatin", output_orths=(),
+         ipa=False, gloss=False, word_column=None, mandarin_column="Chinese",
+         delimiter=u"\t", batch_size=DEFAULT_BATCH_SIZE,
+         workers=None, backend="html", base_url=None,
+         index_path=None, cache_path=None, offline=False, rate=None,
+         incremental=False, manifest_path=None):
+    """Enrich the lexicon at input_path, writing a TSV to output_path.
+
+    The Uyghur words are in word_column (by default the first column) and
+    are written in input_orth; they are transliterated into output_orths
+    and, with ipa, transcribed. With gloss, the terms in mandarin_column
+    are looked up on workers threads (by default as many as the scraper
+    uses with backend, see wiktionaryscraper.default_workers; see
+    wiktionaryscraper.main for backend, base_url, index_path, cache_path,
+    offline and rate).
+
+    With incremental, the rows of the existing output_path that are still
+    up to date are kept, as recorded in the manifest at manifest_path (by
+    default, output_path + ".manifest"), and the manifest is updated.
+    """
+    if incremental and output_path is None:
+        raise ValueError("An incremental run needs an output file")
+    with io.open(input_path, encoding="utf-8") as lines:
+        header = lines.readline().rstrip(u"\r\n").split(delimiter)
+    words = 0 if word_column is None else find_column(header, word_column)
+    if words is None:
+        raise ValueError("No column %s in %s" % (word_column, input_path))
+
+    stages = []
+    if output_orths:
+        stages.append(TransliterationStage(words, input_orth, output_orths))
+    if ipa:
+        stages.append(IpaStage(words, input_orth))
+    index = None
+    if gloss:
+        if wiktionaryscraper is None:
+            raise ImportError("Glosses need BeautifulSoup (bs4)")
+        mandarin = find_column(header, mandarin_column)
+        if mandarin is None:
+            raise ValueError("No column %s in %s" % (mandarin_column,
+                                                      input_path))
+        scraper = wiktionaryscraper
+        base_url = base_url or scraper.wiktionary_url
+        scraper.rate_limiter = scraper.HostRateLimiter(
+            rate or scraper.DEFAULT_RATE)
+        if cache_path is not None:
+            scraper.response_cache = scraper.ResponseCache(
+                cache_path, offline=offline)
+        if backend == "index":
+            index = scraper.DumpIndex(index_path or scraper.index_file)
+            lookup = scraper.IndexBackend(index, base_url)
+        elif backend == "api":
+            lookup = scraper.ApiBackend(base_url)
+        else:
+            lookup = scraper.HtmlBackend(base_url)
+        stages.append(GlossStage(mandarin, scraper.TermResolver(lookup),
+                                 workers or scraper.default_workers(backend)))
+
+    previous = hashes = failed = None
+    if incremental:
+        manifest = Manifest(manifest_path or output_path + ".manifest")
+        previous = reusable_rows(manifest.load(), output_path, header,
+                                 stages)
+        hashes = []
+        failed = []
+
+    ## the scraper prints a line per term looked up (and its failed
+    ## requests); keep them apart from the TSV if it goes to stdout
+    if gloss and output_path is None:
+        wiktionaryscraper.message_stream = sys.stderr
+    try:
+        with io.open(input_path, encoding="utf-8") as lines:
+            if output_path is None:
+                stream = codecs.getwriter("utf-8")(sys.stdout)
+                rows = run(lines, stream, stages, delimiter, batch_size)
+            elif incremental:
+                ## the old output is read while the new one is written
+                temporary = output_path + ".tmp"
+                with io.open(temporary, "w", encoding="utf-8") as stream:
+                    rows = run(lines, stream, stages, delimiter, batch_size,
+                               previous=previous, hashes=hashes,
+                               failed=failed)
+                os.rename(temporary, output_path)
+                manifest.save(header, stages, hashes, failed)
+            else:
+                with io.open(output_path, "w", encoding="utf-8") as stream:
+                    rows = run(lines, stream, stages, delimiter, batch_size)
+    finally:
+        if gloss:
+            wiktionaryscraper.message_stream = None
+        for stage in stages:
+            if isinstance(stage, GlossStage):
+                stage.close()
+        if index is not None:
+            index.close()
+        if gloss and wiktionaryscraper.response_cache is not None:
+            wiktionaryscraper.response_cache.close()
+        ## (the scraper opens its connections as they are needed)
+        if gloss and wiktionaryscraper.http_client is not None:
+            wiktionaryscraper.http_client.close()
+    if incremental:
+        kept = sum(1 for key in hashes
+                   if None not in previous.get(key, [None]))
+        print("%d rows (%d kept as they were, %d to retry next time)" % (
+            rows, kept, len(set(row for row, stage in failed))),
+            file=sys.stderr)
+    else:
+        print("%d rows" % rows, file=sys.stderr)
+
+if __name__ == "__main__":
+    orths = sorted(uyghurtransliterator.orth_key,
+                   key=uyghurtransliterator.orth_index)
+    parser = argparse.ArgumentParser(
+        description=("Add transliterations, broad IPA and English glosses "
+                     "to a tab-separated lexicon in one pass."))
+    parser.add_argument('input', help="lexicon (with a header row)")
+    parser.add_argument('-o', '--output',
+                        help="output file (default: stdout)")
+    parser.add_argument('--orth', default="UyLatin", choices=orths,
+                        help=("orthography of the Uyghur words "
+                              "(default: %(default)s)"))
+    parser.add_argument('--to', nargs='+', default=[], choices=orths,
+                        metavar='ORTH',
+                        help="orthographies to transliterate into")
+    parser.add_argument('--ipa', action='store_true',
+                        help="add broad IPA transcriptions")
+    parser.add_argument('--gloss', action='store_true',
+                        help="add English glosses of the Mandarin column")
+    parser.add_argument('--word-column', metavar='NAME',
+                        help="column of Uyghur words (default: the first)")
+    parser.add_argument('--mandarin-column', metavar='NAME',
+                        default="Chinese",
+                        help="column of Mandarin terms (default: %(default)s)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="rows processed together (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help=("threads looking glosses up (default: as "
+                              "the scraper's --workers, for --backend)"))
+    parser.add_argument('--backend', choices=["html", "api", "index"],
+                        default="html",
+                        help=("where glosses are looked up (see "
+                              "wiktionaryscraper.py; default: %(default)s)"))
+    parser.add_argument('--base-url', help="Wiktionary address")
+    parser.add_argument('--index', help="dump index for --backend index")
+    parser.add_argument('--cache', help="cache of downloaded pages")
+    parser.add_argument('--offline', action='store_true',
+                        help="only use cached pages (needs --cache)")
+    parser.add_argument('--rate', type=float,
+                        help="requests per second to Wiktionary")
+    parser.add_argument('--incremental', action='store_true',
+                        help=("only compute the rows that are new or have "
+                              "changed since the last run (needs -o)"))
+    parser.add_argument('--manifest', metavar='FILE',
+                        help=("manifest of the last run (default: the "
+                              "output file + .manifest)"))
+    args = parser.parse_args()
+    if not (args.to or args.ipa or args.gloss):
+        parser.error("nothing to do: give --to, --ipa and/or --gloss")
+    if args.offline and not args.cache:
+        parser.error("--offline needs --cache")
+    if args.incremental and not args.output:
+        parser.error("--incremental needs -o")
+    main(args.input, args.output, args.orth, args.to, args.ipa, args.gloss,
+         args.word_column, args.mandarin_column,
+         batch_size=args.batch_size, workers=args.workers,
+         backend=args.backend, base_url=args.base_url,
+         index_path=args.index, cache_path=args.cache,
+         offline=args.offline, rate=args.rate,
+         incremental=args.incremental, manifest_path=args.manifest)
@@ -0,0 +1,167 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Check the service's answers against the tools themselves.
+
+The service is started on a free local port (and on a Unix socket in a
+temporary directory), and /transliterate and /ipa are asked for single
+texts and batches, in every orthography, by several ServiceClients at
+once; the results must be what uyghurtransliterator and ipatranscriber
+give in-process, and bad requests must be turned down with a 400. Run
+with `python check_service.py`.
+"""
+
+import httplib
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+## (uyghurservice puts the other tools on the path)
+import uyghurservice
+import ipatranscriber
+import uyghurtransliterator as ut
+
+## clients asking at once, and requests each of them sends
+CLIENTS = 8
+REQUESTS = 50
+
+
+def random_texts(rng, count, length=6):
+    """Return count random texts made of graphemes of every orthography."""
+    pieces = sorted(set(grapheme for row in ut.uyghur_orthographies
+                        for grapheme in row if not isinstance(grapheme, int)
+                        and grapheme))
+    pieces += [u" ", u"-", u"'", u"x", u"中"]
+    return [u"".join(rng.choice(pieces) for _ in range(rng.randint(0, length)))
+            for _ in range(count)]
+
+
+def start_server(server):
+    """Serve on a thread of its own; returns the server."""
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class ServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_server(uyghurservice.ThreadingHTTPServer(
+            ("127.0.0.1", 0), uyghurservice.RequestHandler))
+        self.port = self.server.server_address[1]
+        self.client = uyghurservice.ServiceClient(port=self.port)
+        self.orths = sorted(ut.orth_key, key=ut.orth_index)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def check_transliterate(self, client, rng):
+        texts = random_texts(rng, rng.randint(1, 20))
+        input_orth = rng.choice(self.orths)
+        output_orth = rng.choice(self.orths)
+        self.assertEqual(
+            client.transliterate(texts, input_orth, output_orth),
+            [ut.transliterate(text, input_orth, output_orth)
+             for text in texts])
+        self.assertEqual(
+            client.transliterate(texts[0], input_orth, output_orth),
+            ut.transliterate(texts[0], input_orth, output_orth))
+        output_orths = rng.sample(self.orths, rng.randint(1, 3))
+        self.assertEqual(
+            client.transliterate(texts, input_orth, output_orths),
+            [dict((orth, ut.transliterate(text, input_orth, orth))
+                  for orth in output_orths) for text in texts])
+
+    def check_ipa(self, client, rng):
+        words = [word.lower() for word in random_texts(rng, 20)]
+        self.assertEqual(client.ipa(words),
+                         [ipatranscriber.uyghur_latin_to_ipa(word)
+                          for word in words])
+        self.assertEqual(client.ipa(words[0]),
+                         ipatranscriber.uyghur_latin_to_ipa(words[0]))
+
+    def test_transliterate(self):
+        rng = random.Random(1)
+        for _ in range(REQUESTS):
+            self.check_transliterate(self.client, rng)
+
+    def test_ipa(self):
+        rng = random.Random(2)
+        for _ in range(REQUESTS):
+            self.check_ipa(self.client, rng)
+
+    def test_bad_requests(self):
+        for path, request in [
+                ("/transliterate", {"text": u"yaxshi", "from": "UyLatin",
+                                    "to": "Klingon"}),
+                ("/transliterate", {"text": u"yaxshi", "to": "UyArabic"}),
+                ("/transliterate", {"texts": u"yaxshi", "from": "UyLatin",
+                                    "to": "UyArabic"}),
+                ("/transliterate", {"from": "UyLatin", "to": "UyArabic"}),
+                ("/ipa", {"words": [u"yaxshi", 1]}),
+                ("/ipa", [u"yaxshi"])]:
+            self.assertRaises(uyghurservice.RequestError,
+                              self.client.call, path, request)
+        connection = httplib.HTTPConnection("127.0.0.1", self.port)
+        try:
+            for path, body, status in [("/ipa", "{not json", 400),
+                                       ("/nowhere", "{}", 404)]:
+                connection.request("POST", path, body)
+                response = connection.getresponse()
+                self.assertEqual(response.status, status)
+                self.assertIn("error", json.loads(response.read()))
+        finally:
+            connection.close()
+        ## and the service still answers
+        self.assertEqual(self.client.ipa(u"yaxshi"),
+                         ipatranscriber.uyghur_latin_to_ipa(u"yaxshi"))
+
+    def test_concurrent_clients(self):
+        failures = []
+
+        def ask(seed):
+            client = uyghurservice.ServiceClient(port=self.port)
+            rng = random.Random(seed)
+            try:
+                for _ in range(REQUESTS // 5):
+                    self.check_transliterate(client, rng)
+                    self.check_ipa(client, rng)
+            except Exception, e:
+                failures.append(e)
+            finally:
+                client.close()
+
+        threads = [threading.Thread(target=ask, args=(seed,))
+                   for seed in range(CLIENTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+
+    def test_unix_socket(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "service.sock")
+        server = start_server(uyghurservice.ThreadingUnixHTTPServer(
+            path, uyghurservice.RequestHandler))
+        client = uyghurservice.ServiceClient(socket_path=path)
+        try:
+            rng = random.Random(3)
+            self.check_transliterate(client, rng)
+            self.check_ipa(client, rng)
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,356 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##########
+## uyghurservice.py Version 0.1
+##
+## License: MIT ( http://opensource.org/licenses/MIT )
+##
+##########
+
+"""
+Serve transliteration and IPA transcription over HTTP from one process.
+
+Starting Python and compiling the orthography tables takes far longer
+than converting a word, so this server compiles them once and then
+answers requests (one at a time or in batches, from any number of
+clients at once) on a local TCP port or a Unix socket.
+
+E.g., the request
+
+    POST /transliterate
+    {"texts": ["yaxshi", "kitab"], "from": "UyLatin",
+     "to": ["UyArabic", "IPA"]}
+
+is answered with
+
+    {"result": [{"UyArabic": "ياخشى", "IPA": "jaχʃi"},
+                {"UyArabic": "كىتاب", "IPA": "kʰitʰab"}]}
+"""
+
+from __future__ import print_function
+
+import argparse
+import BaseHTTPServer
+import httplib
+import json
+import os
+import socket
+import SocketServer
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+
+## the tools live in sibling directories of this one
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for tool in ("UyghurTransliterator", "IPATranscriber"):
+    sys.path.insert(0, os.path.join(repository, tool))
+
+import uyghurtransliterator
+import ipatranscriber
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8040
+
+## largest request body accepted, in bytes
+MAX_REQUEST_SIZE = 16 << 20
+
+## most FanOut objects (one per orthography and list of targets) kept
+_FAN_OUT_CACHE_SIZE = 64
+_fan_out_cache = OrderedDict()
+_fan_out_lock = threading.Lock()
+
+
+class RequestError(Exception):
+    """A request that can't be answered (sent back as a 400 response)."""
+
+
+def get_fan_out(input_orth, output_orths):
+    """Return a (shared) FanOut for an input and a list of outputs.
+
+    FanOuts are kept in a registry, dropping the least recently used once
+    it holds _FAN_OUT_CACHE_SIZE of them.
+    """
+    key = (input_orth, tuple(output_orths))
+    with _fan_out_lock:
+        fan = _fan_out_cache.pop(key, None)
+        if fan is None:
+            fan = uyghurtransliterator.FanOut(input_orth, output_orths)
+            if len(_fan_out_cache) >= _FAN_OUT_CACHE_SIZE:
+                _fan_out_cache.popitem(last=False)
+        _fan_out_cache[key] = fan
+    return fan
+
+def warm_up():
+    """Compile the tables for converting every orthography into any other.
+
+    This includes the NumPy tables used for batches, which are otherwise
+    built by the first batch for each pair of orthographies.
+    """
+    orths = sorted(uyghurtransliterator.orth_key,
+                   key=uyghurtransliterator.orth_index)
+    for input_orth in orths:
+        get_fan_out(input_orth, orths)
+        for output_orth in orths:
+            uyghurtransliterator.transliterate_many(
+                [u"yaxshi", u"kitab"], input_orth, output_orth)
+    ipatranscriber.uyghur_latin_to_ipa_many([u"yaxshi", u"kitab"])
+
+def _orth(request, field):
+    """Return an orthography named in a request, checking it exists."""
+    orth = request.get(field)
+    if (not isinstance(orth, basestring) or
+            orth not in uyghurtransliterator.orth_key):
+        raise RequestError("%s is not an orthography (one of %s)" % (
+            json.dumps(orth),
+            ", ".join(sorted(uyghurtransliterator.orth_key))))
+    return orth
+
+def _texts(request, single, batch):
+    """Return the text(s) of a request and whether it was a batch."""
+    if batch in request:
+        texts = request[batch]
+        if (not isinstance(texts, list) or
+                not all(isinstance(text, basestring) for text in texts)):
+            raise RequestError("%r must be a list of strings" % batch)
+        return texts, True
+    if isinstance(request.get(single), basestring):
+        return [request[single]], False
+    raise RequestError("the request needs %r (a string) or %r (a list)" % (
+        single, batch))
+
+def transliterate_request(request):
+    """Answer a /transliterate request.
+
+    The request holds "text" (a string) or "texts" (a list of strings),
+    "from" (an orthography) and "to" (an orthography, or a list of them).
+    The result is the converted text(s); with a list of orthographies,
+    each converted text is an object with one member per orthography.
+    """
+    texts, batch = _texts(request, "text", "texts")
+    input_orth = _orth(request, "from")
+    if isinstance(request.get("to"), list):
+        output_orths = [_orth({"to": orth}, "to") for orth in request["to"]]
+        fan = get_fan_out(input_orth, output_orths)
+        results = [dict(zip(output_orths, fan.convert(text)))
+                   for text in texts]
+    else:
+        output_orth = _orth(request, "to")
+        results = uyghurtransliterator.transliterate_many(
+            texts, input_orth, output_orth)
+    return results if batch else results[0]
+
+def ipa_request(request):
+    """Answer an /ipa request.
+
+    The request holds "word" (a string) or "words" (a list of strings),
+    in Latin orthography; the result is their IPA transcription(s).
+    """
+    words, batch = _texts(request, "word", "words")
+    if batch:
+        return ipatranscriber.uyghur_latin_to_ipa_many(words)
+    return ipatranscriber.uyghur_latin_to_ipa(words[0])
+
+## what answers a POST to each path
+handlers = {
+    "/transliterate": transliterate_request,
+    "/ipa": ipa_request,
+}
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers JSON requests; connections are kept open between them."""
+
+    protocol_version = "HTTP/1.1"
+    log_requests = False
+
+    ## send each response in one piece rather than a packet per header,
+    ## which would stall on delayed ACKs
+    wbufsize = -1
+
+    def do_GET(self):
+        """Answer /orthographies (and /health, for monitoring)."""
+        if self.path == "/orthographies":
+            self.send_json(200, {"result": sorted(
+                uyghurtransliterator.orth_key,
+                key=uyghurtransliterator.orth_index)})
+        elif self.path == "/health":
+            self.send_json(200, {"result": "ok"})
+        else:
+            self.send_json(404, {"error": "no such path: %s" % self.path})
+
+    def do_POST(self):
+        """Answer a request to one of the paths in handlers."""
+        handler = handlers.get(self.path)
+        length = int(self.headers.getheader("content-length") or 0)
+        if length > MAX_REQUEST_SIZE:
+            self.close_connection = 1
+            self.send_json(413, {"error": "request too large"})
+            return
+        body = self.rfile.read(length)
+        if handler is None:
+            self.send_json(404, {"error": "no such path: %s" % self.path})
+            return
+        try:
+            request = json.loads(body.decode("utf-8"))
+            if not isinstance(request, dict):
+                raise RequestError("the request must be a JSON object")
+            result = handler(request)
+        except (ValueError, RequestError), e:
+            self.send_json(400, {"error": unicode(e)})
+            return
+        except Exception:
+            ## a bug, not a bad request: log it (even if requests aren't
+            ## logged) and keep serving
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, "error answering %s:\n%s", self.path,
+                traceback.format_exc())
+            self.send_json(500, {"error": "internal error"})
+            return
+        self.send_json(200, {"result": result})
+
+    def send_json(self, code, reply):
+        """Send a JSON response."""
+        body = json.dumps(reply, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        """Return the client's address (a Unix socket has none)."""
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        """Log a request to stderr, if requests are logged."""
+        if self.log_requests:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    """HTTP server on a TCP port, answering each client on its own thread."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+class ThreadingUnixHTTPServer(SocketServer.ThreadingMixIn,
+                              SocketServer.UnixStreamServer):
+    """HTTP server on a Unix socket, answering each client on its own thread."""
+
+    daemon_threads = True
+
+    def server_bind(self):
+        """Bind to the socket path, replacing a stale socket file."""
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """httplib connection to a server on a Unix socket."""
+
+    def __init__(self, path, timeout=30):
+        """Initialize a connection to the socket at path."""
+        httplib.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        """Connect to the socket."""
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class ServiceClient(object):
+    """Client for the service, keeping its connection open.
+
+    Not safe to share between threads; give each thread its own.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 socket_path=None):
+        """Initialize a client for the service at host:port or socket_path."""
+        if socket_path is not None:
+            self.connection = UnixHTTPConnection(socket_path)
+        else:
+            self.connection = httplib.HTTPConnection(host, port, timeout=30)
+
+    def call(self, path, request):
+        """Send a request to path and return its result.
+
+        Raises RequestError if the service turns the request down.
+        """
+        body = json.dumps(request)
+        try:
+            self.connection.request(
+                "POST", path, body,
+                {"Content-Type": "application/json"})
+            response = self.connection.getresponse()
+        except (httplib.HTTPException, socket.error):
+            ## the service may have closed the connection; try again once
+            self.connection.close()
+            self.connection.request(
+                "POST", path, body,
+                {"Content-Type": "application/json"})
+            response = self.connection.getresponse()
+        reply = json.loads(response.read().decode("utf-8"))
+        if response.status != 200:
+            raise RequestError(reply.get("error", response.reason))
+        return reply["result"]
+
+    def transliterate(self, texts, input_orth, output_orths):
+        """Transliterate a text (or a list of texts) on the service."""
+        key = "texts" if isinstance(texts, list) else "text"
+        return self.call("/transliterate", {
+            key: texts, "from": input_orth, "to": output_orths})
+
+    def ipa(self, words):
+        """Transcribe a word (or a list of words) on the service."""
+        key = "words" if isinstance(words, list) else "word"
+        return self.call("/ipa", {key: words})
+
+    def close(self):
+        """Close the connection."""
+        self.connection.close()
+
+def main(host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None,
+         log_requests=False):
+    """Compile the tables and serve requests until interrupted.
+
+    The service listens on socket_path if given, and on host:port
+    otherwise.
+    """
+    warm_up()
+    RequestHandler.log_requests = log_requests
+    if socket_path is not None:
+        server = ThreadingUnixHTTPServer(socket_path, RequestHandler)
+        where = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+        where = "http://%s:%d" % server.server_address[:2]
+    print("Serving on %s" % where, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=("Serve Uyghur transliteration and IPA transcription "
+                     "over HTTP, with the tables compiled once."))
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help="address to listen on (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help="port to listen on (default: %(default)s)")
+    parser.add_argument('--socket', metavar='PATH',
+                        help="listen on a Unix socket instead of a port")
+    parser.add_argument('--log', action='store_true',
+                        help="log every request to stderr")
+    args = parser.parse_args()
+    main(args.host, args.port, args.socket, args.log)
@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Check that converting a text in chunks gives the same as converting it whole.
+
+Random texts, made of pieces of each orthography's graphemes (so that
+chunk boundaries fall inside graphemes and between upper-case letters),
+are converted with iter_transliterate() and transliterate_file() in
+small chunks of random sizes, for every pair of orthographies, from
+text and from UTF-8 byte streams (whose chunks end inside characters).
+FanOut, which converts into every output orthography at once, must give
+what transliterate() gives for each of them, whole and in chunks. Run
+with `python check_streaming.py`.
+"""
+
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import uyghurtransliterator as ut
+
+## texts per pair of orthographies
+TEXTS = 200
+
+
+def random_texts(rng, transducer, count, length=40):
+    """Return count random texts built from a transducer's graphemes."""
+    graphemes = list(transducer.mapping)
+    pieces = graphemes + list(set(u"".join(graphemes))) + [
+        u" ", u"\n", u"\r\n", u".", u"x"]
+    return [u"".join(rng.choice(pieces)
+                     for _ in range(rng.randint(0, length)))
+            for _ in range(count)]
+
+
+class StreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(3)
+        self.pairs = [(input_orth, output_orth)
+                      for input_orth in sorted(ut.orth_key)
+                      for output_orth in sorted(ut.orth_key)]
+
+    def test_iter_transliterate(self):
+        for input_orth, output_orth in self.pairs:
+            transducer = ut.get_transducer(input_orth, output_orth)
+            for text in random_texts(self.rng, transducer, TEXTS):
+                chunk_size = self.rng.randint(1, 8)
+                chunks = ut.iter_transliterate(
+                    io.StringIO(text), input_orth, output_orth, chunk_size)
+                self.assertEqual(
+                    u"".join(chunks),
+                    ut.transliterate(text, input_orth, output_orth),
+                    "%s>%s, chunks of %d: %r" % (
+                        input_orth, output_orth, chunk_size, text))
+
+    def test_byte_stream(self):
+        for input_orth, output_orth in self.pairs:
+            transducer = ut.get_transducer(input_orth, output_orth)
+            for text in random_texts(self.rng, transducer, TEXTS // 4):
+                chunk_size = self.rng.randint(1, 8)
+                chunks = ut.iter_transliterate(
+                    io.BytesIO(text.encode("utf-8")), input_orth,
+                    output_orth, chunk_size)
+                self.assertEqual(
+                    u"".join(chunks),
+                    ut.transliterate(text, input_orth, output_orth),
+                    "%s>%s, chunks of %d bytes: %r" % (
+                        input_orth, output_orth, chunk_size, text))
+
+    def test_fan_out(self):
+        output_orths = sorted(ut.orth_key)
+        for input_orth in output_orths:
+            fan = ut.FanOut(input_orth, output_orths)
+            transducers = [ut.get_transducer(input_orth, output_orth)
+                           for output_orth in output_orths]
+            for _ in range(TEXTS // 4):
+                ## pieces of the graphemes of any of the targets
+                text = random_texts(self.rng, self.rng.choice(transducers),
+                                    1)[0]
+                expected = [ut.transliterate(text, input_orth, output_orth)
+                            for output_orth in output_orths]
+                self.assertEqual(fan.convert(text), expected,
+                                 "%s: %r" % (input_orth, text))
+                chunk_size = self.rng.randint(1, 8)
+                for stream in (io.StringIO(text),
+                               io.BytesIO(text.encode("utf-8"))):
+                    columns = zip(*fan.iter_convert(stream, chunk_size))
+                    self.assertEqual(
+                        [u"".join(column) for column in columns] or
+                        [u""] * len(output_orths), expected,
+                        "%s, chunks of %d: %r" % (input_orth, chunk_size,
+                                                  text))
+
+    def test_transliterate_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            input_file = os.path.join(directory, "input.txt")
+            output_file = os.path.join(directory, "output.txt")
+            for input_orth, output_orth in self.pairs:
+                transducer = ut.get_transducer(input_orth, output_orth)
+                text = u"".join(random_texts(self.rng, transducer, 50))
+                with io.open(input_file, "w", encoding="utf-8",
+                             newline="") as f:
+                    f.write(text)
+                ut.transliterate_file(input_file, output_file, input_orth,
+                                      output_orth,
+                                      chunk_size=self.rng.randint(1, 64))
+                with io.open(output_file, encoding="utf-8",
+                             newline="") as f:
+                    self.assertEqual(f.read(), ut.transliterate(
+                        text, input_orth, output_orth))
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
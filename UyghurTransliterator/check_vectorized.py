@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Check that converting a list of texts with NumPy gives the same as one by one.
+
+Lists of random short texts, made of pieces of each orthography's
+graphemes in both cases (and characters outside the tables), are
+converted with transliterate_many() and with transliterate() on each
+text, for every pair of orthographies. Run with
+`python check_vectorized.py`; it needs NumPy.
+"""
+
+import random
+import unittest
+
+import uyghurtransliterator as ut
+
+## lists per pair of orthographies, and texts per list
+LISTS = 20
+TEXTS = 200
+
+
+def random_texts(rng, transducer, count, length=10):
+    """Return count random short texts built from a transducer's graphemes."""
+    graphemes = list(transducer.mapping)
+    pieces = graphemes + list(set(u"".join(graphemes))) + [
+        u" ", u"-", u".", u"'", u"x", u"中", u"à"]
+    return [u"".join(rng.choice(pieces)
+                     for _ in range(rng.randint(0, length)))
+            for _ in range(count)]
+
+
+class VectorizedTest(unittest.TestCase):
+
+    def setUp(self):
+        if ut.numpy is None:
+            self.skipTest("NumPy isn't installed")
+        self.rng = random.Random(10)
+
+    def test_transliterate_many(self):
+        vectorized = 0
+        for input_orth in sorted(ut.orth_key):
+            for output_orth in sorted(ut.orth_key):
+                transducer = ut.get_transducer(input_orth, output_orth)
+                for _ in range(LISTS):
+                    texts = random_texts(self.rng, transducer, TEXTS)
+                    self.assertEqual(
+                        ut.transliterate_many(texts, input_orth, output_orth),
+                        [ut.transliterate(text, input_orth, output_orth)
+                         for text in texts],
+                        "%s>%s" % (input_orth, output_orth))
+                if transducer._vector_tables is not None:
+                    vectorized += 1
+        ## every pair but those from IPA, which has graphemes of three
+        ## characters
+        self.assertEqual(vectorized, len(ut.orth_key) * (len(ut.orth_key) - 1))
+
+    def test_separator_in_text(self):
+        texts = [u"yaxshi", u"ki\x00tab", u"Shing"]
+        self.assertEqual(ut.transliterate_many(texts, 'UyLatin', 'UyCyrillic'),
+                         [ut.transliterate(text, 'UyLatin', 'UyCyrillic')
+                          for text in texts])
+
+if __name__ == "__main__":
+    unittest.main()
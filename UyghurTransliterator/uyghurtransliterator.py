@@ -37,8 +37,48 @@
 
 from __future__ import print_function
 
+import argparse
 import codecs
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import re
 import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+## joins the texts given to Transducer.convert_many() (and the IPA
+## transcriber's uyghur_latin_to_ipa_many()) into one array
+_SEPARATOR = u'\x00'
+
+## characters that every transducer maps to themselves (see
+## _pass_through_table), built when the first transducer is
+_pass_through = None
+
+## the upper- and lower-case letters (see _letter_cases)
+_cases = None
+
+## private-use characters that stand in for multi-character graphemes in
+## Transducer.convert() (text that holds any of them is split instead)
+_PLACEHOLDERS_START = 0xE000
+_PLACEHOLDERS_SIZE = 256
+_placeholders = re.compile(u'[%s-%s]' % (
+    unichr(_PLACEHOLDERS_START),
+    unichr(_PLACEHOLDERS_START + _PLACEHOLDERS_SIZE - 1)))
+
+## number of characters that Transducer.convert() replaces and translates
+## at a time, so that each pass over the text stays in the processor cache
+_CONVERT_SLICE = 1 << 14
 
 def to_unicode_or_bust(obj, encoding='utf-8'):
     """Ensure that an object is unicode."""
@@ -48,9 +88,1049 @@ def to_unicode_or_bust(obj, encoding='utf-8'):
             obj = unicode(obj, encoding)
     return obj
 
+def _pass_through_table():
+    """Return a translation table mapping common characters to themselves.
+
+    unicode.translate() raises (and then catches) a LookupError for each
+    character missing from its table, which costs more than the lookup
+    itself, so every transducer's table starts from this one: ASCII, the
+    Latin blocks up to IPA, general punctuation, and the characters of
+    every orthography (in both cases). Any other character is still
+    passed through, just more slowly.
+    """
+    global _pass_through
+    if _pass_through is None:
+        codes = set(range(0x250))
+        codes.update(range(0x2000, 0x2070))
+        for row in uyghur_orthographies:
+            for cell in row:
+                if not isinstance(cell, int):
+                    codes.update(ord(char) for char in cell + cell.upper())
+        _pass_through = dict((code, code) for code in codes)
+    return _pass_through
+
+def _letter_cases():
+    """Return the upper-case and the lower-case letters, as two sets.
+
+    These are the letters among the characters of _pass_through_table();
+    any other character counts as having no case where a transducer
+    decides the case of its output from the neighbouring letters.
+    """
+    global _cases
+    if _cases is None:
+        chars = [unichr(code) for code in _pass_through_table()]
+        _cases = (frozenset(char for char in chars if char.isupper()),
+                  frozenset(char for char in chars if char.islower()))
+    return _cases
+
+def _character_class(chars):
+    """Return a regular expression matching any one of chars."""
+    return u'[' + u''.join(re.escape(char) for char in sorted(chars)) + u']'
+
+def replacement_order(graphemes):
+    """Return an order in which to replace graphemes one after another.
+
+    Replacing every occurrence of each grapheme in turn finds the same
+    graphemes as a left-to-right longest-match scan if u is replaced
+    before v whenever an occurrence of u can start before (or where) an
+    overlapping occurrence of v does: if v is part of u, or if an end of u
+    is a beginning of v (e.g. 'ng' before 'gh', for 'ngh'). Returns None
+    if these constraints have a cycle (e.g. 'ab' and 'ba').
+    """
+    after = dict((grapheme, set()) for grapheme in graphemes)
+    for u in graphemes:
+        for v in graphemes:
+            if u != v and (v in u or any(
+                    u.endswith(v[:size])
+                    for size in range(1, min(len(u), len(v))))):
+                after[v].add(u)
+    order = []
+    while after:
+        ready = sorted((grapheme for grapheme, earlier in after.items()
+                        if not earlier), key=lambda key: (-len(key), key))
+        if not ready:
+            return None
+        for grapheme in ready:
+            del after[grapheme]
+        for earlier in after.values():
+            earlier.difference_update(ready)
+        order.extend(ready)
+    return order
+
+## the building blocks of Transducer.convert_many(), which the IPA
+## transcriber's uyghur_latin_to_ipa_many() is built from as well (they
+## need NumPy)
+
+def vector_tables(mapping, size=0):
+    """Build lookup arrays for a mapping of graphemes of one or two characters.
+
+    Returns (size, width, single_len, single_out, pair_keys, pair_len,
+    pair_out): one row per code point below size (at least the given
+    size) with its output, padded to width, and the output's length
+    (characters without a mapping are their own output); and the
+    two-character graphemes, keyed by their code points (which fit in 21
+    bits) and sorted for numpy.searchsorted(), with their outputs.
+    """
+    width = max([len(value) for value in mapping.values()] + [1])
+    size = max([size] + [ord(char) + 1 for key in mapping for char in key])
+
+    single_len = numpy.ones(size, dtype=numpy.intp)
+    single_out = numpy.zeros((size, width), dtype=numpy.uint32)
+    single_out[:, 0] = numpy.arange(size)
+    for key, value in mapping.items():
+        if len(key) == 1:
+            single_len[ord(key)] = len(value)
+            single_out[ord(key)] = [ord(char) for char in value] + \
+                                   [0] * (width - len(value))
+
+    pairs = sorted(((ord(key[0]) << 21) | ord(key[1]), value)
+                   for key, value in mapping.items() if len(key) == 2)
+    pair_keys = numpy.array([key for key, _ in pairs], dtype=numpy.int64)
+    pair_len = numpy.array([len(value) for _, value in pairs],
+                           dtype=numpy.intp)
+    pair_out = numpy.zeros((len(pairs), width), dtype=numpy.uint32)
+    for row, (_, value) in enumerate(pairs):
+        pair_out[row, :len(value)] = [ord(char) for char in value]
+    return (size, width, single_len, single_out, pair_keys, pair_len,
+            pair_out)
+
+def pack_texts(texts):
+    """Return the code points of texts, joined by _SEPARATOR, as an array.
+
+    Returns None if a text contains the separator itself.
+    """
+    text = _SEPARATOR.join(texts)
+    if text.count(_SEPARATOR) != len(texts) - 1:
+        return None
+    return numpy.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+
+def map_singles(codes, size, single_len, single_out):
+    """Look every code point up in the tables of vector_tables().
+
+    Returns whether each code point is in the tables, its row (0 if it
+    isn't), and the length and the (padded) code points of its output.
+    Characters past the end of the tables are their own output.
+    """
+    in_table = codes < size
+    idx = numpy.where(in_table, codes, 0)
+    lengths = numpy.where(in_table, single_len[idx], 1)
+    out = single_out[idx]
+    out[~in_table, 0] = codes[~in_table]
+    return in_table, idx, lengths, out
+
+def map_pairs(codes, lengths, out, pair_keys, pair_len, pair_out):
+    """Replace the two-character graphemes in lengths and out.
+
+    The output of each grapheme goes to its first character, and its
+    second character's output is emptied. Returns the positions at which
+    the graphemes start.
+    """
+    if not len(pair_keys) or len(codes) < 2:
+        return numpy.zeros(0, dtype=numpy.intp)
+    keys = (codes[:-1].astype(numpy.int64) << 21) | codes[1:]
+    pos = numpy.searchsorted(pair_keys, keys)
+    pos[pos == len(pair_keys)] = 0
+    starts = pair_keys[pos] == keys
+    ## a run of overlapping graphemes (e.g. 'ngh') is matched from the
+    ## left, so only every other start in a run is kept
+    positions = numpy.arange(len(keys))
+    after_start = numpy.concatenate(([False], starts[:-1]))
+    run_begin = numpy.maximum.accumulate(
+        numpy.where(starts & ~after_start, positions, 0))
+    starts &= (positions - run_begin) % 2 == 0
+    starts = numpy.nonzero(starts)[0]
+    lengths[starts] = pair_len[pos[starts]]
+    out[starts] = pair_out[pos[starts]]
+    lengths[starts + 1] = 0
+    return starts
+
+def unpack_texts(out, lengths):
+    """Return the texts written out, as a list (see pack_texts)."""
+    flat = out[numpy.arange(out.shape[1]) < lengths[:, None]]
+    return flat.astype('<u4').tostring().decode('utf-32-le').split(
+        _SEPARATOR)
+
+class Transducer(object):
+    """Longest-match converter compiled from a grapheme mapping.
+
+    The text is converted in a single left-to-right scan: at each position
+    the longest grapheme in the mapping is replaced, and characters with no
+    mapping are passed through unchanged. Output is never rescanned, so one
+    rule's output can't be rewritten by another rule.
+    """
+
+    def __init__(self, mapping, name=None):
+        """Compile a transducer.
+
+        Parameters
+        ---------
+          mapping (dict): input grapheme (unicode) -> output (unicode)
+          name (str): e.g. 'UyLatin>UyArabic', to tell it apart in profiles
+        """
+        self.mapping = dict(mapping)
+        self.name = name
+        self.max_length = max([len(key) for key in self.mapping] or [1])
+        ## single characters are handled by unicode.translate() on the text
+        ## between multi-character graphemes; since a multi-character match
+        ## is always tried first, this gives the same result as a
+        ## character-by-character longest-match scan
+        self._singles = dict(_pass_through_table())
+        self._singles.update((ord(key), value)
+                             for key, value in self.mapping.items()
+                             if len(key) == 1)
+        multiples = sorted((key for key in self.mapping if len(key) > 1),
+                           key=lambda key: (-len(key), key))
+        ## no match can span a character that occurs in no multi-character
+        ## grapheme, so the text can always be cut right after one
+        self._joiners = frozenset(u''.join(multiples))
+        self._vector_tables = None
+        ## a single upper-case character whose output is capitalized but
+        ## longer than one letter (e.g. Cyrillic 'Ш' -> 'Sh') is written all
+        ## in upper case where it is part of an upper-case word: where the
+        ## next letter is upper-case too, or where the previous one is and
+        ## the next isn't lower-case ('ШИНЖАҢ' -> 'SHINJANG'); split()
+        ## returns these characters along with the multi-character graphemes
+        self._upper_outputs = dict(
+            (key, value.upper()) for key, value in self.mapping.items()
+            if len(key) == 1 and key.isupper() and key not in self._joiners
+            and value[:1].isupper() and value != value.upper())
+        self._graphemes = dict(self.mapping)
+        self._graphemes.update(self._upper_outputs)
+        pattern = [re.escape(key) for key in multiples]
+        if self._upper_outputs:
+            upper, lower = _letter_cases()
+            self._context = re.compile(u'%s(?:(?=%s)|(?<=%s.)(?!%s))' % (
+                _character_class(self._upper_outputs), _character_class(upper),
+                _character_class(upper), _character_class(lower)))
+            pattern.append(self._context.pattern)
+        else:
+            self._context = None
+        if pattern:
+            self._multiples = re.compile(u'(' + u'|'.join(pattern) + u')')
+        else:
+            self._multiples = None
+        ## where the order allows it (see replacement_order), convert()
+        ## replaces each multi-character grapheme with a private-use
+        ## placeholder instead, padded with a filler character to the same
+        ## length (which unicode.replace() does fastest, and far faster
+        ## than the text can be split), and a single translate() then
+        ## converts the placeholders and drops the fillers; the characters
+        ## written in upper case are marked with placeholders of their own
+        order = replacement_order(multiples)
+        if order is not None and \
+                len(order) + len(self._upper_outputs) < _PLACEHOLDERS_SIZE \
+                and not any(_placeholders.search(key) for key in multiples):
+            filler = _PLACEHOLDERS_START + _PLACEHOLDERS_SIZE - 1
+            self._replacements = [
+                (grapheme, unichr(_PLACEHOLDERS_START + idx) +
+                 unichr(filler) * (len(grapheme) - 1))
+                for idx, grapheme in enumerate(order)]
+            self._upper_marks = dict(
+                (char, unichr(_PLACEHOLDERS_START + idx))
+                for idx, char in enumerate(sorted(self._upper_outputs),
+                                           len(order)))
+            self._fused = dict(self._singles)
+            self._fused.update((_PLACEHOLDERS_START + idx,
+                                self.mapping[grapheme])
+                               for idx, grapheme in enumerate(order))
+            self._fused.update((ord(mark), self._upper_outputs[char])
+                               for char, mark in self._upper_marks.items())
+            self._fused[filler] = None
+            ## translate() writes an int faster than a one-character string
+            for code, value in self._fused.items():
+                if isinstance(value, unicode) and len(value) == 1:
+                    self._fused[code] = ord(value)
+        else:
+            self._replacements = None
+
+    def convert(self, text):
+        """Return the converted text."""
+        if profile is not None:
+            return profile.convert(self, text)
+        return self._convert(text)
+
+    def _convert(self, text):
+        """Return the converted text (never profiled)."""
+        if self._multiples is None:
+            return text.translate(self._singles)
+        if self._replacements is not None and \
+                not _placeholders.search(text):
+            out = []
+            start = 0
+            while start < len(text):
+                end = start + _CONVERT_SLICE
+                if end < len(text):
+                    ## (with nowhere to cut, the rest is converted at once)
+                    cut = self.boundary(text[start:end])
+                    end = start + cut if cut else len(text)
+                piece = text[start:end]
+                if self._context is not None:
+                    piece = self._context.sub(self._upper_mark, piece)
+                for grapheme, placeholder in self._replacements:
+                    piece = piece.replace(grapheme, placeholder)
+                out.append(piece.translate(self._fused))
+                start = end
+            return u''.join(out)
+        parts = self._multiples.split(text)
+        singles = self._singles
+        parts[0::2] = [part.translate(singles) for part in parts[0::2]]
+        parts[1::2] = map(self._graphemes.__getitem__, parts[1::2])
+        return u''.join(parts)
+
+    def _upper_mark(self, match):
+        """Return the placeholder of a character written in upper case."""
+        return self._upper_marks[match.group()]
+
+    def convert_many(self, texts):
+        """Convert a list of (short) texts, vectorized with NumPy.
+
+        Returns the same list as converting each text with convert(). The
+        texts are packed into one array of code points, single characters
+        are mapped with an array lookup and two-character graphemes are
+        found with vectorized masks. Texts are converted one at a time
+        instead if NumPy isn't installed, if a grapheme is longer than two
+        characters, or if a text contains the separator character.
+        """
+        texts = [to_unicode_or_bust(text) for text in texts]
+        if (numpy is None or profile is not None or self.max_length > 2 or
+                len(texts) < 2):
+            return [self.convert(text) for text in texts]
+        codes = pack_texts(texts)
+        if codes is None:
+            return [self.convert(text) for text in texts]
+        if self._vector_tables is None:
+            self._vector_tables = self._compile_vector_tables()
+        (size, width, single_len, single_out, pair_keys, pair_len, pair_out,
+         letter_case, upper_len, upper_out) = self._vector_tables
+
+        in_table, idx, lengths, out = map_singles(codes, size, single_len,
+                                                  single_out)
+
+        if letter_case is not None:
+            ## characters written in upper case (see __init__): 1 marks an
+            ## upper-case letter and -1 a lower-case one
+            case = numpy.where(in_table, letter_case[idx], 0)
+            next_case = numpy.concatenate((case[1:], [0]))
+            previous_case = numpy.concatenate(([0], case[:-1]))
+            marks = numpy.nonzero(
+                in_table & (upper_len[idx] > 0) &
+                ((next_case == 1) |
+                 ((previous_case == 1) & (next_case != -1))))[0]
+            lengths[marks] = upper_len[idx[marks]]
+            out[marks] = upper_out[idx[marks]]
+
+        map_pairs(codes, lengths, out, pair_keys, pair_len, pair_out)
+        return unpack_texts(out, lengths)
+
+    def _compile_vector_tables(self):
+        """Build the lookup arrays used by convert_many()."""
+        size = 0
+        if self._context is not None:
+            upper, lower = _letter_cases()
+            size = max(ord(char) + 1 for char in upper | lower)
+        tables = vector_tables(self.mapping, size)
+        size, width = tables[:2]
+
+        ## the case of each letter, and the upper-case output of the
+        ## characters written in upper case in an upper-case word (length
+        ## 0 for any other character)
+        if self._context is not None:
+            letter_case = numpy.zeros(size, dtype=numpy.int8)
+            letter_case[[ord(char) for char in upper]] = 1
+            letter_case[[ord(char) for char in lower]] = -1
+            upper_len = numpy.zeros(size, dtype=numpy.intp)
+            upper_out = numpy.zeros((size, width), dtype=numpy.uint32)
+            for key, value in self._upper_outputs.items():
+                upper_len[ord(key)] = len(value)
+                upper_out[ord(key)] = [ord(char) for char in value] + \
+                                      [0] * (width - len(value))
+        else:
+            letter_case = upper_len = upper_out = None
+
+        return tables + (letter_case, upper_len, upper_out)
+
+    def split(self, text):
+        """Split text at its multi-character graphemes.
+
+        Returns a list whose odd items are multi-character graphemes (and
+        the characters written in upper case in an upper-case word) and
+        whose even items are the runs of text between them.
+        """
+        if self._multiples is None:
+            return [text]
+        return self._multiples.split(text)
+
+    def convert_split(self, parts):
+        """Convert text split by another transducer's split().
+
+        The other transducer's multi-character graphemes must include this
+        one's, as a FanOut's segmenter does; graphemes this transducer has
+        no mapping for are converted character by character. A transducer
+        that decides the case of its output from the neighbouring letters
+        splits the text again itself.
+        """
+        if self._context is not None:
+            parts = self.split(u''.join(parts))
+        if profile is not None:
+            return profile.convert(self, parts=parts)
+        singles = self._singles
+        graphemes = self._graphemes
+        out = parts[:]
+        out[0::2] = [part.translate(singles) for part in parts[0::2]]
+        out[1::2] = [graphemes[part] if part in graphemes
+                     else self._convert(part) for part in parts[1::2]]
+        return u''.join(out)
+
+    def boundary(self, text, keep_case=None):
+        """Return where text can be cut without splitting a grapheme.
+
+        text[:boundary] converts the same way whatever follows it, so it
+        can be converted on its own and text[boundary:] carried over to the
+        next chunk of a stream. With keep_case (by default, if this
+        transducer decides the case of its output from the neighbouring
+        letters), letters with case are kept together as well.
+        """
+        if keep_case is None:
+            keep_case = self._context is not None
+        if self._multiples is None and not keep_case:
+            return len(text)
+        joiners = self._joiners
+        if keep_case:
+            ## the case of an output can depend on the letters on either
+            ## side, so cut only after a character that has no case (and
+            ## can't be part of a grapheme), or carry all of the text over
+            upper, lower = _letter_cases()
+            for idx in xrange(len(text) - 1, -1, -1):
+                char = text[idx]
+                if char not in joiners and char not in upper and \
+                        char not in lower:
+                    return idx + 1
+            return 0
+        for idx in xrange(len(text) - 1, -1, -1):
+            if text[idx] not in joiners:
+                return idx + 1
+        ## text is made up entirely of characters that can begin or end a
+        ## multi-character grapheme: cut before the last max_length - 1
+        ## characters, or after the grapheme that straddles that point
+        limit = len(text) - self.max_length + 1
+        if limit <= 0:
+            return 0
+        for match in self._multiples.finditer(text):
+            if match.end() <= limit:
+                continue
+            if match.start() < limit:
+                return match.end()
+            break
+        return limit
+
+orth_key = {
+    'IPA': 0,
+    'UyArabic': 1,
+    'UyLatin': 2,
+    'UyCyrillic': 3,
+    'ChineseLatin': 4,
+    'MengesLatin': 5,
+    'JarringLatin': 6,
+    'JarringArabic': 7,
+    'MalovLatin': 8
+}
+
+## one row per phoneme, one column per orthography (in orth_key order);
+## an int is a placeholder for a grapheme that an orthography lacks
+uyghur_orthographies = (
+    (u'a', u'\u0627', u'a', u'а', u'a', u'a', u'a', 7, u'а'),
+    (u'ɑ', u'\u0627', u'a', u'а', u'a', u'á', u'a', 7, 8),
+    (u'aː', u'\u0627', u'a', u'а', u'a', u'ā', u'aː', u'\u0627', 8),
+    (u'ɛ', u'\u06D5', u'e', u'е', u'e', u'ä', u'ɛ', u'\u06D5', u'ӓ'),
+    (u'æ', u'\u06D5', u'e', u'е', u'e', u'ä', u'æ', u'\u06D5', 8),
+    (u'b', u'\u0628', u'b', u'б', u'b', u'b', u'b', u'\u0628', u'б'),
+    (u'd', u'\u062F', u'd', u'д', u'd', u'd', u'd', u'\u062F', u'д'),
+    (u'e', u'\u06D0', u'ë', u'е', u'e', u'e', u'e', 7, u'е'),
+    (u'f', u'\u0641', u'f', u'ф', u'f', u'f', u'f', u'\u0641', 8),
+    (u'ɡ', u'\u06AF', u'g', u'г', u'g', u'g', u'g', u'\u06AF', u'г'),
+    (u'ɣ', u'\u063A', u'gh', u'ғ', u'ƣ', u'ɣ', u'ɣ', u'\u063A', u'ҕ'),
+    (u'h', u'\u0647', u'h', u'һ', u'ħ', u'h', u'h', u'\u0647', 8),
+    (u'χ', u'\u062E', u'x', u'х', u'h', u'x', u'χ', u'\u062E', u'х'),
+    (u'i', u'\u0649', u'i', u'и', u'i', u'i', u'i', u'\u0649', u'i'),
+    (u'ɨ', u'\u0649', u'i', u'и', u'i', u'i', u'ï', u'\u0649', u'ы'),
+    (u'dʒ', u'\u062C', u'j', u'ж', u'j', u'dž', u'dʒ', u'\u062C', u'з'),
+    (u'kʰ', u'\u0643', u'k', u'k', u'k', u'k', u'k', u'\u0643', u'k'),
+    (u'qʰ', u'\u0642', u'q', u'к', u'ḳ', u'q', u'q', u'\u0642', u'к'),
+    (u'l', u'\u0644', u'l', u'л', u'l', u'l', u'l', u'\u0644', u'л'),
+    (u'ł', u'\u0644', u'l', u'л', u'l', u'ł', u'l', u'\u0644', u'l'),
+    (u'm', u'\u0645', u'm', u'м', u'm', u'm', u'm', u'\u0645', u'м'),
+    (u'n', u'\u0646', u'n', u'н', u'n', u'n', u'n', u'\u0646', u'н'),
+    (u'ŋ', u'\u06AD', u'ng', u'ң', u'ng', u'ñ', u'ŋ', u'\u06AD', u'ң'),
+    (u'o', u'\u0648', u'o', u'о', u'o', u'o', u'o', u'\u0648', u'о'),
+    (u'ø', u'\u06C6', u'ö', u'ө', u'ɵ', u'ö', u'ö', u'\u0648', u'ӧ'),
+    (u'pʰ', u'\u067E', u'p', u'п', u'p', u'p', u'p', u'\u067E', u'п'),
+    (u'r', u'\u0631', u'r', u'р', u'r', u'r', u'r', u'\u0631', u'р'),
+    (u's', u'\u0633', u's', u'с', u's', u's', u's', u'\u0633', u'с'),
+    (u'ʃ', u'\u0634', u'sh', u'ш', u'x', u'š', u'š', u'\u0634', u'ш'),
+    (u'tʰ', u'\u062A', u't', u'т', u't', u't', u't', u'\u062A', u'т'),
+    (u'tʃʰ', u'\u0686', u'ch', u'ч', u'q', u'č', u'č', u'\u0686', u'ч'),
+    (u'u', u'\u06C7', u'u', u'у', u'u', u'u', u'u', u'\u0648', u'у'),
+    (u'ɯ', u'\u06C7', u'u', u'у', u'u', u'ŏ', u'ɯ', u'\u0648', 8),
+    (u'ʏ', u'\u06C7', u'u', u'у', u'u', u'ů', u'ů', u'\u0648', 8),
+    (u'y', u'\u06C8', u'ü', u'ү', u'ü', u'ü', u'ů', u'\u06C8', 8),
+    (u'yː', u'\u06C8', u'ü', u'ү', u'ü', u'ṻ', u'ůː', u'\u06C8', u'ӱ'),
+    (u'ŭ', u'\u06C7', u'u', u'у', u'u', u'u', u'ŭ', u'\u06C8', 8),
+    (u'w', u'\u06CB', u'w', u'в', u'w', u'w', u'v', u'\u06CB', u'в'),
+    (u'j', u'\u064A', u'y', u'й', u'y', u'j', u'j', 7, u'ĭ'),
+    (u'z', u'\u0632', u'z', u'з', u'z', u'z', u'z', u'\u0632', u'z'),
+    (u'ʒ', u'\u0698', u'zh', u'ж', u'zh', u'ž', 6, 7, u'з'),
+    (u'ʔ', u'\u0621', u"'", 3, u"'", u"'", u"'", 7, 8),
+    (0, u'\u0626', u'', 3, 4, 5, 6, 7, 8),
+    (0, u'\u06BE', u'h', 3, 4, 5, 6, 7, 8),
+)
+
+## orthographies that don't distinguish upper and lower case
+caseless_orths = ('IPA', 'UyArabic', 'JarringArabic')
+
+## number of characters read at a time when streaming a file
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+## approximate number of bytes per piece when one file is split across
+## worker processes
+DEFAULT_SPLIT_SIZE = 1 << 23
+
+## compiled transducers, shared by all UyghurString objects and evicted
+## least-recently-used first once there are more than _TRANSDUCER_CACHE_SIZE
+## (enough for every pair of orthographies, so a warmed-up process keeps them)
+_TRANSDUCER_CACHE_SIZE = len(orth_key) ** 2
+_transducer_cache = OrderedDict()
+_transducer_lock = threading.Lock()
+
+## rule-level profile of every conversion (a TransliterationProfile), or
+## None when conversions aren't profiled
+profile = None
+
+def orth_index(orth):
+    """Return the column of an orthography in uyghur_orthographies."""
+    try:
+        return orth_key[orth]
+    except KeyError:
+        raise ValueError("unknown orthography %r (must be one of %s)" % (
+            orth, ", ".join(sorted(orth_key, key=orth_key.get))))
+
+def orthography_mapping(input_orth, output_orth):
+    """Return the grapheme mapping between two orthographies.
+
+    Cells holding an int are placeholders for graphemes an orthography
+    lacks, so rows with a placeholder on either side are skipped, as are
+    rows with an empty input grapheme. Where several rows share an input
+    grapheme, the first row wins.
+
+    The table is lower-case; capitalized (and, for multi-character
+    graphemes, upper-case) input graphemes are added, mapped to the same
+    forms of their output, or to the plain output for the orthographies in
+    caseless_orths. Case is thus kept in the same pass as the conversion
+    (a Transducer writes a capitalized output in upper case where its input
+    is part of an upper-case word).
+    """
+    idx_c = orth_index(input_orth)
+    idx_d = orth_index(output_orth)
+
+    mapping = {}
+    for tup in uyghur_orthographies:
+        input_char = tup[idx_c]
+        output_char = tup[idx_d]
+
+        if isinstance(input_char, int) or isinstance(output_char, int):
+            pass
+        elif input_char:
+            mapping.setdefault(input_char, output_char)
+
+    cased = output_orth not in caseless_orths
+    case_variants = []
+    for input_char, output_char in sorted(mapping.items()):
+        title = input_char[:1].upper() + input_char[1:]
+        if cased:
+            case_variants.append(
+                (title, output_char[:1].upper() + output_char[1:]))
+        else:
+            case_variants.append((title, output_char))
+        if len(input_char) > 1:
+            case_variants.append(
+                (input_char.upper(),
+                 output_char.upper() if cased else output_char))
+    ## graphemes that are in the table keep their own mapping
+    for input_char, output_char in case_variants:
+        mapping.setdefault(input_char, output_char)
+
+    return mapping
+
+def get_transducer(input_orth, output_orth):
+    """Return the compiled transducer between two orthographies."""
+    key = (input_orth, output_orth)
+    with _transducer_lock:
+        try:
+            transducer = _transducer_cache.pop(key)
+        except KeyError:
+            transducer = Transducer(orthography_mapping(input_orth,
+                                                        output_orth),
+                                    "%s>%s" % key)
+        _transducer_cache[key] = transducer
+        while len(_transducer_cache) > _TRANSDUCER_CACHE_SIZE:
+            _transducer_cache.popitem(last=False)
+    return transducer
+
+def rules_version(input_orth, output_orth):
+    """Return a hash of the rules for converting between two orthographies.
+
+    The hash is of their grapheme mapping, so it only changes when a row of
+    uyghur_orthographies changes in one of the two columns (or an
+    orthography becomes caseless or cased).
+    """
+    mapping = sorted(orthography_mapping(input_orth, output_orth).items())
+    return hashlib.sha1(json.dumps(mapping)).hexdigest()
+
+def transliterate(input_string, input_orth, output_orth):
+    """Transliterate a string from one orthography to another.
+
+    Parameters
+    ---------
+      input_string (str): string containing Uyghur text
+      input_orth (str): input orthography (a key of orth_key)
+      output_orth (str): output orthography (a key of orth_key)
+    """
+    input_string = to_unicode_or_bust(input_string)
+    return get_transducer(input_orth, output_orth).convert(input_string)
+
+def transliterate_many(input_strings, input_orth, output_orth):
+    """Transliterate a list of (short) strings, e.g. lexicon entries.
+
+    Returns a list of strings. The strings are converted together in a
+    vectorized pass if NumPy is installed (see Transducer.convert_many).
+    """
+    return get_transducer(input_orth, output_orth).convert_many(
+        input_strings)
+
+def _read_chunks(stream, chunk_size=DEFAULT_CHUNK_SIZE, encoding='utf-8'):
+    """Yield the text of a stream as unicode, chunk by chunk.
+
+    Reads chunk_size characters (or bytes) at a time from stream (a
+    file-like object with a read() method). Bytes are decoded as they
+    come, so a character whose bytes fall across two chunks is decoded
+    whole.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if not isinstance(chunk, unicode):
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    ## (raises UnicodeDecodeError if the stream ends inside a character)
+    rest = decoder.decode(b'', True)
+    if rest:
+        yield rest
+
+def iter_transliterate(stream, input_orth, output_orth,
+                       chunk_size=DEFAULT_CHUNK_SIZE):
+    """Transliterate a text stream chunk by chunk.
+
+    Reads chunk_size characters at a time from stream (a file-like object
+    with a read() method; a byte stream is decoded as UTF-8, see
+    _read_chunks) and yields the transliterated text. Line breaks are
+    kept, and graphemes that fall across a chunk boundary are carried
+    over to the next chunk, so the output matches transliterate() on the
+    whole text while memory use stays flat.
+    """
+    transducer = get_transducer(input_orth, output_orth)
+
+    pending = u''
+    for chunk in _read_chunks(stream, chunk_size):
+        text = pending + chunk
+        cut = transducer.boundary(text)
+        pending = text[cut:]
+        if cut:
+            yield transducer.convert(text[:cut])
+
+    if pending:
+        yield transducer.convert(pending)
+
+def transliterate_file(input_file, output_file, input_orth, output_orth,
+                       chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream a file's transliteration into another file.
+
+    output_file may be the same file as input_file: the output is written
+    to a temporary file next to it, which then replaces it.
+    """
+    out_dir = os.path.dirname(os.path.abspath(output_file))
+    fd, tmp_name = tempfile.mkstemp(dir=out_dir, suffix='.tmp')
+    os.close(fd)
+    try:
+        with codecs.open(input_file, 'r', encoding='utf-8') as f_in:
+            with codecs.open(tmp_name, 'w', encoding='utf-8') as f_out:
+                for text in iter_transliterate(f_in, input_orth, output_orth,
+                                               chunk_size):
+                    f_out.write(text)
+        os.rename(tmp_name, output_file)
+    except:
+        os.remove(tmp_name)
+        raise
+
+def line_ranges(input_file, split_size=DEFAULT_SPLIT_SIZE):
+    """Split a file into pieces of about split_size bytes at line breaks.
+
+    Returns a list of (start, end) byte offsets. No grapheme spans a line
+    break, so each piece can be transliterated on its own.
+    """
+    size = os.path.getsize(input_file)
+    ranges = []
+    with open(input_file, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + split_size, size))
+            f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def _transliterate_file_job(job):
+    """Worker: transliterate one whole file (see transliterate_files)."""
+    input_file, output_file, input_orth, output_orth, chunk_size = job
+    transliterate_file(input_file, output_file, input_orth, output_orth,
+                       chunk_size)
+    return output_file
+
+def _transliterate_range_job(job):
+    """Worker: transliterate one piece of a file (see line_ranges)."""
+    input_file, start, end, input_orth, output_orth = job
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return transliterate(data.decode('utf-8'), input_orth, output_orth)
+
+def _map_jobs(func, jobs, workers):
+    """Yield func(job) for each job, in order, using a process pool."""
+    if workers == None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1 or len(jobs) <= 1:
+        for result in itertools.imap(func, jobs):
+            yield result
+        return
+    pool = multiprocessing.Pool(min(workers, len(jobs)))
+    try:
+        chunksize = max(1, len(jobs) // (workers * 4))
+        for result in pool.imap(func, jobs, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def transliterate_files(input_files, output_files, input_orth, output_orth,
+                        workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Transliterate many files, spread over a pool of worker processes.
+
+    Parameters
+    ---------
+      input_files (list): paths of the files to transliterate
+      output_files (list): paths to write them to, in the same order
+      input_orth (str): input orthography (a key of orth_key)
+      output_orth (str): output orthography (a key of orth_key)
+      workers (int): number of processes (default: one per CPU)
+
+    Each file is streamed (see iter_transliterate), so line breaks are
+    kept. Returns the output paths in input order.
+    """
+    jobs = [(input_file, output_file, input_orth, output_orth, chunk_size)
+            for input_file, output_file in zip(input_files, output_files)]
+    return list(_map_jobs(_transliterate_file_job, jobs, workers))
+
+def transliterate_file_parallel(input_file, output_file, input_orth,
+                                output_orth, workers=None,
+                                split_size=DEFAULT_SPLIT_SIZE):
+    """Transliterate one large file, split at line breaks across processes.
+
+    The pieces are written to output_file in their original order; as with
+    transliterate_file, output_file may be the input file.
+    """
+    jobs = [(input_file, start, end, input_orth, output_orth)
+            for start, end in line_ranges(input_file, split_size)]
+    out_dir = os.path.dirname(os.path.abspath(output_file))
+    fd, tmp_name = tempfile.mkstemp(dir=out_dir, suffix='.tmp')
+    os.close(fd)
+    try:
+        with codecs.open(tmp_name, 'w', encoding='utf-8') as f_out:
+            for text in _map_jobs(_transliterate_range_job, jobs, workers):
+                f_out.write(text)
+        os.rename(tmp_name, output_file)
+    except:
+        os.remove(tmp_name)
+        raise
+
+class FanOut(object):
+    """Converts text into several orthographies from one segmentation.
+
+    The text is split once into the graphemes of the input orthography,
+    i.e. into rows of uyghur_orthographies (the phonemes of the IPA
+    column), and every output orthography is then rendered from that one
+    split instead of rescanning the text for each of them.
+    """
+
+    def __init__(self, input_orth, output_orths):
+        """Compile the segmenter and the output tables.
+
+        Parameters
+        ---------
+          input_orth (str): input orthography (a key of orth_key)
+          output_orths (list): output orthographies (keys of orth_key)
+        """
+        self.input_orth = input_orth
+        self.output_orths = list(output_orths)
+        self.segmenter = Transducer(orthography_mapping(input_orth,
+                                                        input_orth))
+        self._targets = [get_transducer(input_orth, output_orth)
+                         for output_orth in self.output_orths]
+        self._keep_case = any(transducer._context is not None
+                              for transducer in self._targets)
+
+    def convert(self, text):
+        """Return the converted texts, in output_orths order."""
+        text = to_unicode_or_bust(text)
+        parts = self.segmenter.split(text)
+        return [transducer.convert_split(parts)
+                for transducer in self._targets]
+
+    def iter_convert(self, stream, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Yield lists of converted texts for a stream, chunk by chunk.
+
+        Like iter_transliterate(), but each item is a list holding the
+        chunk in every output orthography (in output_orths order).
+        """
+        pending = u''
+        for chunk in _read_chunks(stream, chunk_size):
+            text = pending + chunk
+            cut = self.segmenter.boundary(text, self._keep_case)
+            pending = text[cut:]
+            if cut:
+                yield self.convert(text[:cut])
+
+        if pending:
+            yield self.convert(pending)
+
+def fan_out(input_string, input_orth, output_orths):
+    """Transliterate a string into several orthographies at once.
+
+    Returns a dict mapping each output orthography to its text.
+    """
+    fan = FanOut(input_orth, output_orths)
+    return dict(zip(fan.output_orths, fan.convert(input_string)))
+
+def fan_out_file(input_file, output_files, input_orth, output_orths,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream a file into one output file per output orthography.
+
+    output_files holds the output paths, in output_orths order.
+    """
+    fan = FanOut(input_orth, output_orths)
+    streams = []
+    try:
+        for output_file in output_files:
+            streams.append(codecs.open(output_file, 'w', encoding='utf-8'))
+        with codecs.open(input_file, 'r', encoding='utf-8') as f_in:
+            for texts in fan.iter_convert(f_in, chunk_size):
+                for stream, text in zip(streams, texts):
+                    stream.write(text)
+    finally:
+        for stream in streams:
+            stream.close()
+
+def fan_out_tsv(input_file, output_file, input_orth, output_orths):
+    """Write a TSV with one row per input line and one column per orthography.
+
+    The first row holds the orthography names; the input line itself is in
+    the first column.
+    """
+    fan = FanOut(input_orth, output_orths)
+    with codecs.open(input_file, 'r', encoding='utf-8') as f_in:
+        with codecs.open(output_file, 'w', encoding='utf-8') as f_out:
+            f_out.write(u'\t'.join([input_orth] + fan.output_orths) + u'\n')
+            for line in f_in:
+                line = line.rstrip(u'\r\n')
+                f_out.write(u'\t'.join([line] + fan.convert(line)) + u'\n')
+
+class TransliterationProfile(object):
+    """Records what the transducers do, rule by rule.
+
+    While the module's profile is set to one of these, every conversion is
+    made through it (one text at a time, without NumPy), recording for each
+    transducer how often each grapheme was converted, the characters that
+    have no mapping and were passed through, and the time spent in each
+    pass of the conversion:
+
+      split: finding the multi-character graphemes
+      translate: converting the single characters between them
+      lookup: converting the multi-character graphemes
+      join: joining the output
+
+    Only the passes are timed, not the rules: each pass applies every rule
+    at once (one regular expression, one translation table), so a rule's
+    share of the time can only be guessed from its hits.
+    """
+
+    passes = ("split", "translate", "lookup", "join")
+
+    def __init__(self):
+        """Initialize an empty profile."""
+        self.lock = threading.Lock()
+        self.transducers = {}
+
+    def convert(self, transducer, text=None, parts=None):
+        """Convert text as transducer does, recording what happens.
+
+        Text already split by another transducer (see convert_split) is
+        given as parts instead.
+        """
+        started = time.time()
+        if parts is None:
+            parts = transducer.split(text)
+        split = time.time()
+        out = parts[:]
+        out[0::2] = [part.translate(transducer._singles)
+                     for part in parts[0::2]]
+        translated = time.time()
+        mapping = transducer.mapping
+        graphemes = transducer._graphemes
+        out[1::2] = [graphemes[part] if part in graphemes
+                     else transducer._convert(part) for part in parts[1::2]]
+        looked_up = time.time()
+        result = u''.join(out)
+        joined = time.time()
+
+        graphemes = Counter(part for part in parts[1::2] if part in mapping)
+        characters = Counter(u''.join(parts[0::2]))
+        characters.update(u''.join(part for part in parts[1::2]
+                                   if part not in mapping))
+        unmapped = Counter()
+        for char, count in characters.items():
+            if char in mapping:
+                graphemes[char] += count
+            else:
+                unmapped[char] = count
+        with self.lock:
+            stats = self.transducers.get(transducer.name)
+            if stats is None:
+                stats = self.transducers[transducer.name] = {
+                    "calls": 0, "characters": 0,
+                    "seconds": dict.fromkeys(self.passes, 0.0),
+                    "hits": Counter(), "unmapped": Counter(),
+                    "mapping": mapping}
+            stats["calls"] += 1
+            stats["characters"] += sum(len(part) for part in parts)
+            for name, start, end in zip(
+                    self.passes, (started, split, translated, looked_up),
+                    (split, translated, looked_up, joined)):
+                stats["seconds"][name] += end - start
+            stats["hits"].update(graphemes)
+            stats["unmapped"].update(unmapped)
+        return result
+
+    def rules(self, name, stats):
+        """Return the hits of each rule of a transducer.
+
+        For a transducer between two orthographies, the rules are the rows
+        of uyghur_orthographies, in order (case variants of a grapheme
+        count towards its row); a row whose grapheme is taken by an earlier
+        row never fires, and names that row as shadowed_by. For any other
+        transducer, they are its graphemes.
+        """
+        hits = stats["hits"]
+        try:
+            input_orth, output_orth = name.split(">")
+            idx_c, idx_d = orth_index(input_orth), orth_index(output_orth)
+        except (AttributeError, ValueError):
+            return [{"input": grapheme, "output": output,
+                     "hits": hits[grapheme]}
+                    for grapheme, output in sorted(stats["mapping"].items())]
+        rules = []
+        first = {}
+        for row, tup in enumerate(uyghur_orthographies):
+            grapheme, output = tup[idx_c], tup[idx_d]
+            if (isinstance(grapheme, int) or isinstance(output, int) or
+                    not grapheme):
+                continue
+            rule = {"row": row, "phoneme": tup[0], "input": grapheme,
+                    "output": output}
+            if grapheme in first:
+                rule["hits"] = 0
+                rule["shadowed_by"] = first[grapheme]
+            else:
+                first[grapheme] = row
+                variants = set([grapheme, grapheme.upper(),
+                                grapheme[:1].upper() + grapheme[1:]])
+                rule["hits"] = sum(hits[variant] for variant in variants)
+            rules.append(rule)
+        return rules
+
+    def report(self):
+        """Return the profile as a dict (e.g. for JSON), per transducer.
+
+        Each transducer has its calls, the characters converted, the
+        seconds spent in each pass, the hits of each rule and the unmapped
+        characters (most frequent first).
+        """
+        report = OrderedDict()
+        with self.lock:
+            for name in sorted(self.transducers, key=unicode):
+                stats = self.transducers[name]
+                report[unicode(name)] = OrderedDict([
+                    ("calls", stats["calls"]),
+                    ("characters", stats["characters"]),
+                    ("seconds", OrderedDict((step, stats["seconds"][step])
+                                            for step in self.passes)),
+                    ("rules", self.rules(name, stats)),
+                    ("unmapped", [OrderedDict([
+                        ("character", char),
+                        ("name", unicodedata.name(char, u"U+%04X" %
+                                                  ord(char))),
+                        ("count", count)])
+                        for char, count in stats["unmapped"].most_common()]),
+                ])
+        return report
+
+    def collapsed(self):
+        """Return the time spent in each pass as collapsed stacks.
+
+        One line per transducer and pass, e.g.
+        'transliterate;UyLatin>UyArabic;split 1520', counting microseconds,
+        as flame graph tools (e.g. flamegraph.pl) read them.
+        """
+        lines = []
+        with self.lock:
+            for name in sorted(self.transducers, key=unicode):
+                for step in self.passes:
+                    lines.append(u"transliterate;%s;%s %d" % (
+                        name, step,
+                        round(self.transducers[name]["seconds"][step] * 1e6)))
+        return u"".join(line + u"\n" for line in lines)
+
+    def save(self, path, format="json"):
+        """Write the profile to path, as JSON or as collapsed stacks."""
+        with codecs.open(path, 'w', encoding='utf-8') as f:
+            if format == "collapsed":
+                f.write(self.collapsed())
+            else:
+                f.write(json.dumps(self.report(), ensure_ascii=False,
+                                   indent=2))
+                f.write(u"\n")
+
 class UyghurString(object):
     """String object containing text in the Uyghur language."""
 
+    __slots__ = ('input_text', 'input_orth')
+
+    orth_key = orth_key
+    uyghur_orthographies = uyghur_orthographies
+
     def __init__(self, input_text, input_orth):
         """Initialize text object.
 
@@ -63,69 +1143,20 @@ class UyghurString(object):
         """
         self.input_text = input_text
         self.input_orth = input_orth
-        self.orth_key = {
-            'IPA': 0,
-            'UyArabic': 1,
-            'UyLatin': 2,
-            'UyCyrillic': 3,
-            'ChineseLatin': 4,
-            'MengesLatin': 5,
-            'JarringLatin': 6,
-            'JarringArabic': 7,
-            'MalovLatin': 8
-            }
-        self.uyghur_orthographies = (
-            (u'a', u'\u0627', u'a', u'а', u'a', u'a', u'a', 7, u'а'),
-            (u'ɑ', u'\u0627', u'a', u'а', u'a', u'á', u'a', 7, 8),
-            (u'aː', u'\u0627', u'a', u'а', u'a', u'ā', u'aː', u'\u0627', 8),
-            (u'ɛ', u'\u06D5', u'e', u'е', u'e', u'ä', u'ɛ', u'\u06D5', u'ӓ'),
-            (u'æ', u'\u06D5', u'e', u'е', u'e', u'ä', u'æ', u'\u06D5', 8),
-            (u'b', u'\u0628', u'b', u'б', u'b', u'b', u'b', u'\u0628', u'б'),
-            (u'd', u'\u062F', u'd', u'д', u'd', u'd', u'd', u'\u062F', u'д'),
-            (u'e', u'\u06D0', u'ë', u'е', u'e', u'e', u'e', 7, u'е'),
-            (u'f', u'\u0641', u'f', u'ф', u'f', u'f', u'f', u'\u0641', 8),
-            (u'ɡ', u'\u06AF', u'g', u'г', u'g', u'g', u'g', u'\u06AF', u'г'),
-            (u'ɣ', u'\u063A', u'gh', u'ғ', u'ƣ', u'ɣ', u'ɣ', u'\u063A', u'ҕ'),
-            (u'h', u'\u0647', u'h', u'һ', u'ħ', u'h', u'h', u'\u0647', 8),
-            (u'χ', u'\u062E', u'x', u'х', u'h', u'x', u'χ', u'\u062E', u'х'),
-            (u'i', u'\u0649', u'i', u'и', u'i', u'i', u'i', u'\u0649', u'i'),
-            (u'ɨ', u'\u0649', u'i', u'и', u'i', u'i', u'ï', u'\u0649', u'ы'),
-            (u'dʒ', u'\u062C', u'j', u'ж', u'j', u'dž', u'dʒ', u'\u062C', u'з'),
-            (u'kʰ', u'\u0643', u'k', u'k', u'k', u'k', u'k', u'\u0643', u'k'),
-            (u'qʰ', u'\u0642', u'q', u'к', u'ḳ', u'q', u'q', u'\u0642', u'к'),
-            (u'l', u'\u0644', u'l', u'л', u'l', u'l', u'l', u'\u0644', u'л'),
-            (u'ł', u'\u0644', u'l', u'л', u'l', u'ł', u'l', u'\u0644', u'l'),
-            (u'm', u'\u0645', u'm', u'м', u'm', u'm', u'm', u'\u0645', u'м'),
-            (u'n', u'\u0646', u'n', u'н', u'n', u'n', u'n', u'\u0646', u'н'),
-            (u'ŋ', u'\u06AD', u'ng', u'ң', u'ng', u'ñ', u'ŋ', u'\u06AD', u'ң'),
-            (u'o', u'\u0648', u'o', u'о', u'o', u'o', u'o', u'\u0648', u'о'),
-            (u'ø', u'\u06C6', u'ö', u'ө', u'ɵ', u'ö', u'ö', u'\u0648', u'ӧ'),
-            (u'pʰ', u'\u067E', u'p', u'п', u'p', u'p', u'p', u'\u067E', u'п'),
-            (u'r', u'\u0631', u'r', u'р', u'r', u'r', u'r', u'\u0631', u'р'),
-            (u's', u'\u0633', u's', u'с', u's', u's', u's', u'\u0633', u'с'),
-            (u'ʃ', u'\u0634', u'sh', u'ш', u'x', u'š', u'š', u'\u0634', u'ш'),
-            (u'tʰ', u'\u062A', u't', u'т', u't', u't', u't', u'\u062A', u'т'),
-            (u'tʃʰ', u'\u0686', u'ch', u'ч', u'q', u'č', u'č', u'\u0686', u'ч'),
-            (u'u', u'\u06C7', u'u', u'у', u'u', u'u', u'u', u'\u0648', u'у'),
-            (u'ɯ', u'\u06C7', u'u', u'у', u'u', u'ŏ', u'ɯ', u'\u0648', 8),
-            (u'ʏ', u'\u06C7', u'u', u'у', u'u', u'ů', u'ů', u'\u0648', 8),
-            (u'y', u'\u06C8', u'ü', u'ү', u'ü', u'ü', u'ů', u'\u06C8', 8),
-            (u'yː', u'\u06C8', u'ü', u'ү', u'ü', u'ṻ', u'ůː', u'\u06C8', u'ӱ'),
-            (u'ŭ', u'\u06C7', u'u', u'у', u'u', u'u', u'ŭ', u'\u06C8', 8),
-            (u'w', u'\u06CB', u'w', u'в', u'w', u'w', u'v', u'\u06CB', u'в'),
-            (u'j', u'\u064A', u'y', u'й', u'y', u'j', u'j', 7, u'ĭ'),
-            (u'z', u'\u0632', u'z', u'з', u'z', u'z', u'z', u'\u0632', u'z'),
-            (u'ʒ', u'\u0698', u'zh', u'ж', u'zh', u'ž', 6, 7, u'з'),
-            (u'ʔ', u'\u0621', u"'", 3, u"'", u"'", u"'", 7, 8),
-            (0, u'\u0626', u'', 3, 4, 5, 6, 7, 8),
-            (0, u'\u06BE', u'h', 3, 4, 5, 6, 7, 8),
-            )
 
     def as_string(self):
         """Read the input file's contents into a string."""
         with codecs.open(self.input_text, 'r+', encoding='utf-8') as f:
             return to_unicode_or_bust(f.read().replace(u'\n', u''))
 
+    def mapping(self, output_orth):
+        """Return the grapheme mapping from the input orthography."""
+        return orthography_mapping(self.input_orth, output_orth)
+
+    def transducer(self, output_orth):
+        """Return the compiled transducer for the output orthography."""
+        return get_transducer(self.input_orth, output_orth)
+
     def transliterate(self, output_orth, input_string=None):
         """Transliterate text to specified output orthography.
 
@@ -138,64 +1169,158 @@ class UyghurString(object):
         if input_string == None:
             input_string = self.as_string()
 
-        idx_c = self.orth_key[self.input_orth]
-        idx_d = self.orth_key[output_orth]
-
-        ## TODO: fix this case handling. This should give correct output for
-        ## the three orthographies that don't distinguish case, but it won't
-        ## transliterate an upper-case letter to another upper-case letter.
-        ## TODO: make an upper-case version of the orthography dict?
-        ## e.g., something like:
-        ## try:
-            ## upper_case = tup[idx_c].upper() ## for every entry?
-        caseless_orths = ['IPA', 'UyArabic', 'JarringArabic']
-        if output_orth in caseless_orths:
-            text_in = input_string.lower()
-            text_out = input_string.lower()
-        elif output_orth not in caseless_orths:
-            text_in = input_string
-            text_out = input_string
-        ## TODO: Make the above more elegant
-
-        for tup in self.uyghur_orthographies:
-            input_char = tup[idx_c]
-            output_char = tup[idx_d]
-
-            if isinstance(input_char, int) or isinstance(output_char, int):
-                pass
-            else:
-                text_out = text_out.replace(input_char, output_char)
+        return transliterate(input_string, self.input_orth, output_orth)
 
-        return text_out
+    def iter_transliterate(self, output_orth, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Yield the input file's transliteration chunk by chunk.
 
-def main(input_file, input_orth, output_orth, output_file=None):
+        Unlike transliterate(), line breaks in the input file are kept.
+        """
+        with codecs.open(self.input_text, 'r', encoding='utf-8') as f:
+            for text in iter_transliterate(f, self.input_orth, output_orth,
+                                           chunk_size):
+                yield text
+
+def main(input_file, input_orth, output_orth, output_file=None,
+         stream=False, chunk_size=DEFAULT_CHUNK_SIZE):
     """Convert file contents from one orthography to another."""
     if output_file == None:
         output_file = input_file
+    if stream:
+        transliterate_file(input_file, output_file, input_orth, output_orth,
+                           chunk_size)
+        return
     uy = UyghurString(input_file, input_orth)
+    ## transliterate before opening the output file, which may be the input
+    text = uy.transliterate(output_orth)
     with codecs.open(output_file, 'w+', encoding='utf-8') as stream:
-        stream.write(uy.transliterate(output_orth))
+        stream.write(text)
 
-if __name__ == "__main__":
-    if len(sys.argv) == 5:
-        in_file = sys.argv[1]  # input filename
-        in_orth = sys.argv[2]  # input orthography
-        out_orth = sys.argv[3] # output orthography
-        out_file = sys.argv[4] # output filename
+def batch_main(input_files, input_orth, output_orth, output_dir=None,
+               workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Convert many files, writing them to output_dir (or in place)."""
+    if output_dir == None:
+        output_files = list(input_files)
+    else:
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        output_files = [os.path.join(output_dir, os.path.basename(name))
+                        for name in input_files]
+    if len(set(output_files)) < len(output_files):
+        raise ValueError("several input files share an output file name")
+    return transliterate_files(input_files, output_files, input_orth,
+                               output_orth, workers, chunk_size)
 
-        main(in_file, in_orth, out_orth, out_file)
+def fan_out_main(input_file, input_orth, output_orths, output_file=None,
+                 tsv=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Convert a file into several orthographies in one pass.
 
-    elif len(sys.argv) == 4:
-        in_file = sys.argv[1]  # input filename
-        in_orth = sys.argv[2]  # input orthography
-        out_orth = sys.argv[3] # output orthography
+    output_orths is a comma-separated list of orthographies, or 'all' for
+    every orthography but the input one. With tsv, output_file (by default
+    the input file name with a .tsv extension) gets one column per
+    orthography; otherwise each orthography goes to its own file, named
+    after output_file (by default the input file) with the orthography
+    inserted before the extension, e.g. words.UyCyrillic.txt.
+    """
+    if output_orths == 'all':
+        output_orths = [orth for orth in sorted(orth_key, key=orth_key.get)
+                        if orth != input_orth]
+    else:
+        output_orths = output_orths.split(',')
+    base, ext = os.path.splitext(output_file or input_file)
+    if tsv:
+        fan_out_tsv(input_file, output_file or base + '.tsv', input_orth,
+                    output_orths)
+    else:
+        output_files = ['%s.%s%s' % (base, orth, ext) for orth in output_orths]
+        fan_out_file(input_file, output_files, input_orth, output_orths,
+                     chunk_size)
+
+def list_input_files(input_file, is_list=False):
+    """Return the files named by a directory or a file list.
 
-        main(in_file, in_orth, out_orth)
+    A directory stands for every file in it (in name order); with is_list,
+    input_file is a text file naming one input file per line.
+    """
+    if is_list:
+        with codecs.open(input_file, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    return sorted(os.path.join(input_file, name)
+                  for name in os.listdir(input_file)
+                  if os.path.isfile(os.path.join(input_file, name)))
 
+def parse_args(argv=None):
+    """Parse command-line arguments."""
+    orths = ", ".join("'%s'" % orth for orth in sorted(orth_key,
+                                                       key=orth_key.get))
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        epilog=("inputOrthography and outputOrthography must be one of "
+                "these: " + orths))
+    parser.add_argument('input_file', metavar='inputfilename.txt')
+    parser.add_argument('input_orth', metavar='inputOrthography')
+    parser.add_argument('output_orth', metavar='outputOrthography')
+    parser.add_argument('output_file', metavar='outputfilename.txt',
+                        nargs='?', default=None,
+                        help=("defaults to overwriting the input file; "
+                              "a directory when converting several files"))
+    parser.add_argument('--stream', action='store_true',
+                        help=("convert the file in chunks, in constant "
+                              "memory, keeping its line breaks"))
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=("characters read at a time with --stream "
+                              "(default: %(default)s)"))
+    parser.add_argument('--fan-out', action='store_true',
+                        help=("convert into several orthographies in one "
+                              "pass: outputOrthography is a comma-separated "
+                              "list, or 'all'"))
+    parser.add_argument('--tsv', action='store_true',
+                        help=("with --fan-out, write one TSV with a column "
+                              "per orthography instead of one file each"))
+    parser.add_argument('--list', action='store_true',
+                        help=("inputfilename.txt lists the files to convert, "
+                              "one per line (a directory input converts "
+                              "every file in it)"))
+    parser.add_argument('--workers', type=int, default=None,
+                        help=("number of worker processes (default: one per "
+                              "CPU when converting several files, one for a "
+                              "single file)"))
+    parser.add_argument('--split-size', type=int, default=DEFAULT_SPLIT_SIZE,
+                        help=("bytes per piece when a single file is split "
+                              "across several workers (default: "
+                              "%(default)s)"))
+    parser.add_argument('--profile', metavar='FILE',
+                        help=("record rule hits, unmapped characters and "
+                              "the time spent in each pass, and write them "
+                              "to FILE (runs in a single process)"))
+    parser.add_argument('--profile-format', choices=["json", "collapsed"],
+                        default="json",
+                        help=("JSON report, or collapsed stacks for flame "
+                              "graphs (default: %(default)s)"))
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.profile:
+        ## profiles aren't collected from worker processes
+        profile = TransliterationProfile()
+        args.workers = 1
+    if args.fan_out:
+        fan_out_main(args.input_file, args.input_orth, args.output_orth,
+                     args.output_file, tsv=args.tsv,
+                     chunk_size=args.chunk_size)
+    elif args.list or os.path.isdir(args.input_file):
+        batch_main(list_input_files(args.input_file, args.list),
+                   args.input_orth, args.output_orth, args.output_file,
+                   workers=args.workers, chunk_size=args.chunk_size)
+    elif args.workers != None and args.workers > 1:
+        transliterate_file_parallel(
+            args.input_file, args.output_file or args.input_file,
+            args.input_orth, args.output_orth, workers=args.workers,
+            split_size=args.split_size)
     else:
-        print("\nUSAGE:\n\tpython uyghurtransliterator.py "
-              "inputfilename.txt inputOrthography outputOrthography "
-              "(outputfilename.txt)\n\n"
-              "inputOrthograpy and outputOrthography must be one of these:\n"
-              "\t'IPA', 'UyArabic', 'UyLatin', 'UyCyrillic', 'ChineseLatin'\n"
-              "\t'MengesLatin', 'JarringLatin', 'JarringArabic', 'MalovLatin'\n")
+        main(args.input_file, args.input_orth, args.output_orth,
+             args.output_file, stream=args.stream,
+             chunk_size=args.chunk_size)
+    if profile is not None:
+        profile.save(args.profile, args.profile_format)
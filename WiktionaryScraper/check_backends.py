@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Check that the HTML and API backends read the same translations.
+
+Every term with a sample page in fixtures/wiki (and a few without) is
+looked up with HtmlBackend and ApiBackend against the stand-in server
+(see standinserver.py). Run with `python check_backends.py`.
+"""
+
+import os
+import StringIO
+import sys
+import threading
+import unittest
+
+import standinserver
+import wiktionaryscraper as scraper
+
+## terms without a sample page
+MISSING = [u"轻轻地", u"没有这个词"]
+
+
+def sample_terms():
+    """Return the terms with a sample page."""
+    names = os.listdir(os.path.join(standinserver.fixtures_dir, "wiki"))
+    return sorted(name.decode("utf-8")[:-len(".html")] for name in names
+                  if name.endswith(".html"))
+
+
+class BackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = sys.stdout
+        ## the scraper prints the 404s
+        sys.stdout = StringIO.StringIO()
+        self.server = standinserver.start_server()
+        scraper.response_cache = None
+        scraper.metrics = None
+        scraper.rate_limiter = None
+        scraper.http_client = scraper.HttpClient(retries=0)
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        scraper.http_client.close()
+        scraper.http_client = None
+        self.server.shutdown()
+        self.server.server_close()
+
+    def assertSameEntry(self, html, api):
+        self.assertEqual((html.english, html.english_short),
+                         (api.english, api.english_short))
+
+    def test_one_at_a_time(self):
+        html = scraper.HtmlBackend(self.server.base_url)
+        api = scraper.ApiBackend(self.server.base_url, max_delay=0)
+        for term in sample_terms() + MISSING:
+            html_entry = html.lookup(term)
+            self.assertSameEntry(html_entry, api.lookup(term))
+            self.assertEqual(bool(html_entry.english), term not in MISSING)
+
+    def test_batches(self):
+        terms = sample_terms() + MISSING
+        html = scraper.HtmlBackend(self.server.base_url)
+        api = scraper.ApiBackend(self.server.base_url, batch_size=len(terms),
+                                 max_delay=1)
+        entries = {}
+
+        def look_up(term):
+            entries[term] = api.lookup(term)
+
+        threads = [threading.Thread(target=look_up, args=(term,))
+                   for term in terms]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ## one query for all the terms, and one for the term a {{zh-see}}
+        ## refers to
+        self.assertEqual(
+            len([path for _, path in self.server.requests
+                 if path == "/w/api.php"]), 2)
+        for term in terms:
+            self.assertSameEntry(html.lookup(term), entries[term])
+
+    def test_continued(self):
+        ## replies too small for the wikitext of the whole batch
+        self.server.max_revisions = 2
+        terms = sample_terms() + MISSING
+        html = scraper.HtmlBackend(self.server.base_url)
+        api = scraper.ApiBackend(self.server.base_url, batch_size=len(terms))
+        wikitexts = api.query(terms)
+        self.assertEqual(sorted(wikitexts), sorted(terms))
+        self.assertEqual(
+            len([path for _, path in self.server.requests
+                 if path == "/w/api.php"]),
+            (len(sample_terms()) + 1) // 2)
+        for term in terms:
+            self.assertEqual(bool(wikitexts[term]), term not in MISSING)
+            self.assertSameEntry(html.lookup(term), api.lookup(term))
+
+    def test_translations(self):
+        resolver = scraper.TermResolver(
+            scraper.ApiBackend(self.server.base_url, max_delay=0))
+        self.assertEqual(resolver.resolve(u"小心"),
+                         u"to be careful, to take care (小心), ")
+        self.assertEqual(resolver.resolve(u"響應"),
+                         u"to respond, to answer (響應), ")
+        self.assertEqual(resolver.resolve(u"警告"),
+                         u"to warn, to admonish (警告), ")
+        self.assertEqual(resolver.resolve(MISSING[0]), u"")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Check the crawl against the stand-in server (see standinserver.py).
+
+Run with `python check_crawl.py`.
+"""
+
+import codecs
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+import standinserver
+import wiktionaryscraper as scraper
+
+## input rows, with a header, repeated terms and terms without a page
+ROWS = [u"Index,Mandarin\n",
+        u"48,生气，发怒\n",
+        u"4745,小心；轻轻地\n",
+        u"4746,响应\n",
+        u"4747,\n",
+        u"4748,響應\n",
+        u"4749,收集\n",
+        u"4750,提醒；生气\n",
+        u"4751,警告\n",
+        u"4752,没有这个词\n"] * 3
+
+
+class CrawlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.servers = []
+        self.stdout = sys.stdout
+        ## the scraper prints its progress
+        sys.stdout = StringIO.StringIO()
+        scraper.response_cache = None
+        scraper.metrics = None
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        scraper.rate_limiter = None
+        if scraper.http_client is not None:
+            scraper.http_client.close()
+            scraper.http_client = None
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.directory)
+
+    def crawl(self, workers, rate=1000.0, burst=100, **options):
+        """Crawl ROWS on a new stand-in server; returns the output."""
+        server = standinserver.start_server(**options)
+        self.servers.append(server)
+        scraper.rate_limiter = scraper.HostRateLimiter(rate, burst)
+        scraper.http_client = scraper.HttpClient(retries=3, backoff=0.01)
+        resolver = scraper.TermResolver(scraper.HtmlBackend(server.base_url))
+        path = os.path.join(self.directory, "output%d.txt" % len(self.servers))
+        with codecs.open(path, "w", encoding="utf-8") as stream:
+            written = scraper.crawl(scraper.read_rows(ROWS), stream, resolver,
+                                    workers)
+        self.assertEqual(written, len(ROWS) - 3)
+        with codecs.open(path, encoding="utf-8") as stream:
+            return stream.read(), server
+
+    def test_rows_in_input_order(self):
+        output, _ = self.crawl(workers=1)
+        lines = output.split(u"\n")[1:]
+        self.assertEqual(len(lines), len(ROWS) - 3)
+        self.assertEqual(lines[0], u"48;to get angry, to be mad (生气), "
+                                   u"(literary) to become angry, "
+                                   u"to get angry (发怒), ")
+        self.assertEqual(lines[1], u"4745;to be careful, to take care (小心), ")
+        self.assertEqual(lines[4], lines[2].replace(u"4746;", u"4748;")
+                                           .replace(u"响应", u"響應"))
+        self.assertEqual(lines[3], u"4747;")
+        self.assertEqual(lines[8], u"4752;")
+        self.assertEqual(self.crawl(workers=8)[0], output)
+
+    def test_rate_limit(self):
+        rate, burst = 20.0, 3
+        output, server = self.crawl(workers=8, rate=rate, burst=burst)
+        times = sorted(started for started, _ in server.requests)
+        ## no more than burst requests at once, and rate per second after
+        for first in range(len(times)):
+            for last in range(first + burst, len(times)):
+                self.assertGreaterEqual(
+                    times[last] - times[first],
+                    (last - first + 1 - burst) / rate - 0.01)
+        self.assertEqual(self.crawl(workers=1)[0], output)
+
+    def test_retries(self):
+        output, _ = self.crawl(workers=4)
+        failing, server = self.crawl(workers=4, fail_every=3)
+        self.assertEqual(failing, output)
+        ## every third request failed, and was asked again
+        self.assertGreater(len(server.requests),
+                           len(self.servers[0].requests))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,246 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##########
+## standinserver.py Version 0.1
+##
+## License: MIT ( http://opensource.org/licenses/MIT )
+##
+##########
+
+"""
+Serve saved Wiktionary pages locally, to test the scraper against.
+
+The pages in fixtures/wiki are served as /wiki/<term>, and their
+wikitext through /w/api.php: fixtures/api holds the API's reply to a
+query for each title, and a query for several titles gets them merged
+into one reply, as from the MediaWiki API. So
+
+    python standinserver.py --port 8765 &
+    python wiktionaryscraper.py --base-url http://127.0.0.1:8765 --no-cache
+
+crawls this server instead of en.wiktionary.org (with --backend html or
+api). A term without a saved page gets a 404, or is reported missing by
+the API, as on Wiktionary. The server can answer slowly, or with a 503
+every so often, to try the scraper's rate limiting and retries, and can
+hold only a few pages' wikitext per API reply, continuing the rest as
+the API does when a reply reaches its size limit.
+"""
+
+from __future__ import print_function
+
+import argparse
+import BaseHTTPServer
+import json
+import os
+import SocketServer
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+## saved pages, next to this script
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fixtures")
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves the fixtures, answering each client on its own thread.
+
+    Every request is recorded in requests as a (time, path) pair. Each
+    response is held back delay seconds, and every fail_every-th request
+    (if fail_every isn't 0) is answered with a 503 asking to retry at
+    once. With max_revisions, an API reply holds the wikitext of at most
+    that many pages, and asks for the rest to be continued.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, fixtures=fixtures_dir, delay=0.0,
+                 fail_every=0, max_revisions=0):
+        """Initialize a server on address (a (host, port) pair)."""
+        BaseHTTPServer.HTTPServer.__init__(self, address, FixtureHandler)
+        self.fixtures = fixtures
+        self.delay = delay
+        self.fail_every = fail_every
+        self.max_revisions = max_revisions
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        """Return the address to give the scraper as --base-url."""
+        return "http://%s:%d" % self.server_address[:2]
+
+    def count(self, path):
+        """Record a request; returns whether it is to fail."""
+        with self.lock:
+            self.requests.append((time.time(), path))
+            return bool(self.fail_every and
+                        len(self.requests) % self.fail_every == 0)
+
+    def page(self, kind, name, extension):
+        """Return the saved page for a name, or None if there is none."""
+        ## the name comes from the URL: keep it inside the fixtures
+        name = os.path.basename(name)
+        path = os.path.join(self.fixtures, kind, name + extension)
+        if not name or not os.path.isfile(path):
+            return None
+        with open(path, "rb") as page:
+            return page.read()
+
+    def query(self, titles, start=0):
+        """Return the API's reply to a query for the wikitext of titles.
+
+        The saved replies for the titles are merged into one; titles
+        without one are reported missing. Titles are normalized (spaces
+        for underscores) as the API does. If there is a max_revisions,
+        only the wikitext of the pages from start on fits in the reply
+        (the other pages are listed without it), and the reply says where
+        to continue.
+        """
+        query = {"normalized": [], "redirects": [], "pages": []}
+        for title in titles:
+            name = title.replace("_", " ")
+            if name != title:
+                query["normalized"].append({"fromencoded": False,
+                                            "from": title, "to": name})
+            saved = self.page("api", name.encode("utf-8"), ".json")
+            if saved is None:
+                query["pages"].append({"ns": 0, "title": name,
+                                       "missing": True})
+                continue
+            reply = json.loads(saved)["query"]
+            for key in ("redirects", "pages"):
+                query[key].extend(reply.get(key, []))
+        for key in ("normalized", "redirects"):
+            if not query[key]:
+                del query[key]
+        reply = {"batchcomplete": True, "query": query}
+        if self.max_revisions:
+            pages = [page for page in query["pages"] if "revisions" in page]
+            end = start + self.max_revisions
+            for page in pages[:start] + pages[end:]:
+                del page["revisions"]
+            if end < len(pages):
+                del reply["batchcomplete"]
+                reply["continue"] = {"rvcontinue": str(end),
+                                     "continue": "||"}
+        return reply
+
+
+class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers requests for the saved pages; connections are kept open."""
+
+    protocol_version = "HTTP/1.1"
+    log_requests = False
+
+    ## send each response in one piece rather than a packet per header,
+    ## which would stall on delayed ACKs
+    wbufsize = -1
+
+    def do_GET(self):
+        """Answer /wiki/<term> and /w/api.php from the saved pages."""
+        parts = urlparse.urlsplit(self.path)
+        failing = self.server.count(parts.path)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if failing:
+            self.send_body(503, "Service Unavailable\n", "text/plain",
+                           {"Retry-After": "0"})
+        elif parts.path.startswith("/wiki/"):
+            term = urllib.unquote(parts.path[len("/wiki/"):])
+            self.send_page(self.server.page("wiki", term, ".html"),
+                           "text/html; charset=UTF-8")
+        elif parts.path == "/w/api.php":
+            params = urlparse.parse_qs(parts.query)
+            titles = params.get("titles", [""])[0].decode("utf-8")
+            start = int(params.get("rvcontinue", ["0"])[0])
+            reply = self.server.query(titles.split("|") if titles else [],
+                                      start)
+            self.send_body(200, json.dumps(reply, ensure_ascii=False)
+                           .encode("utf-8"),
+                           "application/json; charset=utf-8")
+        else:
+            self.send_body(404, "Not Found\n", "text/plain")
+
+    def send_page(self, body, content_type):
+        """Send a saved page, or a 404 if there is none."""
+        if body is None:
+            self.send_body(404, "Not Found\n", "text/plain")
+        else:
+            self.send_body(200, body, content_type)
+
+    def send_body(self, code, body, content_type, headers={}):
+        """Send a response."""
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Log a request to stderr, if requests are logged."""
+        if self.log_requests:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+
+def start_server(host=DEFAULT_HOST, port=0, **options):
+    """Start a StandInServer on a thread of its own and return it.
+
+    Port 0 picks a free port (see base_url); options are passed on to
+    StandInServer. Stop the server with its shutdown() and server_close().
+    """
+    server = StandInServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(host=DEFAULT_HOST, port=DEFAULT_PORT, delay=0.0, fail_every=0,
+         log_requests=False, max_revisions=0):
+    """Serve the fixtures until interrupted."""
+    FixtureHandler.log_requests = log_requests
+    server = StandInServer((host, port), delay=delay, fail_every=fail_every,
+                           max_revisions=max_revisions)
+    print("Serving %s on %s" % (server.fixtures, server.base_url),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=("Serve saved Wiktionary pages locally, to test the "
+                     "scraper against (see --base-url)."))
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help="address to listen on (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help="port to listen on (default: %(default)s)")
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help=("seconds each response is held back "
+                              "(default: %(default)s)"))
+    parser.add_argument('--fail-every', type=int, default=0, metavar='N',
+                        help=("answer every Nth request with a 503 "
+                              "(default: never)"))
+    parser.add_argument('--max-revisions', type=int, default=0,
+                        metavar='N',
+                        help=("wikitext of at most N pages per API reply, "
+                              "the rest continued (default: no limit)"))
+    parser.add_argument('--log', action='store_true',
+                        help="log every request to stderr")
+    args = parser.parse_args()
+    main(args.host, args.port, args.delay, args.fail_every, args.log,
+         args.max_revisions)
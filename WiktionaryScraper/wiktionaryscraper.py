@@ -55,16 +55,99 @@ in the output.
 
 #from __future__ import unicode_literals
 from bs4 import BeautifulSoup as Soup
+from bs4 import SoupStrainer
 from urllib import FancyURLopener
+import urllib
 import urllib2
+import urlparse
+import argparse
+import bz2
 import codecs
+import contextlib
+import httplib
+import io
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import Queue
+from collections import OrderedDict
+import sqlite3
 import time
-import random
+import zlib
+import xml.etree.cElementTree as ElementTree
+
+## lxml parses pages several times faster than Python's own HTML parser
+try:
+    import lxml
+    html_parser = "lxml"
+except ImportError:
+    html_parser = "html.parser"
 
 input_file = "uyghurchineseitemswithindex.txt"
 
 results_file = "wiktionaryoutput.txt"
 
+## (Wikimedia redirects plain http to https, which would cost a round trip
+## and a rate-limiter token per request)
+wiktionary_url = "https://en.wiktionary.org"
+
+## default number of rows looked up at the same time
+DEFAULT_WORKERS = 4
+
+## default number of requests per second to each host, and the number of
+## requests that may be sent at once after an idle spell
+DEFAULT_RATE = 2.0
+DEFAULT_BURST = 4
+
+## rate limiter shared by all requests (see fetch)
+rate_limiter = None
+
+## pooled connections shared by all requests (see fetch), and how often
+## a request is retried after a connection error, 429 or 5xx response
+http_client = None
+DEFAULT_RETRIES = 3
+
+## measurements of the crawl (see CrawlMetrics), and how often they are
+## written out
+metrics = None
+DEFAULT_METRICS_INTERVAL = 10
+
+## on-disk cache of downloaded pages shared by all requests (see fetch)
+cache_file = "wiktionarycache.sqlite"
+response_cache = None
+
+## most titles the MediaWiki API accepts in one query, and the longest a
+## partly filled batch waits for more titles
+API_BATCH_SIZE = 50
+API_BATCH_DELAY = 0.05
+
+## index of the Chinese entries in a Wiktionary dump (see DumpIndex)
+index_file = "wiktionaryindex.sqlite"
+
+## file recording how far a crawl has got (see Checkpoint), and how many
+## rows are written between updates of it
+checkpoint_file = results_file + ".checkpoint"
+DEFAULT_CHECKPOINT_EVERY = 100
+
+## default number of distinct terms whose translations are remembered
+DEFAULT_MAX_TERMS = 100000
+
+## default number of days a cached page is used before it is downloaded again
+DEFAULT_CACHE_TTL = 30
+
+## counter to track the number of pages crawled
+pages_crawled = 0
+pages_crawled_lock = threading.Lock()
+
+## where the scraper's messages (failed requests, and the count of pages
+## crawled) are printed, None for stdout, and whether the count is
+## printed at all (see say)
+message_stream = None
+show_progress = True
+
 
 class MyOpener(FancyURLopener):
     """FancyURLopener object with custom User-Agent field."""
@@ -79,6 +162,505 @@ class MyOpener(FancyURLopener):
     version = ("Translation scraper created by Matt Menzenski. "
                "See www.menzenski.com/scraper for more information.")
 
+class TokenBucket(object):
+    """Token-bucket rate limiter, safe to share between threads.
+
+    Tokens are added at rate per second, up to burst; each request takes
+    one, waiting for it if the bucket is empty.
+    """
+
+    def __init__(self, rate, burst=1):
+        """Initialize a full bucket."""
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available.
+
+        Returns the number of seconds spent waiting.
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            ## a negative balance is a debt that this caller sleeps off,
+            ## outside the lock, while later callers queue behind it
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+        return delay
+
+class HostRateLimiter(object):
+    """One TokenBucket per host."""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        """Initialize a limiter with no buckets yet."""
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, url):
+        """Wait for the bucket of the url's host (see TokenBucket.acquire)."""
+        host = urlparse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            bucket = self.buckets[host]
+        return bucket.acquire()
+
+class Histogram(object):
+    """Counts of values falling under each of a list of bounds."""
+
+    def __init__(self, bounds):
+        """Initialize an empty histogram with ascending bounds."""
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, value):
+        """Count a value."""
+        bucket = 0
+        while bucket < len(self.bounds) and value > self.bounds[bucket]:
+            bucket += 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, fraction):
+        """Return the bound under which fraction of the values fall."""
+        needed = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= needed:
+                return bound
+        return self.max
+
+    def as_dict(self):
+        """Return the histogram as a dict (for JSON)."""
+        return {"count": self.count, "sum": self.total, "max": self.max,
+                "buckets": [[bound, count] for bound, count in
+                            zip(list(self.bounds) + [None], self.counts)]}
+
+class CrawlMetrics(object):
+    """Counters and histograms of a crawl, safe to share between threads.
+
+    Counters are totals (requests, bytes, cache hits, seconds spent
+    throttled, ...); histograms hold the distribution of a measurement
+    (request latency, parse time, definitions found per row).
+    """
+
+    ## histogram bounds, in seconds unless listed here
+    seconds = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+               2.5, 5, 10, 30)
+    bounds = {"definitions": (0, 1, 2, 3, 4, 5, 10)}
+
+    def __init__(self):
+        """Initialize metrics with nothing counted yet."""
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, value=1):
+        """Add value to a counter."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Add a measurement to a histogram."""
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(
+                    self.bounds.get(name, self.seconds))
+            self.histograms[name].add(value)
+
+    def snapshot(self):
+        """Return all the metrics so far as a dict (for JSON)."""
+        with self.lock:
+            return {"time": time.time(),
+                    "elapsed": time.time() - self.started,
+                    "counters": dict(self.counters),
+                    "histograms": dict(
+                        (name, histogram.as_dict())
+                        for name, histogram in self.histograms.items())}
+
+    def export(self, stream):
+        """Write a snapshot to stream as a line of JSON."""
+        stream.write(json.dumps(self.snapshot(), sort_keys=True) + "\n")
+        stream.flush()
+
+    def summary(self):
+        """Return a few lines summing up the crawl so far."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        get = counters.get
+        lines = ["%.1f s elapsed" % (time.time() - self.started)]
+        request = histograms.get("request")
+        if request is not None:
+            lines.append(
+                "requests: %d (%.1f kB), latency mean %.0f ms, "
+                "p95 under %.0f ms, max %.0f ms" % (
+                    request.count, get("bytes", 0) / 1000.0,
+                    request.total / request.count * 1000,
+                    request.quantile(0.95) * 1000, request.max * 1000))
+        lines.append("cache: %d hits, %d misses" % (
+            get("cache_hits", 0), get("cache_misses", 0)))
+        lines.append("retries: %d (%.1f s waiting), errors: %d" % (
+            get("retries", 0), get("retry_seconds", 0), get("errors", 0)))
+        lines.append("throttled: %.1f s (added up over all threads)" %
+                     get("throttle_seconds", 0))
+        parse = histograms.get("parse")
+        if parse is not None:
+            lines.append("parsing: %d pages, %.2f s, p95 under %.0f ms" % (
+                parse.count, parse.total, parse.quantile(0.95) * 1000))
+        definitions = histograms.get("definitions")
+        if definitions is not None:
+            lines.append(
+                "definitions per row: mean %.2f, %d rows without any" % (
+                    definitions.total / definitions.count,
+                    definitions.counts[0]))
+        return "\n".join(lines)
+
+class MetricsExporter(threading.Thread):
+    """Thread writing a CrawlMetrics snapshot to a file every so often."""
+
+    def __init__(self, metrics, path, interval=DEFAULT_METRICS_INTERVAL):
+        """Initialize an exporter appending JSON lines to path."""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        """Write a snapshot every interval seconds, and once stopped."""
+        with open(self.path, "a") as stream:
+            while not self.stopped.wait(self.interval):
+                self.metrics.export(stream)
+            self.metrics.export(stream)
+
+    def stop(self):
+        """Write a last snapshot and stop."""
+        self.stopped.set()
+        self.join()
+
+def record(name, value=1):
+    """Add value to a counter of the crawl's metrics, if they're kept."""
+    if metrics is not None:
+        metrics.add(name, value)
+
+def observe(name, value):
+    """Add a measurement to the crawl's metrics, if they're kept."""
+    if metrics is not None:
+        metrics.observe(name, value)
+
+@contextlib.contextmanager
+def measure(name):
+    """Time a block of code into a histogram of the crawl's metrics."""
+    started = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - started)
+
+class HttpClient(object):
+    """HTTP client that keeps connections open and reuses them.
+
+    Idle connections are pooled per host (up to max_idle of them), so a
+    request normally doesn't open a new connection, let alone do a new TLS
+    handshake. Responses may be gzip-compressed and redirects are
+    followed. Connection errors, 429 and 5xx responses are retried up to
+    retries times, waiting backoff seconds and twice as long each time
+    after, or as long as a Retry-After header asks. Requests wait for the
+    rate limiter, retries included.
+    """
+
+    redirect_codes = (301, 302, 303, 307, 308)
+    max_redirects = 5
+
+    def __init__(self, retries=DEFAULT_RETRIES, backoff=1.0, timeout=30,
+                 max_idle=16):
+        """Initialize a client with no connections yet."""
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.headers = {"User-Agent": MyOpener.version,
+                        "Accept-Encoding": "gzip",
+                        "Connection": "keep-alive"}
+
+    def get(self, url):
+        """Return the body of the page at url.
+
+        Raises urllib2.HTTPError for an error response (once retries are
+        used up) and urllib2.URLError if the server can't be reached.
+        """
+        for _ in range(self.max_redirects + 1):
+            response, body = self._request(url)
+            if response.status not in self.redirect_codes:
+                break
+            url = urlparse.urljoin(url, response.getheader("location", ""))
+        if response.status >= 400 or response.status in self.redirect_codes:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, None)
+        if response.getheader("content-encoding", "").lower() == "gzip":
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return body
+
+    def _request(self, url):
+        """GET url, retrying; returns the response and its body."""
+        parts = urlparse.urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        ## terms go into URLs as they are, so quote them here (as
+        ## FancyURLopener used to)
+        path = urllib.quote(parts.path or "/", safe="/%:@&=+$,;~!*'()")
+        if parts.query:
+            path += "?" + parts.query
+        attempt = 0
+        while True:
+            connection, reused = self._connection(host)
+            if rate_limiter is not None:
+                record("throttle_seconds", rate_limiter.acquire(url))
+            started = time.time()
+            try:
+                connection.request("GET", path, headers=self.headers)
+                response = connection.getresponse()
+                body = response.read()
+                observe("request", time.time() - started)
+                record("bytes", len(body))
+            except (httplib.HTTPException, socket.error), e:
+                connection.close()
+                ## the server may have closed an idle connection; that's
+                ## worth a retry on a new one, without waiting
+                if reused:
+                    continue
+                if attempt >= self.retries:
+                    raise urllib2.URLError(e)
+                delay = None
+            else:
+                if response.will_close:
+                    connection.close()
+                else:
+                    self._release(host, connection)
+                if (response.status != 429 and response.status < 500
+                        or attempt >= self.retries):
+                    return response, body
+                delay = _retry_after(response.getheader("retry-after"))
+            if delay is None:
+                delay = self.backoff * 2 ** attempt
+            record("retries")
+            record("retry_seconds", delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _connection(self, host):
+        """Return an idle connection to host, or a new one.
+
+        Returns the connection and whether it was used before.
+        """
+        with self.lock:
+            idle = self.idle.get(host)
+            if idle:
+                return idle.pop(), True
+        scheme, netloc = host
+        if scheme == "https":
+            return httplib.HTTPSConnection(netloc,
+                                           timeout=self.timeout), False
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _release(self, host, connection):
+        """Put a connection back in its host's pool."""
+        with self.lock:
+            idle = self.idle.setdefault(host, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self.lock:
+            for idle in self.idle.values():
+                for connection in idle:
+                    connection.close()
+            self.idle = {}
+
+def _retry_after(value):
+    """Return the seconds a Retry-After header asks for, or None."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+def say(message):
+    """Print a message to message_stream (or stdout)."""
+    print >> (message_stream or sys.stdout), message
+
+def default_workers(backend):
+    """Return how many rows to look up at the same time with a backend.
+
+    A batch of the "api" backend can only fill up with as many titles as
+    there are threads looking terms up.
+    """
+    if backend == "api":
+        return API_BATCH_SIZE
+    return DEFAULT_WORKERS
+
+def describe_error(url, e):
+    """Return a one-line description of a failed request."""
+    if isinstance(e, urllib2.HTTPError):
+        return "HTTP %d (%s) for %s" % (e.code, e.msg, url)
+    return "%s for %s" % (getattr(e, "reason", e), url)
+
+def missing_page(e):
+    """Return whether a failed request failed because there's no such page."""
+    return getattr(e, "code", None) in (404, 410)
+
+class ResponseCache(object):
+    """Persistent cache of downloaded pages, in an SQLite database.
+
+    Pages are stored compressed, keyed by URL (which holds the term) along
+    with the term they were fetched for. Pages older than ttl seconds are
+    treated as missing, and once the stored pages take up more than
+    max_bytes the least recently used are deleted. In offline mode, pages
+    that aren't in the cache aren't downloaded at all, and pages older
+    than ttl are used anyway, since they can't be downloaded again.
+    """
+
+    def __init__(self, path, ttl=None, max_bytes=None, offline=False):
+        """Open (or create) the cache database at path."""
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "url TEXT PRIMARY KEY, term TEXT, body BLOB, "
+                "size INTEGER, fetched REAL, used REAL)")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS pages_used ON pages (used)")
+        ## the size of the stored pages, counted once and then kept up to
+        ## date by put() and _evict()
+        self.total = None
+        if max_bytes is not None:
+            self.total = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def get(self, url):
+        """Return the cached page at url, or None."""
+        url = _to_unicode(url)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT body, fetched FROM pages WHERE url = ?",
+                (url,)).fetchone()
+            if row is None:
+                return None
+            body, fetched = row
+            if (self.ttl is not None and not self.offline and
+                    time.time() - fetched > self.ttl):
+                return None
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE pages SET used = ? WHERE url = ?",
+                    (time.time(), url))
+        return zlib.decompress(body)
+
+    def put(self, url, body, term=None):
+        """Store the page at url, evicting old pages if the cache is full."""
+        data = zlib.compress(body)
+        now = time.time()
+        url = _to_unicode(url)
+        with self.lock:
+            with self.connection:
+                if self.max_bytes is not None:
+                    ## a page stored again replaces the old copy
+                    row = self.connection.execute(
+                        "SELECT size FROM pages WHERE url = ?",
+                        (url,)).fetchone()
+                    self.total += len(data) - (row[0] if row else 0)
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                    (url, _to_unicode(term), sqlite3.Binary(data),
+                     len(data), now, now))
+                if self.max_bytes is not None and \
+                        self.total > self.max_bytes:
+                    self._evict()
+
+    def _evict(self):
+        """Delete the least recently used pages until under max_bytes."""
+        while self.total > self.max_bytes:
+            ## (a few at a time, rather than reading the whole index)
+            rows = self.connection.execute(
+                "SELECT url, size FROM pages ORDER BY used LIMIT 64"
+                ).fetchall()
+            if not rows:
+                self.total = 0
+                break
+            for url, size in rows:
+                self.connection.execute("DELETE FROM pages WHERE url = ?",
+                                        (url,))
+                self.total -= size
+                if self.total <= self.max_bytes:
+                    break
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.connection.close()
+
+def _to_unicode(text, encoding='utf-8'):
+    """Decode a byte string (leaving unicode and None as they are)."""
+    if isinstance(text, str):
+        return text.decode(encoding)
+    return text
+
+def fetch(url, term=None, cache=True):
+    """Download a page with the shared HttpClient.
+
+    Pages are looked up in (and added to) the response cache, if there is
+    one and cache is true. Missing pages are cached as empty ones.
+    """
+    if cache and response_cache is not None:
+        body = response_cache.get(url)
+        if body is not None:
+            record("cache_hits")
+            return body
+        record("cache_misses")
+        if response_cache.offline:
+            raise urllib2.URLError("%s is not in the cache" % url)
+    global http_client
+    if http_client is None:
+        http_client = HttpClient()
+    try:
+        body = http_client.get(url)
+    except urllib2.URLError, e:
+        record("errors")
+        ## remember missing pages too, as empty ones, so that they aren't
+        ## asked for again
+        if cache and response_cache is not None and missing_page(e):
+            response_cache.put(url, "", term)
+        raise
+    if cache and response_cache is not None:
+        response_cache.put(url, body, term)
+    return body
+
 class RowInTheLexicon(object):
     """One line in the input file.
 
@@ -98,6 +680,8 @@ class RowInTheLexicon(object):
         self.mandarin_cell = mandarin_cell
         self.index = 0
         self.whole = ''
+        self.stripped = ''
+        self.tokens = []
         self.searchable = []
         self.all_english = []
         self.english = ''
@@ -117,69 +701,83 @@ class RowInTheLexicon(object):
             pass
 
         #tokens = re.split('[；，（）;, ]', self.whole)
-        punct = ["；", "，", "（", "）", ";", ",", "(", ")", '"', "'"]
+        punct = [u"；", u"，", u"（", u"）", u";", u",", u"(", u")", u'"', u"'"]
         stripped = self.whole
         for i in punct:
             stripped = stripped.replace(i, " ")
 
         tokens = stripped.split(" ")
 
-        self.searchable.append(self.whole)
-        self.searchable.append(stripped)
-        for token in tokens:
-            if token != '':
-                self.searchable.append(token)
+        self.stripped = stripped
+        self.tokens = [token for token in tokens if token != '']
 
-        #while True:
-        for _ in range(1,3):
-            if len(self.searchable) >= 2:
-                if self.searchable[0] == self.searchable[1]:
-                    self.searchable = self.searchable[1:]
+        ## every distinct, non-empty term, in order
+        self.searchable = []
+        for term in [self.whole, stripped] + self.tokens:
+            if term.strip() and term not in self.searchable:
+                self.searchable.append(term)
+
+    def query_plan(self):
+        """Return the row's terms in the order they should be looked up.
+
+        Returns a list of stages, each a list of distinct terms: first the
+        whole cell (as is and without punctuation), then the single tokens
+        not already looked up. Later stages are only needed if the earlier
+        ones found no translation.
+        """
+        stages = []
+        seen = set()
+        for stage in ([self.whole, self.stripped], self.tokens):
+            terms = []
+            for term in stage:
+                if term.strip() and term not in seen:
+                    seen.add(term)
+                    terms.append(term)
+            if terms:
+                stages.append(terms)
+        return stages
 
 class WiktionaryEntry(object):
     """Entry on en.wiktionary.org for a Mandarin term."""
 
-    def __init__(self, mandarin_term):
+    def __init__(self, mandarin_term, base_url=wiktionary_url):
         """Initialize an object for a Mandarin term."""
         self.mandarin_term = mandarin_term
         self.english = []
         self.english_str = ', '.join(self.english)
         self.english_short = ''
-        self.address = "http://en.wiktionary.org/wiki/" + mandarin_term
+        self.base_url = base_url
+        ## the term is text, but the address goes on the wire as UTF-8
+        self.address = (base_url + "/wiki/" +
+                        _to_unicode(mandarin_term).encode("utf-8"))
+        self.section = None
 
     def check_page(self):
         """Load the actual wiktionary page for a term if it exists."""
         try:
-            #html = urllib.urlopen(self.address).read()
-            myopener = MyOpener()
-            html = myopener.open(self.address).read()
-            soup = Soup(html)
-
-            try:
-                box = soup.find(
+            html = fetch(self.address, self.mandarin_term)
+            with measure("parse"):
+                section = chinese_html(html)
+                box = Soup(section, html_parser, parse_only=SoupStrainer(
                     "table",
                     style=("border:1px solid #797979; margin-left: 1px; "
-                    "text-align:left; width:76%"))
-                links = box.find_all("a")
-
-                if len(links) > 0:
-                    self.address = "http://en.wiktionary.org" + links[0].get(
-                        "href")
-                    if self.address.endswith("#Chinese"):
-                        self.address = self.address[:-8]
-                else:
-                    pass
+                           "text-align:left; width:76%")))
+                link = box.find("a", href=True)
 
-            except AttributeError:
-                pass
+            if link is not None:
+                self.address = self.base_url + link.get("href")
+                if self.address.endswith("#Chinese"):
+                    self.address = self.address[:-8]
             else:
-                pass
-
-        except urllib2.HTTPError, e:
-            print e.code
+                ## get_translation needn't download the page again
+                self.section = section
 
         except urllib2.URLError, e:
-            print e.code
+            say(describe_error(self.address, e))
+            ## a term without a page has no translation, but any other
+            ## failure is passed on, so the term isn't taken for one
+            if not missing_page(e):
+                raise
 
         else:
             pass
@@ -187,118 +785,970 @@ class WiktionaryEntry(object):
     def get_translation(self):
         """Find the translation of a Mandarin term from Wiktionary."""
         try:
-            #html = urllib.urlopen(self.address).read()
-            myopener = MyOpener()
-            html = myopener.open(self.address).read()
-            soup = Soup(html)
+            if self.section is None:
+                html = fetch(self.address, self.mandarin_term)
+                with measure("parse"):
+                    self.section = chinese_html(html)
+            with measure("parse"):
+                self.read_definitions(html_definitions(self.section))
+
+        except urllib2.URLError, e:
+            say(describe_error(self.address, e))
+            if not missing_page(e):
+                raise
+
+        else:
+            pass
+
+    def read_wikitext(self, wikitext):
+        """Find the translation of a Mandarin term in a page's wikitext.
+
+        This is the counterpart of get_translation for the MediaWiki API:
+        the definitions are the first list of the page's Chinese (or
+        Mandarin) section.
+        """
+        self.read_definitions(wikitext_definitions(wikitext))
+
+    def read_definitions(self, definitions):
+        """Take the translation of a Mandarin term from a list of definitions."""
+        for definition in definitions:
+            if not self.english:
+                self.english_short = definition.replace(";", ",")
+            self.english.append(definition)
+
+## the heading of a page's Chinese (or Mandarin) section, and the heading
+## of the next language, in its HTML
+_html_section_start = re.compile(r'id="(?:Chinese|Mandarin)"')
+_html_next_language = re.compile(r"<h2[\s>]")
+
+def chinese_html(html):
+    """Return the Chinese (or Mandarin) section of a page's HTML.
+
+    The section is cut out of the page before parsing, so the rest of a
+    page (often most of it) is never parsed at all. Returns '' if the page
+    has no such section.
+    """
+    start = _html_section_start.search(html)
+    if start is None:
+        return html[:0]
+    end = _html_next_language.search(html, start.end())
+    return html[start.end():end.start() if end else len(html)]
+
+def html_definitions(section):
+    """Return the definitions in the HTML of a Chinese (or Mandarin) section.
+
+    Like read_wikitext, only the first line of each item of the section's
+    first definition list is taken.
+    """
+    definition = Soup(section, html_parser,
+                      parse_only=SoupStrainer("ol")).find("ol")
+    if definition is None:
+        return []
+    return [item.text.split("\n")[0]
+            for item in definition.find_all("li", recursive=False)]
+
+def benchmark_extraction(paths, repeat=5):
+    """Time extracting definitions from saved pages.
+
+    Returns the seconds per pass over the pages for parsing whole pages
+    (as the scraper used to) and for html_definitions on the cut-out
+    Chinese sections.
+    """
+    pages = []
+    for path in paths:
+        with open(path, "rb") as page:
+            pages.append(page.read())
+
+    def whole_pages():
+        for html in pages:
+            Soup(html, html_parser).find("ol")
 
+    def sections():
+        for html in pages:
+            html_definitions(chinese_html(html))
+
+    timings = []
+    for run in (whole_pages, sections):
+        best = None
+        for _ in range(repeat):
+            started = time.time()
+            run()
+            elapsed = time.time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings.append(best)
+    return tuple(timings)
+
+## language sections, definitions and markup in a page's wikitext
+_language_heading = re.compile(r"^==\s*([^=]+?)\s*==\s*$", re.M)
+_definition = re.compile(r"^#(?![:*#])\s*(.*)$")
+_zh_see = re.compile(r"\{\{zh-see\|([^|}]+)")
+_wiki_link = re.compile(r"\[\[(?:[^\]|]*\|)?([^\]|]*)\]\]")
+_template = re.compile(r"\{\{([^{}]*)\}\}")
+_ref = re.compile(r"<ref[^>]*/>|<ref[^>]*>.*?</ref>", re.S)
+_html_tag = re.compile(r"<[^>]+>")
+
+def chinese_section(wikitext):
+    """Return the Chinese (or Mandarin) section of a page's wikitext."""
+    headings = list(_language_heading.finditer(wikitext))
+    for number, heading in enumerate(headings):
+        if heading.group(1) in ("Chinese", "Mandarin"):
+            end = (headings[number + 1].start()
+                   if number + 1 < len(headings) else len(wikitext))
+            return wikitext[heading.end():end]
+    return ""
+
+def zh_see_target(wikitext):
+    """Return the term a Chinese section refers to with {{zh-see}}, if any."""
+    match = _zh_see.search(chinese_section(wikitext))
+    if match:
+        return match.group(1).strip()
+    return None
+
+def _render_template(match):
+    """Render a template roughly as Wiktionary shows it in definitions."""
+    parts = match.group(1).split("|")
+    name = parts[0].strip()
+    args = [arg.strip() for arg in parts[1:] if "=" not in arg]
+    if name in ("lb", "lbl", "label", "term-label", "tlb"):
+        labels = [arg for arg in args[1:] if arg not in ("", "_", "and", "or")]
+        return "(%s)" % ", ".join(labels) if labels else ""
+    if name in ("q", "qual", "qualifier", "i", "qf", "gloss", "gl"):
+        return "(%s)" % ", ".join(args) if args else ""
+    if name in ("l", "m", "l-self", "ll") and len(args) > 1:
+        return args[2] if len(args) > 2 and args[2] else args[1]
+    if name in ("zh-l", "zh-m") and args:
+        return args[0].split("/")[0]
+    if name in ("w", "taxlink", "vern", "taxfmt") and args:
+        return args[0]
+    return ""
+
+def wikitext_to_text(wikitext):
+    """Strip links, templates and formatting from a line of wikitext."""
+    text = _ref.sub("", wikitext)
+    text = _wiki_link.sub(r"\1", text)
+    while True:
+        text, count = _template.subn(_render_template, text)
+        if not count:
+            break
+    text = _html_tag.sub("", text.replace("'''", "").replace("''", ""))
+    return " ".join(text.split())
+
+def wikitext_definitions(wikitext):
+    """Return the definitions in a page's Chinese (or Mandarin) section.
+
+    Like get_translation, only the section's first definition list is
+    read, and only its top-level definitions.
+    """
+    definitions = []
+    for line in chinese_section(wikitext).splitlines():
+        if line.startswith("#"):
+            match = _definition.match(line)
+            if match:
+                definitions.append(wikitext_to_text(match.group(1)))
+        elif definitions:
+            break
+    return definitions
+
+class HtmlBackend(object):
+    """Looks terms up by downloading their rendered Wiktionary pages."""
+
+    def __init__(self, base_url=wiktionary_url):
+        """Initialize a backend for the Wiktionary at base_url."""
+        self.base_url = base_url
+
+    def lookup(self, term):
+        """Return the WiktionaryEntry for a term, with its translation.
+
+        Raises urllib2.URLError if a page can't be downloaded (unless
+        there is no such page).
+        """
+        wiki = WiktionaryEntry(term, self.base_url)
+        wiki.check_page()
+        wiki.get_translation()
+        return wiki
+
+class _ApiBatch(object):
+    """Titles waiting to be sent to the MediaWiki API in one query."""
+
+    def __init__(self):
+        """Initialize an empty batch."""
+        self.titles = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.wikitexts = {}
+        self.error = None
+
+class ApiBackend(object):
+    """Looks terms up through the MediaWiki action API, in batches.
+
+    Terms that worker threads look up at about the same time are sent
+    together, up to batch_size titles per query, and the API resolves
+    redirects itself, so a term costs a fraction of one request instead of
+    two page downloads. Chinese sections that only refer to another term
+    with {{zh-see}} are followed once, as check_page does.
+    """
+
+    def __init__(self, base_url=wiktionary_url, batch_size=API_BATCH_SIZE,
+                 max_delay=API_BATCH_DELAY):
+        """Initialize a backend for the Wiktionary at base_url."""
+        self.base_url = base_url
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.batch = None
+
+    def lookup(self, term):
+        """Return the WiktionaryEntry for a term, with its translation.
+
+        Raises urllib2.URLError if the API can't be reached.
+        """
+        wiki = WiktionaryEntry(term, self.base_url)
+        wikitext = self.wikitext(term)
+        with measure("parse"):
+            target = zh_see_target(wikitext)
+        if target is not None:
+            wiki.address = (self.base_url + "/wiki/" +
+                            _to_unicode(target).encode("utf-8"))
+            wikitext = self.wikitext(target)
+        with measure("parse"):
+            wiki.read_wikitext(wikitext)
+        return wiki
+
+    def title_url(self, title):
+        """Return the query URL for one title (used as its cache key)."""
+        return self.query_url([title])
+
+    def query_url(self, titles, continued=None):
+        """Return the query URL for the wikitext of some titles.
+
+        continued is the "continue" part of the previous reply, when the
+        wikitext didn't all fit in it.
+        """
+        params = [("action", "query"), ("format", "json"),
+                  ("formatversion", "2"), ("prop", "revisions"),
+                  ("rvprop", "content"), ("rvslots", "main"),
+                  ("redirects", "1"),
+                  ("titles", "|".join(_to_unicode(title).encode("utf-8")
+                                      for title in titles))]
+        for name, value in sorted((continued or {}).items()):
+            params.append((name, _to_unicode(value).encode("utf-8")))
+        return self.base_url + "/w/api.php?" + urllib.urlencode(params)
+
+    def wikitext(self, title):
+        """Return a title's wikitext ('' if there is no such page).
+
+        The title is looked up in the response cache first; otherwise it
+        joins the current batch, and the first thread to join a batch
+        sends it once it is full or max_delay has passed. Raises
+        urllib2.URLError if the query failed or its reply left the title
+        out.
+        """
+        title = _to_unicode(title)
+        if response_cache is not None:
+            cached = response_cache.get(self.title_url(title))
+            if cached is not None:
+                record("cache_hits")
+                return cached.decode("utf-8")
+            record("cache_misses")
+            if response_cache.offline:
+                return ""
+
+        with self.lock:
+            batch = self.batch
+            sending = batch is None
+            if sending:
+                batch = self.batch = _ApiBatch()
+            batch.titles.append(title)
+            if len(batch.titles) >= self.batch_size:
+                self.batch = None
+                batch.full.set()
+
+        if sending:
+            batch.full.wait(self.max_delay)
+            with self.lock:
+                if self.batch is batch:
+                    self.batch = None
             try:
-                heading = soup.find(
-                    "span", {"class": "mw-headline",
-                             "id": ["Chinese", "Mandarin"]})
+                batch.wikitexts = self.query(batch.titles)
+            except urllib2.URLError, e:
+                batch.error = e
+                raise
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+        if title not in batch.wikitexts:
+            say("No wikitext for %s in the reply" % title.encode("utf-8"))
+            raise urllib2.URLError("no wikitext for %s in the reply" %
+                                   title.encode("utf-8"))
+        return batch.wikitexts[title]
 
-                definition = heading.find_next("ol")
+    def query(self, titles):
+        """Fetch the wikitext of some titles, in as few requests as it takes.
 
-                new_def = definition.li
+        A reply holds only as much wikitext as the API's size limit allows;
+        the rest is asked for again with the reply's "continue" parameters
+        until none are left. Returns a dict of title -> wikitext, following
+        the normalizations and redirects the API reports back to the titles
+        asked for ('' for a missing page). A title whose page came back
+        without wikitext nor as missing is left out (and isn't cached).
+        Raises urllib2.URLError if a request fails or its reply isn't JSON.
+        """
+        titles = list(OrderedDict.fromkeys(titles))
+        renamed = {}
+        pages = {}
+        continued = None
+        while True:
+            url = self.query_url(titles, continued)
+            try:
+                ## each title is cached under its own URL (see wikitext),
+                ## so the batch itself isn't
+                reply = json.loads(fetch(url, cache=False))
+            except urllib2.URLError, e:
+                say(describe_error(url, e))
+                raise
+            except ValueError, e:
+                say("%s for %s" % (e, url))
+                raise urllib2.URLError("%s for %s" % (e, url))
 
-                self.english.append(new_def.text.split("\n")[0])
-                self.english_short = new_def.text.split(
-                    "\n")[0].replace(";", ",")
+            query = reply.get("query", {})
+            for rename in (query.get("normalized", []) +
+                           query.get("redirects", [])):
+                renamed[rename["from"]] = rename["to"]
+            for page in query.get("pages", []) + query.get("interwiki", []):
+                if (page.get("missing") or page.get("invalid") or
+                        "iw" in page):
+                    pages[page["title"]] = ""
+                elif page.get("revisions"):
+                    pages[page["title"]] = page["revisions"][0].get(
+                        "slots", {}).get("main", {}).get("content", "")
+            continued = reply.get("continue")
+            if not continued:
+                break
 
-                if new_def.next_sibling.next_sibling:
-                    while True:
-                        newer_def = new_def.next_sibling.next_sibling
-                        self.english.append(newer_def.text.split("\n")[0])
+        wikitexts = {}
+        for title in titles:
+            name = title
+            for _ in range(3):
+                if name not in renamed:
+                    break
+                name = renamed[name]
+            if name not in pages:
+                continue
+            wikitexts[title] = pages[name]
+            if response_cache is not None:
+                response_cache.put(self.title_url(title),
+                                   wikitexts[title].encode("utf-8"), title)
+        return wikitexts
 
-                        new_def = newer_def
+class DumpIndex(object):
+    """Index of the Chinese entries in a Wiktionary XML dump, in SQLite.
 
-            except AttributeError:
-                pass
-            else:
-                pass
+    Only the definitions of each page's Chinese (or Mandarin) section are
+    kept, along with the term that a section or a redirect refers to, so
+    the index is a small fraction of the size of the dump.
+    """
 
-        except urllib2.HTTPError, e:
-            print e.code
+    def __init__(self, path):
+        """Open (or create) the index database at path."""
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "term TEXT PRIMARY KEY, definitions TEXT, see TEXT)")
 
-        except urllib2.URLError, e:
-            print e.code
+    def build(self, dump_path, batch_size=1000):
+        """Add the Chinese entries in the dump at dump_path to the index.
 
+        The dump (optionally compressed with bzip2) is read one page at a
+        time, so memory use doesn't grow with its size. Returns the number
+        of entries added.
+        """
+        if dump_path.endswith(".bz2"):
+            dump = bz2.BZ2File(dump_path)
         else:
+            dump = open(dump_path, "rb")
+        rows = []
+        added = 0
+        try:
+            pages = ElementTree.iterparse(dump, events=("start", "end"))
+            event, root = next(pages)
+            for event, element in pages:
+                if event != "end" or _local_name(element.tag) != "page":
+                    continue
+                row = _dump_row(element)
+                ## pages are done with once read; clearing the root
+                ## drops them from the tree as well
+                root.clear()
+                if row is None:
+                    continue
+                rows.append(row)
+                if len(rows) >= batch_size:
+                    added += self._insert(rows)
+                    rows = []
+            added += self._insert(rows)
+        finally:
+            dump.close()
+        return added
+
+    def _insert(self, rows):
+        """Store (term, definitions, see) rows."""
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def get(self, term):
+        """Return the (definitions, see) of a term, or None."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT definitions, see FROM entries WHERE term = ?",
+                (_to_unicode(term),)).fetchone()
+        if row is None:
+            return None
+        definitions, see = row
+        return (definitions.split("\n") if definitions else []), see
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.connection.close()
+
+def _local_name(tag):
+    """Return an XML tag without its namespace."""
+    return tag.rsplit("}", 1)[-1]
+
+def _dump_row(page):
+    """Return the (term, definitions, see) row for a dump page, or None.
+
+    Only main namespace pages with a Chinese (or Mandarin) section, and
+    redirects, are kept.
+    """
+    title = namespace = text = redirect = None
+    for element in page.iter():
+        name = _local_name(element.tag)
+        if name == "title":
+            title = element.text
+        elif name == "ns":
+            namespace = element.text
+        elif name == "redirect":
+            redirect = element.get("title")
+        elif name == "text":
+            text = element.text or ""
+    if title is None or namespace not in (None, "0"):
+        return None
+    if redirect is not None:
+        return title, "", redirect
+    if text is None or not chinese_section(text):
+        return None
+    return (title, "\n".join(wikitext_definitions(text)),
+            zh_see_target(text))
+
+class IndexBackend(object):
+    """Looks terms up in a DumpIndex, without using the network."""
+
+    def __init__(self, index, base_url=wiktionary_url):
+        """Initialize a backend answering from index."""
+        self.index = index
+        self.base_url = base_url
+
+    def lookup(self, term):
+        """Return the WiktionaryEntry for a term, with its translation."""
+        wiki = WiktionaryEntry(term, self.base_url)
+        entry = self.index.get(term)
+        ## follow a redirect or {{zh-see}}, then a redirect from there
+        for _ in range(2):
+            if entry is None or entry[1] is None:
+                break
+            wiki.address = self.base_url + "/wiki/" + entry[1].encode("utf-8")
+            entry = self.index.get(entry[1])
+        if entry is not None:
+            wiki.read_definitions(entry[0])
+        return wiki
+
+def format_translation(wiki, term):
+    """Return a Wiktionary entry's translation of a term as output text.
+
+    Returns '' if the entry has no usable translation.
+    """
+    ## Delete some common Wiktionary entry prefixes:
+
+    if wiki.english_short.startswith(
+            "(Advanced Mandarin) "):
+        wiki.english_short = wiki.english_short[20:]
+
+    if wiki.english_short.startswith(
+            "(Elementary Mandarin) "):
+        wiki.english_short = wiki.english_short[22:]
+
+    if wiki.english_short.startswith(
+            "(Beginning Mandarin) "):
+        wiki.english_short = wiki.english_short[21:]
+
+    if wiki.english_short.startswith(u"† "):
+        wiki.english_short = wiki.english_short[2:] + \
+                             " [obsolete]"
+
+    if wiki.english_short != '':
+        if not wiki.english_short.startswith(
+                "This entry needs a definition. " \
+                "Please add one, then remove"):
+            return u"%s (%s), " % (wiki.english_short, term)
+    return u''
+
+class TermResolver(object):
+    """Looks up each distinct term once, however many rows it's in.
+
+    Translations are remembered (up to max_terms of them, the least
+    recently used being forgotten first), and a term that another thread
+    is already looking up is waited for rather than looked up again. A
+    lookup that fails on a network error gives '' but isn't remembered,
+    so the term is looked up again the next time it comes up.
+    """
+
+    def __init__(self, backend, max_terms=DEFAULT_MAX_TERMS):
+        """Initialize a resolver looking terms up with backend.
+
+        backend is an HtmlBackend, an ApiBackend or an IndexBackend.
+        """
+        self.backend = backend
+        self.max_terms = max_terms
+        self.memo = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.reused = 0
+
+    def resolve(self, term):
+        """Return a term's translation as output text ('' if none)."""
+        return self.try_resolve(term)[0]
+
+    def try_resolve(self, term):
+        """Return a term's translation and whether the lookup went through.
+
+        The translation is '' if the term has none, or if its lookup
+        failed on a network error (and then the second item is False).
+        """
+        with self.lock:
+            if term in self.memo:
+                self.reused += 1
+                translation = self.memo.pop(term)
+                self.memo[term] = translation
+                return translation, True
+            event = self.pending.get(term)
+            if event is None:
+                event = self.pending[term] = threading.Event()
+                event.translation = ''
+                event.found = False
+                looking_up = True
+            else:
+                self.reused += 1
+                looking_up = False
+
+        if not looking_up:
+            event.wait()
+            return event.translation, event.found
+
+        try:
+            event.translation = self.lookup(term)
+            event.found = True
+        except urllib2.URLError:
+            ## (the backend has printed the error)
             pass
+        finally:
+            with self.lock:
+                del self.pending[term]
+                if event.found:
+                    self.memo[term] = event.translation
+                    if len(self.memo) > self.max_terms:
+                        self.memo.popitem(last=False)
+            event.set()
+        return event.translation, event.found
 
+    def lookup(self, term):
+        """Look a term up on Wiktionary and return its translation."""
+        global pages_crawled
+        wiki = self.backend.lookup(term)
+        with pages_crawled_lock:
+            pages_crawled += 1
+            if show_progress:
+                say(pages_crawled)
+        with self.lock:
+            self.lookups += 1
+        return format_translation(wiki, term)
 
-def main():
-    global pages_crawled
-    with codecs.open(results_file, "a", encoding="utf-8") as stream:
-        with codecs.open(input_file, mode="r", encoding="utf-8") as myitems:
-            items = myitems.readlines()
-            for item in items:
-                if item.startswith("Index"):
-                    pass
-                else:
-                    myrow = RowInTheLexicon(item.encode('utf-8'))
-                    myrow.get_lexicon_info(item.encode('utf-8')),
-
-                    stream.write("\n%s;" % str(myrow.index)),
-
-                    for term in myrow.searchable:
-
-                        wiki = WiktionaryEntry(term)
-                        wiki.check_page()
-                        wiki.get_translation()
-                        pages_crawled += 1
-                        print pages_crawled
-
-                        ## Delete some common Wiktionary entry prefixes:
-
-                        if wiki.english_short.startswith(
-                                "(Advanced Mandarin) "):
-                            wiki.english_short = wiki.english_short[20:]
-
-                        if wiki.english_short.startswith(
-                                "(Elementary Mandarin) "):
-                            wiki.english_short = wiki.english_short[22:]
-
-                        if wiki.english_short.startswith(
-                                "(Beginning Mandarin) "):
-                            wiki.english_short = wiki.english_short[21:]
-
-                        if wiki.english_short.startswith(u"† "):
-                            wiki.english_short = wiki.english_short[2:] + \
-                                                 " [obsolete]"
-
-                        if wiki.english_short != '':
-                            if not wiki.english_short.startswith(
-                                    "This entry needs a definition. " \
-                                    "Please add one, then remove"):
-                                try:
-                                    stream.write("%s (%s), " % (
-                                        wiki.english_short.decode('utf-8'),
-                                        term.decode('utf-8'))),
-                                except UnicodeDecodeError:
-                                    stream.write(
-                                        "UnicodeDecodeError (%s)" % term.decode(
-                                            'utf-8'))
-                                except UnicodeEncodeError:
-                                    stream.write(
-                                        "UnicodeEncodeError (%s)" % term.decode(
-                                            'utf-8'))
-                                else:
-                                    pass
-                            else:
-                                pass
-
-                    ## wait a few seconds between searches--we don't
-                    ## want to overload the server
-                    delay = random.randint(0,4)
-                    time.sleep(delay)
-
-                    ## longer wait after 100 pages
-                    if pages_crawled % 100:
-                        long_delay = random.randint(11,29)
-                        time.sleep(long_delay)
+def translate_row(item, resolver):
+    """Look up the terms of an input line and return the output line."""
+    myrow = RowInTheLexicon(item)
+    myrow.get_lexicon_info(item)
+
+    translations = gloss_row(myrow, resolver)
+    observe("definitions", sum(1 for translation in translations
+                               if translation))
+    return u"".join([u"\n%d;" % myrow.index] + translations)
+
+def gloss_row(myrow, resolver, failed=None):
+    """Look up the terms of a row and return their translations.
+
+    The terms are looked up stage by stage (see query_plan), stopping at
+    the first stage that finds a translation. Terms without a translation
+    give ''. With failed (a list), the terms whose lookup failed on a
+    network error are appended to it.
+    """
+    translations = []
+    for stage in myrow.query_plan():
+        for term in stage:
+            translation, found = resolver.try_resolve(term)
+            translations.append(translation)
+            if not found and failed is not None:
+                failed.append(term)
+        if any(translations):
+            break
+    return translations
+
+def read_rows(lines, start=0):
+    """Yield the (position, line) of each row of the input, lazily.
+
+    The header line is skipped, and so are the rows before start.
+    """
+    position = 0
+    for line in lines:
+        if line.startswith(u"Index"):
+            continue
+        if position >= start:
+            yield position, line
+        position += 1
+
+class Checkpoint(object):
+    """How far a crawl has got, kept in a small JSON file for --resume.
+
+    Records how many rows of the input have been written to the output,
+    and how long the output was then. The file is replaced atomically, and
+    only after the output has been flushed to disk, so it never claims a
+    row that isn't safely written.
+    """
+
+    def __init__(self, path, input_path):
+        """Initialize a checkpoint at path for the input at input_path."""
+        self.path = path
+        self.input_path = input_path
+
+    def load(self):
+        """Return the rows done and the output length, or None.
+
+        Returns None if there is no checkpoint, or if it was made for
+        another input (or the input has changed since).
+        """
+        try:
+            with open(self.path, "rb") as checkpoint:
+                state = json.load(checkpoint)
+        except (IOError, ValueError):
+            return None
+        if (state.get("input") != self.input_path or
+                state.get("input_size") != os.path.getsize(self.input_path)):
+            return None
+        return state["rows"], state["offset"]
+
+    def save(self, rows, offset):
+        """Record that rows rows are done, with the output offset long."""
+        state = {"input": self.input_path,
+                 "input_size": os.path.getsize(self.input_path),
+                 "rows": rows, "offset": offset}
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as checkpoint:
+            json.dump(state, checkpoint)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.rename(temporary, self.path)
+
+class ReorderBuffer(object):
+    """Writes rows finished out of order in input order.
+
+    A finished row waits until every row before it has been written. Every
+    checkpoint_every rows written, the output is flushed to disk and the
+    checkpoint (if any) updated.
+    """
+
+    def __init__(self, stream, start=0, checkpoint=None,
+                 checkpoint_every=DEFAULT_CHECKPOINT_EVERY):
+        """Initialize a buffer whose next row to write is row start."""
+        self.stream = stream
+        self.next_position = start
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.finished = {}
+        self.unflushed = 0
+
+    def add(self, position, line):
+        """Take a finished row, writing it and any rows now in order."""
+        self.finished[position] = line
+        while self.next_position in self.finished:
+            self.stream.write(self.finished.pop(self.next_position))
+            self.next_position += 1
+            self.unflushed += 1
+        if self.unflushed >= self.checkpoint_every:
+            self.flush()
+
+    def flush(self):
+        """Flush the rows written so far to disk and update the checkpoint."""
+        self.stream.flush()
+        os.fsync(self.stream.fileno())
+        if self.checkpoint is not None:
+            self.checkpoint.save(self.next_position, self.stream.tell())
+        self.unflushed = 0
+
+    def __len__(self):
+        """Return the number of rows waiting for earlier ones."""
+        return len(self.finished)
+
+def crawl(rows, stream, resolver, workers=DEFAULT_WORKERS, start=0,
+          checkpoint=None, checkpoint_every=DEFAULT_CHECKPOINT_EVERY,
+          max_pending=None):
+    """Translate input rows on worker threads, writing them in order.
+
+    rows yields (position, line) pairs (see read_rows), starting at
+    position start; the rows before start were done by an earlier run.
+    A reader thread takes rows from rows, workers threads look them up and
+    the calling thread writes them out through a ReorderBuffer, recording
+    the progress in checkpoint, if given.
+
+    At most max_pending rows (by default four per worker) are read but not
+    yet written at any time, so a slow lookup holds the reader back rather
+    than letting rows pile up in memory, however long the input is.
+    Returns the number of rows written.
+    """
+    if max_pending is None:
+        max_pending = workers * 4
+    tasks = Queue.Queue(maxsize=workers * 2)
+    results = Queue.Queue()
+    pending = threading.Semaphore(max_pending)
+
+    def read():
+        for row in rows:
+            pending.acquire()
+            tasks.put(row)
+        for _ in range(workers):
+            tasks.put(None)
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is None:
+                results.put(None)
+                break
+            position, item = task
+            try:
+                results.put((position, translate_row(item, resolver), None))
+            except Exception, e:
+                results.put((position, None, e))
+
+    threads = [threading.Thread(target=read)]
+    threads += [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    buffer = ReorderBuffer(stream, start, checkpoint, checkpoint_every)
+    ## replace any checkpoint left by an earlier run right away
+    buffer.flush()
+    working = workers
+    try:
+        while working:
+            ## a timeout makes the wait interruptible with Ctrl-C
+            result = results.get(True, 86400)
+            if result is None:
+                working -= 1
+                continue
+            position, line, error = result
+            if error is not None:
+                raise error
+            written = buffer.next_position
+            buffer.add(position, line)
+            for _ in range(buffer.next_position - written):
+                pending.release()
+    finally:
+        ## whatever was written in order is done, even after an error
+        buffer.flush()
+
+    for thread in threads:
+        thread.join()
+    return buffer.next_position - start
+
+def main(workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+         base_url=wiktionary_url, cache_path=cache_file,
+         cache_ttl=DEFAULT_CACHE_TTL, cache_max_mb=None, offline=False,
+         backend="html", index_path=index_file, retries=DEFAULT_RETRIES,
+         resume=False, checkpoint_path=checkpoint_file,
+         checkpoint_every=DEFAULT_CHECKPOINT_EVERY, metrics_path=None,
+         metrics_interval=DEFAULT_METRICS_INTERVAL):
+    """Translate input_file, appending the results to results_file.
+
+    Requests are spread over workers threads and limited to rate requests
+    per second (in bursts of up to burst) to each host. Pages are cached in
+    cache_path (unless it is None) for cache_ttl days, up to cache_max_mb
+    megabytes; offline, only cached pages are used. backend is "html" to
+    download rendered pages, "api" to use the MediaWiki API or "index" to
+    use the dump index at index_path. Failed requests are retried up to
+    retries times.
+
+    Progress is recorded in checkpoint_path every checkpoint_every rows;
+    with resume, the rows done by an earlier run are skipped, and anything
+    it wrote after its last checkpoint is removed from results_file.
+
+    A summary of the crawl's metrics is printed at the end, and if
+    metrics_path is given they are appended to it as JSON lines every
+    metrics_interval seconds.
+    """
+    global rate_limiter, response_cache, http_client, metrics
+    metrics = CrawlMetrics()
+    exporter = None
+    if metrics_path is not None:
+        exporter = MetricsExporter(metrics, metrics_path, metrics_interval)
+        exporter.start()
+    rate_limiter = HostRateLimiter(rate, burst)
+    http_client = HttpClient(retries)
+    if cache_path is not None:
+        response_cache = ResponseCache(
+            cache_path,
+            ttl=cache_ttl * 86400 if cache_ttl is not None else None,
+            max_bytes=cache_max_mb * 1000000 if cache_max_mb else None,
+            offline=offline)
+    index = None
+    checkpoint = Checkpoint(checkpoint_path, input_file)
+    start = 0
+    if resume:
+        state = checkpoint.load()
+        if state is None:
+            print "No checkpoint for %s; starting from the beginning" % (
+                input_file)
+        else:
+            start, offset = state
+            with open(results_file, "r+b") as results:
+                results.truncate(offset)
+            print "Resuming after %d rows" % start
+    try:
+        with codecs.open(results_file, "a", encoding="utf-8") as stream:
+            if backend == "index":
+                index = DumpIndex(index_path)
+                resolver = TermResolver(IndexBackend(index, base_url))
+            elif backend == "api":
+                resolver = TermResolver(ApiBackend(base_url))
+            else:
+                resolver = TermResolver(HtmlBackend(base_url))
+            with io.open(input_file, encoding="utf-8") as lines:
+                written = crawl(read_rows(lines, start), stream, resolver,
+                                workers, start, checkpoint, checkpoint_every)
+            print "%d rows, %d terms looked up, %d lookups saved" % (
+                written, resolver.lookups, resolver.reused)
+            print metrics.summary()
+    finally:
+        if response_cache is not None:
+            response_cache.close()
+        if index is not None:
+            index.close()
+        http_client.close()
+        if exporter is not None:
+            exporter.stop()
 
 if __name__ == "__main__":
-    ## counter to track the number of pages crawled
-    pages_crawled = 0
-    main()
+    parser = argparse.ArgumentParser(
+        description=("Translate the Mandarin glosses in %s into English, "
+                     "appending them to %s." % (input_file, results_file)))
+    parser.add_argument('--workers', type=int, default=None,
+                        help=("rows looked up at the same time (default: "
+                              "%d, or %d with --backend api)" % (
+                                  DEFAULT_WORKERS, API_BATCH_SIZE)))
+    parser.add_argument('--backend', choices=["html", "api", "index"],
+                        default="html",
+                        help=("download rendered pages (html), query "
+                              "the MediaWiki API for up to %d terms at once "
+                              "(api), or use the dump index (index) "
+                              "(default: %%(default)s)" % API_BATCH_SIZE))
+    parser.add_argument('--index', default=index_file,
+                        help=("SQLite file holding the index of a "
+                              "Wiktionary dump (default: %(default)s)"))
+    parser.add_argument('--resume', action='store_true',
+                        help=("skip the rows done by an earlier, "
+                              "interrupted run"))
+    parser.add_argument('--checkpoint', default=checkpoint_file,
+                        help=("file recording how far the crawl has got "
+                              "(default: %(default)s)"))
+    parser.add_argument('--checkpoint-every', type=int,
+                        default=DEFAULT_CHECKPOINT_EVERY,
+                        help=("rows written between checkpoints "
+                              "(default: %(default)s)"))
+    parser.add_argument('--metrics', metavar='FILE',
+                        help=("append the crawl's metrics to FILE as JSON "
+                              "lines every --metrics-interval seconds"))
+    parser.add_argument('--metrics-interval', type=float,
+                        default=DEFAULT_METRICS_INTERVAL,
+                        help=("seconds between metrics lines "
+                              "(default: %(default)s)"))
+    parser.add_argument('--benchmark', metavar='DIR',
+                        help=("time extracting definitions from the pages "
+                              "saved in DIR (e.g. fixtures/wiki, or pages "
+                              "written by ../Benchmarks/benchmarks.py "
+                              "--save-pages) and exit"))
+    parser.add_argument('--build-index', metavar='DUMP',
+                        help=("index the Chinese entries of a Wiktionary "
+                              "XML dump (.xml or .xml.bz2) and exit"))
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help=("requests per second to each host "
+                              "(default: %(default)s)"))
+    parser.add_argument('--burst', type=int, default=DEFAULT_BURST,
+                        help=("requests sent at once after an idle spell "
+                              "(default: %(default)s)"))
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help=("times a request is retried after a "
+                              "connection error, 429 or 5xx response "
+                              "(default: %(default)s)"))
+    parser.add_argument('--base-url', default=wiktionary_url,
+                        help=("Wiktionary address, e.g. a local test server "
+                              "(default: %(default)s)"))
+    parser.add_argument('--cache', default=cache_file,
+                        help=("SQLite file in which downloaded pages are "
+                              "cached (default: %(default)s)"))
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't cache downloaded pages")
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_CACHE_TTL,
+                        help=("days a cached page is used before it is "
+                              "downloaded again (default: %(default)s)"))
+    parser.add_argument('--cache-max-mb', type=float, default=None,
+                        help=("size above which the least recently used "
+                              "pages are deleted from the cache"))
+    parser.add_argument('--offline', action='store_true',
+                        help="only use cached pages; download nothing")
+    args = parser.parse_args()
+    if args.no_cache and args.offline:
+        parser.error("--offline needs the cache")
+    if args.benchmark:
+        paths = [os.path.join(args.benchmark, name)
+                 for name in sorted(os.listdir(args.benchmark))]
+        paths = [path for path in paths if os.path.isfile(path)]
+        whole, section = benchmark_extraction(paths)
+        print "%d pages (%s): whole pages %.1f ms, sections %.1f ms" % (
+            len(paths), html_parser, whole * 1000, section * 1000)
+        parser.exit()
+    if args.build_index:
+        index = DumpIndex(args.index)
+        try:
+            print "%d entries indexed in %s" % (
+                index.build(args.build_index), args.index)
+        finally:
+            index.close()
+        parser.exit()
+    if args.workers is None:
+        args.workers = default_workers(args.backend)
+    main(args.workers, args.rate, args.burst, args.base_url,
+         cache_path=None if args.no_cache else args.cache,
+         cache_ttl=args.cache_ttl, cache_max_mb=args.cache_max_mb,
+         offline=args.offline, backend=args.backend, index_path=args.index,
+         retries=args.retries, resume=args.resume,
+         checkpoint_path=args.checkpoint,
+         checkpoint_every=args.checkpoint_every, metrics_path=args.metrics,
+         metrics_interval=args.metrics_interval)